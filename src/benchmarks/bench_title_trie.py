@@ -0,0 +1,57 @@
+# src/benchmarks/bench_title_trie.py
+
+import os
+import sys
+import time
+import random
+import tracemalloc
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from rewrite_links_with_uid_alias import build_title_trie, PREFIX_MATCH_MIN_BYTES
+
+
+def synthetic_entries(n: int, seed: int = 0):
+    """產生 n 筆 (key, uid, full_sentence)：full_sentence 約 120 字元、key 為約 64 字元的截斷。"""
+    rng = random.Random(seed)
+    words = ["memory", "city", "deity", "realm", "countdown", "protagonist", "whiteboard", "card", "dimension", "barrier"]
+    for i in range(1, n + 1):
+        full = " ".join(rng.choice(words) for _ in range(16)) + f" #{i}."
+        yield f"{full[:64].rstrip()} {i}", f"uid_{i:03d}", full
+
+
+def main(n: int = 100_000) -> None:
+    print(f"🔎 前綴樹基準：{n} 筆\n")
+    entries = list(synthetic_entries(n))
+
+    # 記憶體與建樹時間分開量（tracemalloc 會拖慢建樹）
+    tracemalloc.start()
+    trie = build_title_trie(entries, PREFIX_MATCH_MIN_BYTES)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del trie
+    t0 = time.perf_counter()
+    trie = build_title_trie(entries, PREFIX_MATCH_MIN_BYTES)
+    elapsed = time.perf_counter() - t0
+    print(f"build              {elapsed:6.3f}s  retained={current / 2**20:7.2f} MiB  strings={len(trie)}")
+
+    # 模擬連結：以不同位元組數截斷的 full_sentence（70 bytes、97 bytes）與不存在的標題
+    rng = random.Random(1)
+    links = []
+    for _, _, full in rng.sample(entries, min(n, 50_000)):
+        links.append(full[:70])
+        links.append(full[:97])
+        links.append("nothing like this title exists in the vault " + full[:20])
+
+    t0 = time.perf_counter()
+    resolved = ambiguous = 0
+    for link in links:
+        key, candidates = trie.resolve(link)
+        resolved += key is not None
+        ambiguous += bool(candidates)
+    elapsed = time.perf_counter() - t0
+    print(f"resolve            {elapsed / len(links) * 1e6:6.2f} µs/link  "
+          f"resolved={resolved} ambiguous={ambiguous} total={len(links)}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
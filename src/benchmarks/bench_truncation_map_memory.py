@@ -0,0 +1,117 @@
+# src/benchmarks/bench_truncation_map_memory.py
+
+import os
+import gc
+import sys
+import json
+import time
+import random
+import tempfile
+import tracemalloc
+from dataclasses import dataclass
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from build_uid_map_for_truncated_titles import load_truncation_map, build_indices_from_map
+
+
+@dataclass
+class LegacyEntry:
+    """舊版 TruncationMapEntry（無 __slots__）作為對照組。"""
+    uid: str
+    full_sentence: str
+
+
+@dataclass
+class LegacyIndices:
+    """舊版 Indices：三個 dict + 方法查詢。"""
+    full_to_uid: dict
+    uid_to_expected_full: dict
+    uid_to_key: dict
+
+    def uid_for_full(self, full_sentence):
+        return self.full_to_uid.get(full_sentence)
+
+    def key_for_uid(self, uid):
+        return self.uid_to_key.get(uid)
+
+    def expected_full_for_uid(self, uid):
+        return self.uid_to_expected_full.get(uid)
+
+
+def write_synthetic_map(path: str, n: int, seed: int = 0) -> None:
+    """產生 n 筆仿真 truncation_map.json：key 為約 70 字元的截斷句、full_sentence 約 120 字元。"""
+    rng = random.Random(seed)
+    words = ["memory", "city", "deity", "realm", "countdown", "protagonist", "whiteboard", "card", "dimension", "barrier"]
+    data = {}
+    for i in range(1, n + 1):
+        full = " ".join(rng.choice(words) for _ in range(16)) + f" #{i}."
+        data[f"{full[:64].rstrip()} {i}"] = {"uid": f"uid_{i:03d}", "full_sentence": full}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def load_legacy(path: str):
+    """舊版表示法：無 slots 的條目 + 三個索引 dict。"""
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    truncation_map = {k: LegacyEntry(uid=v["uid"], full_sentence=v["full_sentence"]) for k, v in raw.items()}
+    del raw
+    full_to_uid, uid_to_expected_full, uid_to_key = {}, {}, {}
+    for k, e in truncation_map.items():
+        full_to_uid[e.full_sentence] = e.uid
+        uid_to_expected_full[e.uid] = e.full_sentence
+        uid_to_key[e.uid] = k
+    return truncation_map, LegacyIndices(full_to_uid, uid_to_expected_full, uid_to_key)
+
+
+def load_compact(path: str):
+    truncation_map = load_truncation_map(path)
+    return truncation_map, build_indices_from_map(truncation_map)
+
+
+def measure(label: str, fn):
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    obj = fn()
+    elapsed = time.perf_counter() - t0
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<20} retained={current / 2**20:7.2f} MiB  peak={peak / 2**20:7.2f} MiB  load={elapsed:6.3f}s")
+    return obj
+
+
+def bench_lookups(label: str, uid_for_full, key_for_uid, full_for_uid, fulls, uids, rounds: int = 3) -> None:
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for s in fulls:
+            uid_for_full(s)
+        for u in uids:
+            key_for_uid(u)
+            full_for_uid(u)
+    elapsed = time.perf_counter() - t0
+    n = rounds * (len(fulls) + 2 * len(uids))
+    print(f"{label:<20} {elapsed / n * 1e9:7.1f} ns/lookup")
+
+
+def main(n: int = 100_000) -> None:
+    print(f"📏 truncation_map 記憶體基準：{n} 筆\n")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "truncation_map.json")
+        write_synthetic_map(path, n)
+
+        legacy_map, legacy_idx = measure("legacy (3 dicts)", lambda: load_legacy(path))
+        fulls = [e.full_sentence for e in legacy_map.values()]
+        uids = [e.uid for e in legacy_map.values()]
+        del legacy_map
+        compact_map, compact_idx = measure("compact Indices", lambda: load_compact(path))
+
+    print()
+    bench_lookups("legacy lookups", legacy_idx.uid_for_full, legacy_idx.key_for_uid,
+                  legacy_idx.expected_full_for_uid, fulls, uids)
+    bench_lookups("compact lookups", compact_idx.uid_for_full, compact_idx.key_for_uid,
+                  compact_idx.expected_full_for_uid, fulls, uids)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
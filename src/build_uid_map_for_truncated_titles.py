@@ -2,28 +2,38 @@
 
 from __future__ import annotations
 
+import io
 import os
 import re
 import json
+import hashlib
+from collections import deque
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Tuple, List, Iterable, Optional
+from typing import Container, Dict, Tuple, List, Iterable, Iterator, Optional
 
+from utils.change_events import DELETED, RENAMED, REWRITTEN, UID_ASSIGNED, ChangeEvent, drain
 from utils.get_safe_path import get_safe_path
 from utils.logger import Logger
+from utils.md_lexer import find_frontmatter
+from utils.rename_planner import order_renames, apply_renames
+from utils.state_store import StateStore, StoreIndices, truncation_map_sha1
+from utils.vault_fs import VaultFS, state_fs
+from utils.write_ahead_journal import (
+    WriteAheadJournal, apply_journal_op, revert_journal_op, iter_map_inserts, encode_bytes,
+)
 
 
 # ===== Constants =====
 LONG_FILENAME_UTF8_BYTES_THRESHOLD = 70  # 目前檔名約能使用97Byte，不排除有容量更小、提前截斷的情況，所以可能要設得比97小一些
+UID_SCHEME = "sequential"  # "sequential"：uid_001 起依序取最小可用；"content"：由 full_sentence 雜湊決定（跨次執行／跨備份穩定）
+CONTENT_UID_DIGITS = 12    # content 模式的十進位位數（10 萬筆時碰撞機率約 0.5%，碰撞會自動加鹽重算）
 
 
 # ===== Data Models =====
-from dataclasses import dataclass
-from typing import Dict, Optional
-
-@dataclass
+@dataclass(slots=True)
 class TruncationMapEntry:
-    """truncation_map 的 value 結構：{ uid, full_sentence }"""
+    """truncation_map 的 value 結構：{ uid, full_sentence }（__slots__，大型 map 省去每筆 __dict__）"""
     uid: str
     full_sentence: str
 
@@ -36,42 +46,60 @@ class TruncationMapEntry:
         return {"uid": self.uid, "full_sentence": self.full_sentence}
 
 
-@dataclass
 class Indices:
-    """規格：高層流程 Step1 所需的三個索引（皆為必備）"""
-    full_to_uid: Dict[str, str]
-    uid_to_expected_full: Dict[str, str]
-    uid_to_key: Dict[str, str]
+    """規格：高層流程 Step1 所需的三個索引（皆為必備）
+
+    緊湊表示：不另存第三份字串對照，只留兩個 dict
+    - full_sentence → uid
+    - uid → key（再經 truncation_map[key] 取回 full_sentence）
+    索引與 map 共用同一批字串物件；三種查詢皆為 1～2 次 dict 查詢。
+    """
+    __slots__ = ("_map", "_full_to_uid", "_uid_to_key")
+
+    def __init__(self, truncation_map: Dict[str, TruncationMapEntry]) -> None:
+        self._map = truncation_map
+        self._full_to_uid: Dict[str, str] = {}
+        self._uid_to_key: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._uid_to_key)
 
     # 查詢輔助（讀操作）
     def uid_for_full(self, full_sentence: str) -> Optional[str]:
-        return self.full_to_uid.get(full_sentence)
+        return self._full_to_uid.get(full_sentence)
 
     def key_for_uid(self, uid: str) -> Optional[str]:
-        return self.uid_to_key.get(uid)
+        return self._uid_to_key.get(uid)
 
     def expected_full_for_uid(self, uid: str) -> Optional[str]:
-        return self.uid_to_expected_full.get(uid)
+        key = self._uid_to_key.get(uid)
+        entry = None if key is None else self._map.get(key)
+        return None if entry is None else entry.full_sentence
 
     def has_uid(self, uid: str) -> bool:
-        return uid in self.uid_to_expected_full
+        return uid in self._uid_to_key
 
     def has_full(self, full_sentence: str) -> bool:
-        return full_sentence in self.full_to_uid
+        return full_sentence in self._full_to_uid
+
+    def full_sentences(self) -> Container[str]:
+        """供 serialize_full_sentence 做存在判斷的容器（O(1) 查詢）。"""
+        return self._full_to_uid.keys()
 
-    # 新增 map 條目時，保持三索引同步（寫操作）
+    # 新增 map 條目時，保持索引同步（寫操作；entry 須已放入 truncation_map[key]）
     def register(self, key: str, entry: TruncationMapEntry) -> None:
-        self.full_to_uid[entry.full_sentence] = entry.uid
-        self.uid_to_expected_full[entry.uid] = entry.full_sentence
-        self.uid_to_key[entry.uid] = key
+        self._full_to_uid[entry.full_sentence] = entry.uid
+        self._uid_to_key[entry.uid] = key
 
     # 變更 full_sentence（例如 F2 序號化）時，安全更新索引
     def update_full_for_uid(self, uid: str, old_full: str, new_full: str) -> None:
-        if self.full_to_uid.get(old_full) == uid:
-            self.full_to_uid.pop(old_full, None)
-        self.full_to_uid[new_full] = uid
-        self.uid_to_expected_full[uid] = new_full
-        # uid_to_key 不變（key 仍是被截斷的不完整語句）
+        if self._full_to_uid.get(old_full) == uid:
+            self._full_to_uid.pop(old_full, None)
+        self._full_to_uid[new_full] = uid
+        key = self._uid_to_key.get(uid)
+        if key is not None and key in self._map:
+            self._map[key].full_sentence = new_full
+        # key 不變（key 仍是被截斷的不完整語句）
 
 
 @dataclass
@@ -98,16 +126,15 @@ class Stats:
 
 
 # ===== I/O & Map =====
-def load_truncation_map(map_path: str) -> Dict[str, TruncationMapEntry]:
+def load_truncation_map(map_path: str, fs: Optional[VaultFS] = None) -> Dict[str, TruncationMapEntry]:
     """讀取 truncation_map.json → 以 key(str)→TruncationMapEntry 回傳。
     規格：map 由他程保養；若遇不一致，本程式不覆寫、不挪用，僅記錄 audit。
     """
-    p = get_safe_path(map_path)
-    if not os.path.exists(p):
+    text = state_fs(fs).read_state(map_path)
+    if text is None:
         return {}
     try:
-        with open(p, "r", encoding="utf-8") as f:
-            raw = json.load(f)
+        raw = json.loads(text)
         result: Dict[str, TruncationMapEntry] = {}
         for k, v in raw.items():
             # 容錯：v 可能是 dict 或已是正確結構
@@ -120,58 +147,145 @@ def load_truncation_map(map_path: str) -> Dict[str, TruncationMapEntry]:
         return {}
 
 
-def save_truncation_map(map_path: str, truncation_map: Dict[str, TruncationMapEntry]) -> None:
+def save_truncation_map(
+    map_path: str, truncation_map: Dict[str, TruncationMapEntry], fs: Optional[VaultFS] = None
+) -> None:
     """安全寫回 truncation_map.json（確保資料夾存在、UTF-8）。
+    先寫暫存檔再 os.replace，中斷時 map 只會是舊版或新版，不會半寫。
     """
-    p = get_safe_path(map_path)
-    os.makedirs(os.path.dirname(p), exist_ok=True)
     serializable = {k: {"uid": v.uid, "full_sentence": v.full_sentence} for k, v in truncation_map.items()}
-    with open(p, "w", encoding="utf-8") as f:
-        json.dump(serializable, f, ensure_ascii=False, indent=2)
+    state_fs(fs).write_state(
+        map_path, json.dumps(serializable, ensure_ascii=False, indent=2), atomic=True, fsync=True
+    )
+
+
+def load_truncation_map_from_store(store: StateStore) -> Dict[str, TruncationMapEntry]:
+    """state.db → key(str)→TruncationMapEntry（依寫入順序）。"""
+    return {k: TruncationMapEntry(uid=u, full_sentence=s) for k, u, s in store.iter_truncation_entries()}
+
+
+def reconcile_store_with_json(
+    store: StateStore, map_path: str, logger: Logger, fs: Optional[VaultFS] = None
+) -> None:
+    """state.db 與 truncation_map.json 對帳：
+    - store 為空 → 匯入 JSON（首次啟用 state.db）
+    - 兩者不一致 → 記錄差異；以 store 為準，本次結束時 JSON 由 store 內容覆寫
+    """
+    if store.truncation_count() == 0:
+        store.import_json("truncation_map", map_path)
+        return
+    stored = snapshot_truncation_map(load_truncation_map_from_store(store))
+    exported = snapshot_truncation_map(load_truncation_map(map_path, fs))
+    if stored == exported:
+        return
+    only_store = sum(1 for k in stored if k not in exported)
+    only_json = sum(1 for k in exported if k not in stored)
+    differing = sum(1 for k, v in stored.items() if k in exported and exported[k] != v)
+    log_event(
+        logger, action="store-json-drift", src=Path(map_path),
+        detail=f"only_store={only_store}, only_json={only_json}, differing={differing}（以 state.db 為準）",
+    )
+
+
+def snapshot_truncation_map(truncation_map: Dict[str, TruncationMapEntry]) -> Dict[str, Tuple[str, str]]:
+    """key → (uid, full_sentence) 的淺快照，供計算本次 delta。"""
+    return {k: (v.uid, v.full_sentence) for k, v in truncation_map.items()}
+
+
+DELTA_SECTIONS = ("added", "changed", "retargeted")
+
+
+def compute_truncation_delta(
+    before: Dict[str, Tuple[str, str]], truncation_map: Dict[str, TruncationMapEntry]
+) -> Dict[str, dict]:
+    """比對執行前後的 map，列出受影響的條目：
+    - added：新 key
+    - changed：同 key、full_sentence 改變（附 old_full_sentence）
+    - retargeted：同 key、uid 改變（附 old_uid）
+    """
+    delta: Dict[str, dict] = {section: {} for section in DELTA_SECTIONS}
+    for k, v in truncation_map.items():
+        old = before.get(k)
+        entry = {"uid": v.uid, "full_sentence": v.full_sentence}
+        if old is None:
+            delta["added"][k] = entry
+            continue
+        old_uid, old_full = old
+        if old_full != v.full_sentence:
+            delta["changed"][k] = {**entry, "old_full_sentence": old_full}
+        if old_uid != v.uid:
+            delta["retargeted"][k] = {**entry, "old_uid": old_uid}
+    return delta
+
+
+def merge_truncation_delta(
+    pending: Dict[str, dict], delta: Dict[str, dict], truncation_map: Dict[str, TruncationMapEntry]
+) -> Dict[str, dict]:
+    """把本次 delta 併入第 7 步尚未消化的 delta（第 6 步連續執行多次時，先前的條目不能遺失）：
+    - 先前為 added 的 key 仍算 added；old_full_sentence / old_uid 保留最早的值
+    - uid / full_sentence 一律以目前的 map 為準
+    """
+    merged = {section: dict(pending.get(section, {})) for section in DELTA_SECTIONS}
+    for section in DELTA_SECTIONS:
+        for key, entry in delta[section].items():
+            target = "added" if key in merged["added"] else section
+            earlier = merged[target].get(key, {})
+            merged[target][key] = {**entry, **{f: earlier[f] for f in ("old_full_sentence", "old_uid") if f in earlier}}
+    for section in DELTA_SECTIONS:
+        for key, entry in merged[section].items():
+            current = truncation_map.get(key)
+            if current is not None:
+                entry["uid"], entry["full_sentence"] = current.uid, current.full_sentence
+    return merged
+
+
+def load_pending_truncation_delta(delta_path: str, fs: Optional[VaultFS] = None) -> Optional[dict]:
+    """第 7 步成功後會刪除 delta；仍存在即表示尚未消化。"""
+    text = state_fs(fs).read_state(delta_path)
+    if text is None:
+        return None
+    pending = json.loads(text)
+    for section in DELTA_SECTIONS:
+        pending.setdefault(section, {})
+    return pending
+
+
+def save_truncation_delta(delta_path: str, delta: Dict[str, dict], fs: Optional[VaultFS] = None) -> None:
+    """輸出 truncation_delta.json，供 rewrite_links_with_uid_alias 只處理受影響的連結。"""
+    state_fs(fs).write_state(delta_path, json.dumps(delta, ensure_ascii=False, indent=2))
 
 
 def build_indices_from_map(truncation_map: Dict[str, TruncationMapEntry]) -> Indices:
-    """由 map 建立 full_to_uid / uid_to_expected_full / uid_to_key 三索引。"""
-    full_to_uid: Dict[str, str] = {}
-    uid_to_expected_full: Dict[str, str] = {}
-    uid_to_key: Dict[str, str] = {}
+    """由 map 建立 full_sentence→uid / uid→full_sentence / uid→key 三種查詢的緊湊索引。"""
+    indices = Indices(truncation_map)
     for k, entry in truncation_map.items():
-        full_to_uid[entry.full_sentence] = entry.uid
-        uid_to_expected_full[entry.uid] = entry.full_sentence
-        uid_to_key[entry.uid] = k
-    return Indices(full_to_uid=full_to_uid, uid_to_expected_full=uid_to_expected_full, uid_to_key=uid_to_key)
+        indices.register(k, entry)
+    return indices
 
 
 # ===== File Scanning =====
-def iter_vault_md_files(vault_path: str) -> Iterable[Path]:
+def iter_vault_md_files(vault_path: str, fs: Optional[VaultFS] = None) -> Iterable[Path]:
     """遍歷整個 Vault（全域）找出所有 .md 檔（含 uid / 非 uid / temp），yield 絕對路徑 Path。"""
     vp = os.path.abspath(vault_path)
-    for root, _, files in os.walk(vp):
+    for root, _, files in (fs.walk(vp) if fs is not None else os.walk(vp)):
         for fn in files:
             if fn.lower().endswith(".md"):
                 yield Path(get_safe_path(os.path.join(root, fn)))
 
 
-def read_lines(path: Path) -> List[str]:
+def read_lines(path: Path, fs: Optional[VaultFS] = None) -> List[str]:
     """讀取單檔所有行（保留換行符）。"""
+    if fs is not None:
+        return io.StringIO(fs.read_text(str(path), errors="ignore")).readlines()
     with open(get_safe_path(str(path)), "r", encoding="utf-8", errors="ignore") as f:
         return f.readlines()
 
 
 # ===== Markdown Cleaning =====
 def skip_yaml(lines: List[str]) -> List[str]:
-    """規格 1：跳過 YAML 區塊（首行/次行皆以單獨 '---' 為邊界，含邊界）。"""
-    if not lines:
-        return lines
-    i = 0
-    # 僅當第一行是 '---' 時才視為 YAML 開頭
-    if lines[0].strip() == "---":
-        for i in range(1, len(lines)):
-            if lines[i].strip() == "---":
-                return lines[i + 1 :]
-        # 沒有收尾，保守起見：視為沒 YAML
-        return lines
-    return lines
+    """規格 1：跳過 YAML 區塊（首行/次行皆以單獨 '---' 為邊界，含邊界）。沒有收尾，保守起見：視為沒 YAML。"""
+    frontmatter = find_frontmatter(lines)
+    return lines[frontmatter[1] + 1 :] if frontmatter is not None else lines
 
 
 def first_nonempty_line(lines: List[str]) -> str:
@@ -315,23 +429,19 @@ def uniquify_key(base_key: str, truncation_map: Dict[str, TruncationMapEntry]) -
 
 
 # ===== F1 / F2 / F3 =====
-def files_are_fully_identical(path_a: Path, path_b: Path) -> bool:
-    """F1：完全重複判定（先比 cleaned，再比整檔逐字，含 YAML）。"""
+def files_are_fully_identical(plan: "RenamePlan", a: "PlannedFile", b: "PlannedFile") -> bool:
+    """F1：完全重複判定（先比 cleaned，再比整檔逐字，含 YAML）。內容取自規劃中的最新狀態。"""
     # 首句 cleaned 比對
-    ln_a = first_nonempty_line(skip_yaml(read_lines(path_a)))
-    ln_b = first_nonempty_line(skip_yaml(read_lines(path_b)))
-    if clean_markdown_line(ln_a) != clean_markdown_line(ln_b):
+    if plan.cleaned_of(a) != plan.cleaned_of(b):
         return False
     # 整檔逐字
-    with open(get_safe_path(str(path_a)), "r", encoding="utf-8", errors="ignore") as fa, \
-         open(get_safe_path(str(path_b)), "r", encoding="utf-8", errors="ignore") as fb:
-        return fa.read() == fb.read()
+    return "".join(plan.lines_of(a)) == "".join(plan.lines_of(b))
 
 
-def serialize_full_sentence(sentence: str, existing_full_values: Iterable[str]) -> str:
+def serialize_full_sentence(sentence: str, existing_full_values: Container[str]) -> str:
     """F2：生成唯一化的 full_sentence 'S (n)'。不含 I/O。"""
     s = sentence
-    existing = set(existing_full_values)
+    existing = existing_full_values
     if s not in existing:
         return s
     n = 2
@@ -342,17 +452,12 @@ def serialize_full_sentence(sentence: str, existing_full_values: Iterable[str])
         n += 1
 
 
-def apply_serialized_suffix_to_file_headline(path: Path, new_sentence: str) -> None:
-    """F2：把 '(n)' 同步寫回檔案首句（唯一允許的內容變更）。"""
-    p = get_safe_path(str(path))
-    lines = read_lines(path)
+def replace_headline(lines: List[str], new_sentence: str) -> List[str]:
+    """F2：回傳首句（YAML 之後第一個非空行）換成 new_sentence 的新內容。不含 I/O。"""
+    lines = list(lines)
     # 找 YAML 結束
-    start_idx = 0
-    if lines and lines[0].strip() == "---":
-        for i in range(1, len(lines)):
-            if lines[i].strip() == "---":
-                start_idx = i + 1
-                break
+    frontmatter = find_frontmatter(lines)
+    start_idx = frontmatter[1] + 1 if frontmatter is not None else 0
     # 找第一個非空行
     idx = None
     for i in range(start_idx, len(lines)):
@@ -364,7 +469,13 @@ def apply_serialized_suffix_to_file_headline(path: Path, new_sentence: str) -> N
         lines.append(new_sentence + "\n")
     else:
         lines[idx] = new_sentence + "\n"
-    with open(p, "w", encoding="utf-8") as f:
+    return lines
+
+
+def apply_serialized_suffix_to_file_headline(path: Path, new_sentence: str) -> None:
+    """F2：把 '(n)' 同步寫回檔案首句（唯一允許的內容變更）。"""
+    lines = replace_headline(read_lines(path), new_sentence)
+    with open(get_safe_path(str(path)), "w", encoding="utf-8") as f:
         f.writelines(lines)
 
 
@@ -384,27 +495,33 @@ def get_unused_uid(vault_path: str, start_index: int) -> Tuple[str, int]:
         idx += 1
 
 
-# ===== Rename / Temp Utilities =====
-def ensure_global_unique_rename(src: Path, dest: Path) -> None:
-    """安全正名（必要時先把占用者移 temp 或用中繼名再換名，避免覆寫）。"""
-    src_p = Path(get_safe_path(str(src)))
-    dest_p = Path(get_safe_path(str(dest)))
-    os.makedirs(os.path.dirname(str(dest_p)), exist_ok=True)
-    if dest_p.exists():
-        move_to_temp_name(dest_p)  # 先把占用者讓位
-    os.rename(str(src_p), str(dest_p))
+def content_uid(full_sentence: str, salt: int = 0) -> str:
+    """F3（content 模式）：由 full_sentence 的 BLAKE2b 雜湊導出 uid_<12 位數字>。
+    純函式：同一句子在任何機器、任何執行順序都得到同一個 UID，可平行指派。
+    salt > 0 僅用於碰撞時重算。
+    """
+    data = full_sentence.encode("utf-8") if salt == 0 else f"{full_sentence}\x00{salt}".encode("utf-8")
+    digest = hashlib.blake2b(data, digest_size=8).digest()
+    return f"uid_{int.from_bytes(digest, 'big') % 10 ** CONTENT_UID_DIGITS:0{CONTENT_UID_DIGITS}d}"
 
 
-def move_to_temp_name(path: Path) -> Path:
-    """將檔名換成 uid_fix_temp(n).md（n=1,2,3… 唯一）。"""
-    parent = Path(str(path)).parent
+def pick_unused_uid(parent: Path, indices: Indices, plan: "RenamePlan", full_sentence: str) -> str:
+    """F3：map 未使用、且目的資料夾（依規劃後檔名）無同名檔的 UID。
+    - sequential：最小的 uid_XXX
+    - content：content_uid(full_sentence)；被其他句子占用時依 salt 1, 2, … 重算
+    """
+    if plan.uid_scheme == "content":
+        salt = 0
+        while True:
+            cand = content_uid(full_sentence, salt)
+            if not indices.has_uid(cand) and not plan.exists(parent, f"{cand}.md"):
+                return cand
+            salt += 1
     n = 1
     while True:
-        cand = parent / f"uid_fix_temp({n}).md"
-        cand_p = Path(get_safe_path(str(cand)))
-        if not cand_p.exists():
-            os.rename(get_safe_path(str(path)), str(cand_p))
-            return cand_p
+        cand = f"uid_{n:03d}"
+        if not indices.has_uid(cand) and not plan.exists(parent, f"{cand}.md"):
+            return cand
         n += 1
 
 
@@ -416,25 +533,187 @@ def uid_for_path(path: Path) -> Optional[str]:
 
 
 def is_temp_file(path: Path) -> bool:
-    """判斷是否 uid_fix_temp(n).md。"""
+    """判斷是否 uid_fix_temp(n).md（前次中斷殘留或環狀改名的中繼檔）。"""
     return re.fullmatch(r"uid_fix_temp\(\d+\)\.md", path.name) is not None
 
 
+# ===== Rename Plan =====
+@dataclass(slots=True)
+class PlannedFile:
+    """規劃中的單一 .md 檔：以掃描時的實體路徑為身分，改名／刪除／首句變更只記在記憶體。"""
+    origin: Path
+    name: Optional[str]                    # 規劃後檔名；None = 被讓位、等待 Case C 重新分派
+    cleaned: Optional[str] = None          # 首句 cleaned（延遲計算）
+    lines: Optional[List[str]] = None      # 僅在首句被序號化後才持有整檔內容
+    headline: Optional[str] = None         # F2 寫回的首句
+    deleted: bool = False
+
+
+class RenamePlan:
+    """整批改名的記憶體規劃：
+    - 以資料夾 → {檔名: PlannedFile} 取代 exists() 探測
+    - 讓位（原本的 move_to_temp_name）只標記並排入 displaced 佇列，不動實體檔
+    - apply() 時才依序刪除、寫回首句，並把改名當作置換執行；只有環狀改名才借用暫存名
+    """
+
+    def __init__(self, md_paths: Iterable[Path], uid_scheme: str = UID_SCHEME, fs: Optional[VaultFS] = None):
+        self.uid_scheme = uid_scheme
+        self.fs = fs or VaultFS(os.curdir)  # 只用來套用操作（root 僅影響 walk 預設值）
+        self.files: List[PlannedFile] = []
+        self.displaced: deque = deque()
+        self._dirs: Dict[Path, Dict[str, PlannedFile]] = {}
+        self._origin_names: Dict[Path, set] = {}
+        for p in md_paths:
+            f = PlannedFile(origin=p, name=p.name)
+            self.files.append(f)
+            self._dirs.setdefault(p.parent, {})[p.name] = f
+            self._origin_names.setdefault(p.parent, set()).add(p.name)
+
+    # --- 查詢 ---
+    def path_of(self, f: PlannedFile) -> Path:
+        """規劃後的路徑；讓位中的檔案回傳原始路徑（僅供 log）。"""
+        return f.origin.parent / (f.name or f.origin.name)
+
+    def occupant(self, parent: Path, name: str) -> Optional[PlannedFile]:
+        return self._dirs.get(parent, {}).get(name)
+
+    def exists(self, parent: Path, name: str) -> bool:
+        return name in self._dirs.get(parent, {})
+
+    def vacated(self, parent: Path, name: str) -> bool:
+        """掃描時存在、但在本次規劃中已被移走的檔名（置換鏈／環的一環）。"""
+        return name in self._origin_names.get(parent, ()) and not self.exists(parent, name)
+
+    def lines_of(self, f: PlannedFile) -> List[str]:
+        return f.lines if f.lines is not None else read_lines(f.origin, self.fs)
+
+    def cleaned_of(self, f: PlannedFile) -> str:
+        if f.cleaned is None:
+            f.cleaned = clean_markdown_line(first_nonempty_line(skip_yaml(self.lines_of(f))))
+        return f.cleaned
+
+    # --- 規劃（寫操作，皆不碰檔案系統） ---
+    def rename(self, f: PlannedFile, name: str, logger: Logger) -> Path:
+        """規劃改名；目的地若有占用者，占用者讓位並排入 Case C。"""
+        names = self._dirs.setdefault(f.origin.parent, {})
+        other = names.get(name)
+        if other is not None and other is not f:
+            self.displace(other)
+            log_event(logger, action="preempt-occupier-displace", src=self.path_of(other))
+        self._release(f)
+        f.name = name
+        names[name] = f
+        return f.origin.parent / name
+
+    def displace(self, f: PlannedFile) -> None:
+        self._release(f)
+        f.name = None
+        self.displaced.append(f)
+
+    def delete(self, f: PlannedFile) -> None:
+        self._release(f)
+        f.deleted = True
+
+    def set_headline(self, f: PlannedFile, new_sentence: str) -> None:
+        f.lines = replace_headline(self.lines_of(f), new_sentence)
+        f.headline = new_sentence
+        f.cleaned = clean_markdown_line(first_nonempty_line(skip_yaml(f.lines)))
+
+    def _release(self, f: PlannedFile) -> None:
+        names = self._dirs.get(f.origin.parent, {})
+        if f.name is not None and names.get(f.name) is f:
+            del names[f.name]
+
+    # --- 套用 ---
+    def moves(self) -> Dict[str, str]:
+        """原始路徑 → 最終路徑（僅含實際換名者）。"""
+        return {
+            str(f.origin): str(f.origin.parent / f.name)
+            for f in self.files
+            if not f.deleted and f.name is not None and f.name != f.origin.name
+        }
+
+    def apply(self, journal: Optional[WriteAheadJournal] = None, map_inserts: Iterable[Tuple[str, TruncationMapEntry]] = ()) -> None:
+        """1) 刪除冗餘 2) 於原路徑寫回序號化首句 3) 依置換順序改名。
+        有 journal 時：先把全部操作（含 map_inserts）寫入日誌並落盤，之後每套用一筆就標記 done。
+        """
+        for _ in self.iter_apply(journal, map_inserts):
+            pass
+
+    def iter_apply(
+        self, journal: Optional[WriteAheadJournal] = None, map_inserts: Iterable[Tuple[str, TruncationMapEntry]] = ()
+    ) -> Iterator[dict]:
+        """apply 的逐筆版：每套用完一筆操作（日誌已標記 done）就 yield 該操作 dict（op / path / src / dst）。
+        呼叫端中途停止時，未套用的操作留在日誌中，下次執行依 recovery 收尾。
+        """
+        ops: List[dict] = []
+        for f in self.files:
+            if f.deleted:
+                ops.append({"op": "delete", "path": str(f.origin)})
+        for f in self.files:
+            if f.headline is not None and not f.deleted:
+                ops.append({"op": "headline", "path": str(f.origin), "new": "".join(f.lines)})
+        for src, dst in order_renames(self.moves(), self._make_temp):
+            ops.append({"op": "rename", "src": src, "dst": dst})
+
+        if journal is None:
+            for op in ops:
+                self._apply_op(op)
+                yield op
+            return
+
+        journal.begin()
+        seqs = []
+        for op in ops:
+            # 還原用的舊內容記錄原始位元組（read_lines 會丟掉非 UTF-8 位元組並把 CRLF 轉成 LF）
+            if op["op"] == "delete":
+                op["content_b64"] = encode_bytes(self.fs.read_bytes(op["path"]))
+            elif op["op"] == "headline":
+                op["old_b64"] = encode_bytes(self.fs.read_bytes(op["path"]))
+            seqs.append(journal.intend(**op))
+        for key, entry in map_inserts:
+            journal.intend("map_insert", key=key, uid=entry.uid, full_sentence=entry.full_sentence)
+        journal.planned()
+        for seq, op in zip(seqs, ops):
+            self._apply_op(op)
+            journal.done(seq)
+            yield op
+
+    def _apply_op(self, op: dict) -> None:
+        if op["op"] == "delete":
+            self.fs.remove(op["path"])
+        elif op["op"] == "headline":
+            self.fs.write_text(op["path"], op["new"])
+        elif op["op"] == "rename":
+            apply_renames([(op["src"], op["dst"])], rename_fn=self.fs.rename, exists_fn=self.fs.exists)
+
+    def _make_temp(self, src: str) -> str:
+        """環狀改名的中繼名：同資料夾內，避開所有原始檔名與規劃後檔名。"""
+        parent = Path(src).parent
+        taken = set(self._dirs.get(parent, {})) | self._origin_names.get(parent, set())
+        n = 1
+        while f"uid_fix_temp({n}).md" in taken:
+            n += 1
+        name = f"uid_fix_temp({n}).md"
+        self._dirs.setdefault(parent, {})[name] = None  # 保留，避免同資料夾第二個環撞名
+        return str(parent / name)
+
+
 # ===== Case Dispatchers (all orchestrators only) =====
 def handle_uid_named_file(
-    path: Path,
-    cleaned: str,
+    f: PlannedFile,
+    plan: RenamePlan,
     truncation_map: Dict[str, TruncationMapEntry],
     indices: Indices,
     stats: Stats,
     logger: Logger,
 ) -> None:
     """Case A：檔名為 uid_XXX.md。
-    → 直接進入『共用邏輯』；如需，依規格先搬移占用者、正名、或序號化＋新 UID。
+    → 直接進入『共用邏輯』；如需，依規格先讓位占用者、正名、或序號化＋新 UID。
     """
     common_logic_with_cleaned(
-        path=path,
-        cleaned=cleaned,
+        f=f,
+        plan=plan,
         from_uid_named=True,
         truncation_map=truncation_map,
         indices=indices,
@@ -444,9 +723,8 @@ def handle_uid_named_file(
 
 
 def handle_general_named_file(
-    path: Path,
-    base_filename: str,
-    cleaned: str,
+    f: PlannedFile,
+    plan: RenamePlan,
     truncation_map: Dict[str, TruncationMapEntry],
     indices: Indices,
     stats: Stats,
@@ -457,6 +735,9 @@ def handle_general_named_file(
     2) 被截斷 is_truncated
     3) 若皆為是 → 進入『共用邏輯』；需要時先轉為 uid_XXX.md。
     """
+    path = plan.path_of(f)
+    base_filename = f.origin.stem
+    cleaned = plan.cleaned_of(f)
     ok, reason = compare_filename_and_line(base_filename, cleaned)
     if not ok:
         log_event(logger, action="skip-nonsegbreak", src=path, detail=reason)
@@ -470,8 +751,8 @@ def handle_general_named_file(
 
     # 進入共用邏輯（來路為一般檔名）
     common_logic_with_cleaned(
-        path=path,
-        cleaned=cleaned,
+        f=f,
+        plan=plan,
         from_uid_named=False,
         truncation_map=truncation_map,
         indices=indices,
@@ -481,112 +762,92 @@ def handle_general_named_file(
 
 
 def handle_temp_file(
-    path: Path,
-    cleaned: str,
+    f: PlannedFile,
+    plan: RenamePlan,
     truncation_map: Dict[str, TruncationMapEntry],
     indices: Indices,
     stats: Stats,
     logger: Logger,
 ) -> None:
-    """Case C：uid_fix_temp(n).md → 依規格轉正（或刪除冗餘）。
-    完成轉正後不長留 temp（正名後自然消失）。
-    """
+    """Case C：讓位中的檔案（或前次殘留的 uid_fix_temp(n).md）→ 依規格轉正（或刪除冗餘）。"""
+    src = plan.path_of(f)
+    cleaned = plan.cleaned_of(f)
     expected_uid = indices.uid_for_full(cleaned)
-    parent = path.parent
+    parent = f.origin.parent
 
     if expected_uid:
-        expected_path = parent / f"{expected_uid}.md"
-        if expected_path.exists():
+        expected = plan.occupant(parent, f"{expected_uid}.md")
+        if expected is not None:
             # 首句一致？→ F1
-            ln_expected = first_nonempty_line(skip_yaml(read_lines(expected_path)))
-            if clean_markdown_line(ln_expected) == cleaned:
-                if files_are_fully_identical(path, expected_path):
+            if plan.cleaned_of(expected) == cleaned:
+                if files_are_fully_identical(plan, f, expected):
                     # 冗餘暫存 → 刪除
-                    os.remove(get_safe_path(str(path)))
+                    plan.delete(f)
                     stats.inc_deleted_dup()
-                    log_event(logger, action="delete-duplicate-temp", src=path, dst=expected_path)
+                    log_event(logger, action="delete-duplicate-temp", src=src, dst=plan.path_of(expected))
                     return
                 else:
                     # 同首句不同內容 → F2 + F3 新 UID，改名、新增條目；key 以 expected 的 key 為 base 遞增
-                    new_full = serialize_full_sentence(cleaned, indices.full_to_uid.keys())
+                    new_full = serialize_full_sentence(cleaned, indices.full_sentences())
                     if new_full != cleaned:
-                        apply_serialized_suffix_to_file_headline(path, new_full)
+                        plan.set_headline(f, new_full)
                     # 以 map（全域）與當前資料夾確保唯一 UID
-                    used = set(indices.uid_to_expected_full.keys())
-                    n = 1
-                    while True:
-                        cand = f"uid_{n:03d}"
-                        if cand not in used and not (parent / f"{cand}.md").exists():
-                            new_uid = cand
-                            break
-                        n += 1
-                    # 改名
-                    dest = parent / f"{new_uid}.md"
-                    ensure_global_unique_rename(path, dest)
+                    new_uid = pick_unused_uid(parent, indices, plan, new_full)
+                    dest = plan.rename(f, f"{new_uid}.md", logger)
                     # key 基於 expected 的既有 key 遞增
                     base_key = indices.key_for_uid(expected_uid) or synthesize_truncation_key_from_cleaned(cleaned)
                     key = uniquify_key(base_key, truncation_map)
                     add_map_entry(truncation_map, key, new_uid, new_full, indices)
                     stats.inc_serialized(); stats.inc_new_uid(); stats.inc_renamed(); stats.inc_added()
-                    log_event(logger, action="temp-serialize-newuid", src=path, dst=dest, detail=f"key={key}")
+                    log_event(logger, action="temp-serialize-newuid", src=src, dst=dest, detail=f"key={key}")
                     return
             else:
                 # 首句不同：此 temp 與 expected 無關 → 視為新內容（F2 視需求）+ 新 UID
                 pass  # 落到下面「expected_uid 不存在或不適用」的路徑
+        elif plan.vacated(parent, f"{expected_uid}.md"):
+            # 原占用者本次已被移走 → 屬於置換（含環），直接正名；環由 apply() 以暫存名解開
+            dest = plan.rename(f, f"{expected_uid}.md", logger)
+            stats.inc_renamed(); stats.inc_repaired_temp()
+            log_event(logger, action="temp-rename-to-expected-uid", src=src, dst=dest)
+            return
 
         # expected_uid.md 不存在（map 遺失實體）→ 不得直接占用該 uid；視為新增內容
         stats.inc_orphan()
         # F2（必要）+ F3
-        new_full = serialize_full_sentence(cleaned, indices.full_to_uid.keys())
+        new_full = serialize_full_sentence(cleaned, indices.full_sentences())
         if new_full != cleaned:
-            apply_serialized_suffix_to_file_headline(path, new_full)
+            plan.set_headline(f, new_full)
 
-        used = set(indices.uid_to_expected_full.keys())
-        n = 1
-        while True:
-            cand = f"uid_{n:03d}"
-            if cand not in used and not (parent / f"{cand}.md").exists():
-                new_uid = cand
-                break
-            n += 1
-        dest = parent / f"{new_uid}.md"
-        ensure_global_unique_rename(path, dest)
+        new_uid = pick_unused_uid(parent, indices, plan, new_full)
+        dest = plan.rename(f, f"{new_uid}.md", logger)
         base_key = indices.key_for_uid(expected_uid) or synthesize_truncation_key_from_cleaned(cleaned)
         key = uniquify_key(base_key, truncation_map)
         add_map_entry(truncation_map, key, new_uid, new_full, indices)
         stats.inc_new_uid(); stats.inc_renamed(); stats.inc_added()
-        log_event(logger, action="temp-newuid-orphan-map", src=path, dst=dest, detail=f"key={key}")
+        log_event(logger, action="temp-newuid-orphan-map", src=src, dst=dest, detail=f"key={key}")
         return
 
     # cleaned 不在 map → 新內容：F2（如需）＋ F3
     new_full = cleaned  # 若 map 無此句，通常不需序號化
-    if new_full in indices.full_to_uid:
-        new_full = serialize_full_sentence(new_full, indices.full_to_uid.keys())
+    if indices.has_full(new_full):
+        new_full = serialize_full_sentence(new_full, indices.full_sentences())
         if new_full != cleaned:
-            apply_serialized_suffix_to_file_headline(path, new_full)
+            plan.set_headline(f, new_full)
 
-    used = set(indices.uid_to_expected_full.keys())
-    n = 1
-    while True:
-        cand = f"uid_{n:03d}"
-        if cand not in used and not (parent / f"{cand}.md").exists():
-            new_uid = cand
-            break
-        n += 1
-    dest = parent / f"{new_uid}.md"
-    ensure_global_unique_rename(path, dest)
+    new_uid = pick_unused_uid(parent, indices, plan, new_full)
+    dest = plan.rename(f, f"{new_uid}.md", logger)
 
     base_key = synthesize_truncation_key_from_cleaned(new_full)
     key = uniquify_key(base_key, truncation_map)
     add_map_entry(truncation_map, key, new_uid, new_full, indices)
     stats.inc_new_uid(); stats.inc_renamed(); stats.inc_added()
-    log_event(logger, action="temp-newuid-fresh", src=path, dst=dest, detail=f"key={key}")
+    log_event(logger, action="temp-newuid-fresh", src=src, dst=dest, detail=f"key={key}")
 
 
 # ===== Shared Logic (cleaned in map? ) =====
 def common_logic_with_cleaned(
-    path: Path,
-    cleaned: str,
+    f: PlannedFile,
+    plan: RenamePlan,
     from_uid_named: bool,
     truncation_map: Dict[str, TruncationMapEntry],
     indices: Indices,
@@ -594,17 +855,19 @@ def common_logic_with_cleaned(
     logger: Logger,
 ) -> None:
     """共用邏輯（規格：以 cleaned 是否在 map 分流；a) 來自 uid 檔；b) 來自非 uid 檔）
-    (1) cleaned 已在 map → expected_uid 分支（F1 / 轉 temp / 正名）
+    (1) cleaned 已在 map → expected_uid 分支（F1 / 讓位 / 正名）
     (2) cleaned 不在 map → 新內容：
         - 來路 b) 非 uid 檔 → F3 新 UID → 改檔名 → key=原始被截斷檔名(預處理後) → 新增條目
-        - 來路 a) uid 檔 → 依『以 uid 收錄時 key 規則』合成 key → 必收錄 or 衝突改 temp 後 Case C
+        - 來路 a) uid 檔 → 依『以 uid 收錄時 key 規則』合成 key → 必收錄 or 衝突讓位後 Case C
     """
-    parent = path.parent
+    path = plan.path_of(f)
+    cleaned = plan.cleaned_of(f)
+    parent = f.origin.parent
     expected_uid = indices.uid_for_full(cleaned)
 
     # (1) cleaned 已在 map
     if expected_uid:
-        expected_path = parent / f"{expected_uid}.md"
+        expected_name = f"{expected_uid}.md"
 
         if from_uid_named:
             current_uid = uid_for_path(path)
@@ -613,33 +876,25 @@ def common_logic_with_cleaned(
                 log_event(logger, action="noop-consistent", src=path)
                 return
 
-        if expected_path.exists():
+        expected = plan.occupant(parent, expected_name)
+        if expected is not None:
             # 比對首句
-            ln_expected = first_nonempty_line(skip_yaml(read_lines(expected_path)))
-            if clean_markdown_line(ln_expected) == cleaned:
+            if plan.cleaned_of(expected) == cleaned:
                 # F1：完全重複？
-                if files_are_fully_identical(path, expected_path):
+                if files_are_fully_identical(plan, f, expected):
                     # 冗餘 → 刪除當前檔案
-                    os.remove(get_safe_path(str(path)))
+                    plan.delete(f)
                     stats.inc_deleted_dup()
-                    log_event(logger, action="delete-duplicate", src=path, dst=expected_path)
+                    log_event(logger, action="delete-duplicate", src=path, dst=plan.path_of(expected))
                     return
                 else:
                     # 兩者共存 → 對「當前檔案」序號化 + 新 UID + 新條目；key 以 expected 的 key 為 base 遞增
-                    new_full = serialize_full_sentence(cleaned, indices.full_to_uid.keys())
+                    new_full = serialize_full_sentence(cleaned, indices.full_sentences())
                     if new_full != cleaned:
-                        apply_serialized_suffix_to_file_headline(path, new_full)
+                        plan.set_headline(f, new_full)
                     # 指派新 UID（以 map + 當前資料夾檢查）
-                    used = set(indices.uid_to_expected_full.keys())
-                    n = 1
-                    while True:
-                        cand = f"uid_{n:03d}"
-                        if cand not in used and not (parent / f"{cand}.md").exists():
-                            new_uid = cand
-                            break
-                        n += 1
-                    dest = parent / f"{new_uid}.md"
-                    ensure_global_unique_rename(path, dest)
+                    new_uid = pick_unused_uid(parent, indices, plan, new_full)
+                    dest = plan.rename(f, f"{new_uid}.md", logger)
 
                     base_key = indices.key_for_uid(expected_uid) or synthesize_truncation_key_from_cleaned(cleaned)
                     key = uniquify_key(base_key, truncation_map)
@@ -648,25 +903,21 @@ def common_logic_with_cleaned(
                     log_event(logger, action="serialize-newuid", src=path, dst=dest, detail=f"key={key}")
                     return
             else:
-                # 首句不同 → 占用者需要更正檔名：先把占用者移 temp，再把當前檔案正名為 expected_uid.md
-                moved = move_to_temp_name(expected_path)
-                log_event(logger, action="preempt-occupier-to-temp", src=expected_path, dst=moved)
-                dest = parent / f"{expected_uid}.md"
-                ensure_global_unique_rename(path, dest)
+                # 首句不同 → 占用者需要更正檔名：占用者讓位（排入 Case C），再把當前檔案正名為 expected_uid.md
+                dest = plan.rename(f, expected_name, logger)
                 stats.inc_renamed()
                 log_event(logger, action="rename-to-expected-uid", src=path, dst=dest)
                 return
         else:
             # 無人占用 → 直接正名為 expected_uid.md（不改內容）
-            dest = parent / f"{expected_uid}.md"
-            ensure_global_unique_rename(path, dest)
+            dest = plan.rename(f, expected_name, logger)
             stats.inc_renamed()
             log_event(logger, action="rename-to-expected-uid", src=path, dst=dest)
             return
 
     # (2) cleaned 不在 map → 新內容
     if from_uid_named:
-        # 來路 a) uid 檔：必收錄或衝突轉 temp（由 Case C 後續處理）
+        # 來路 a) uid 檔：必收錄或衝突讓位（由 Case C 後續處理）
         current_uid = uid_for_path(path)
         if current_uid and not indices.has_uid(current_uid):
             # 必收錄：以 cleaned 反推標準 key → 唯一化 → 新增條目
@@ -676,25 +927,16 @@ def common_logic_with_cleaned(
             stats.inc_added()
             log_event(logger, action="register-uid-file", src=path, detail=f"key={key}")
         else:
-            # UID 衝突（map 已使用此 UID）→ 改名為 temp，留待 Case C
-            moved = move_to_temp_name(path)
-            log_event(logger, action="uid-conflict-move-temp", src=path, dst=moved)
+            # UID 衝突（map 已使用此 UID）→ 讓位，留待 Case C
+            plan.displace(f)
+            log_event(logger, action="uid-conflict-displace", src=path)
         return
 
     # 來路 b) 非 uid 檔：F3 新 UID → 改檔名 → key=原始被截斷檔名(預處理後) → 新增條目
-    used = set(indices.uid_to_expected_full.keys())
-    n = 1
-    while True:
-        cand = f"uid_{n:03d}"
-        if cand not in used and not (parent / f"{cand}.md").exists():
-            new_uid = cand
-            break
-        n += 1
-
-    dest = parent / f"{new_uid}.md"
-    ensure_global_unique_rename(path, dest)
+    new_uid = pick_unused_uid(parent, indices, plan, cleaned)
+    dest = plan.rename(f, f"{new_uid}.md", logger)
 
-    base_key = remove_trailing_number(path.stem)  # 檔名預處理後作為 key base
+    base_key = remove_trailing_number(f.origin.stem)  # 檔名預處理後作為 key base
     key = uniquify_key(base_key, truncation_map)
     add_map_entry(truncation_map, key, new_uid, cleaned, indices)
     stats.inc_new_uid(); stats.inc_renamed(); stats.inc_added()
@@ -702,6 +944,43 @@ def common_logic_with_cleaned(
 
 
 
+# ===== Passes =====
+def plan_uid_renames(
+    plan: RenamePlan,
+    truncation_map: Dict[str, TruncationMapEntry],
+    indices: Indices,
+    stats: Stats,
+    logger: Logger,
+    only: Optional[Container[Path]] = None,
+) -> None:
+    """第一輪 Case A/B → 第二輪 Case C（讓位佇列與殘留 temp），結果只寫入 plan 與 map。
+    only：第一輪只處理這些原始路徑（其餘檔案仍在 plan 中供占用／讓位判斷；常駐程式只轉換單張卡片時使用）。
+    """
+    # ---------- Pass 1: Case A / B ----------
+    leftover_temps: List[PlannedFile] = []
+    for f in list(plan.files):
+        if is_temp_file(f.origin):
+            leftover_temps.append(f)  # 第一輪跳過 Case C
+            continue
+        if f.name is None:
+            continue  # 已被前面的檔案擠出 → 交給 Case C
+        if only is not None and f.origin not in only:
+            continue
+
+        if uid_for_path(f.origin) is not None:
+            handle_uid_named_file(f, plan, truncation_map, indices, stats, logger)     # Case A
+        else:
+            handle_general_named_file(f, plan, truncation_map, indices, stats, logger)  # Case B
+
+    # ---------- Pass 2: Case C（僅記憶體佇列） ----------
+    plan.displaced.extendleft(reversed(leftover_temps))
+    while plan.displaced:
+        f = plan.displaced.popleft()
+        if f.deleted:
+            continue
+        handle_temp_file(f, plan, truncation_map, indices, stats, logger)  # Case C
+
+
 # ===== Map Mutations =====
 def add_map_entry(
     truncation_map: Dict[str, TruncationMapEntry],
@@ -714,9 +993,9 @@ def add_map_entry(
     # 三重唯一性檢查（不覆寫、不挪用）
     if key in truncation_map:
         raise ValueError(f"map key already exists: {key}")
-    if uid in indices.uid_to_expected_full:
+    if indices.has_uid(uid):
         raise ValueError(f"uid already exists in map: {uid}")
-    if full_sentence in indices.full_to_uid:
+    if indices.has_full(full_sentence):
         raise ValueError(f"full_sentence already exists in map: {full_sentence}")
 
     entry = TruncationMapEntry(uid=uid, full_sentence=full_sentence)
@@ -725,11 +1004,57 @@ def add_map_entry(
     indices.register(key, entry)
 
 
+# ===== Crash Recovery =====
+def recover_from_journal(
+    journal: WriteAheadJournal, map_path: str, mode: str, logger: Logger, store: Optional[StateStore] = None
+) -> bool:
+    """前次執行中斷時，依預寫日誌收尾：
+    - replay：補做尚未標記 done 的檔案操作，並把 map_insert 補進 map
+    - rollback：依反序撤銷已 done 的檔案操作，並移除已寫入 map 的本次條目
+    意圖未寫完（"planned" 之前中斷）代表尚未動任何檔案，直接丟棄日誌。
+    回傳是否動過 Vault 內的檔案。
+    """
+    state = journal.pending()
+    if state is None:
+        if journal.exists():
+            journal.discard()
+            log_event(logger, action="journal-discard-unplanned", src=Path(journal.path))
+        return False
+
+    truncation_map = load_truncation_map_from_store(store) if store is not None else load_truncation_map(map_path)
+    inserts = list(iter_map_inserts(state["ops"]))
+    if mode == "rollback":
+        for record in reversed(state["done"]):
+            revert_journal_op(record)
+        for r in inserts:
+            entry = truncation_map.get(r["key"])
+            if entry is not None and entry.uid == r["uid"]:
+                del truncation_map[r["key"]]
+    else:
+        done = {r["seq"] for r in state["done"]}
+        for record in state["ops"]:
+            if record["seq"] not in done and record["op"] != "map_insert":
+                apply_journal_op(record)
+        for r in inserts:
+            if r["key"] not in truncation_map:
+                truncation_map[r["key"]] = TruncationMapEntry(uid=r["uid"], full_sentence=r["full_sentence"])
+    save_truncation_map(map_path, truncation_map)
+    if store is not None:
+        store.replace_truncation_entries((k, v.uid, v.full_sentence) for k, v in truncation_map.items())
+    journal.discard()
+    log_event(
+        logger, action=f"journal-{mode}", src=Path(journal.path),
+        detail=f"ops={len(state['ops'])}, done={len(state['done'])}, map_inserts={len(inserts)}",
+    )
+    return True
+
+
 # ===== Logging =====
-def log_params(logger: Logger) -> None:
+def log_params(logger: Logger, uid_scheme: str = UID_SCHEME) -> None:
     """在 log 開頭列印主要參數（如 bytes 門檻等）。"""
     logger.log("=== build_uid_map_for_truncated_titles: run params ===")
     logger.log(f"- LONG_FILENAME_UTF8_BYTES_THRESHOLD = {LONG_FILENAME_UTF8_BYTES_THRESHOLD}")
+    logger.log(f"- UID_SCHEME = {uid_scheme}")
     logger.log("=====================================================")
 
 
@@ -777,65 +1102,131 @@ def log_stats_summary(
 
 # ===== Orchestrator =====
 def build_uid_map_for_truncated_titles(
-    vault_path: str, map_path: str, log_path: str, verbose: bool = False
+    vault_path: str,
+    map_path: str,
+    log_path: str,
+    verbose: bool = False,
+    journal_path: Optional[str] = None,
+    recovery: str = "replay",
+    state_db_path: Optional[str] = None,
+    uid_scheme: str = UID_SCHEME,
+    delta_path: Optional[str] = None,
+    fs: Optional[VaultFS] = None,
 ) -> Dict[str, TruncationMapEntry]:
+    """主流程見 iter_build_uid_map_for_truncated_titles（不逐筆產生事件）；回傳更新後的 truncation_map。"""
+    return drain(iter_build_uid_map_for_truncated_titles(
+        vault_path, map_path, log_path, verbose, journal_path, recovery, state_db_path, uid_scheme, delta_path, fs
+    ))
+
+
+def iter_build_uid_map_for_truncated_titles(
+    vault_path: str,
+    map_path: str,
+    log_path: str,
+    verbose: bool = False,
+    journal_path: Optional[str] = None,
+    recovery: str = "replay",
+    state_db_path: Optional[str] = None,
+    uid_scheme: str = UID_SCHEME,
+    delta_path: Optional[str] = None,
+    fs: Optional[VaultFS] = None,
+) -> Iterator[ChangeEvent]:
     """
     主流程（僅呼叫，無實作邏輯）：
-    1) 建 logger、列印參數
-    2) 讀 map → 建索引
-    3) 第一輪遍歷（Case A/B）：
-       - 跳過 temp
-       - 讀檔、skip_yaml、取第一行、clean
-       - 依檔名類型分派：uid / 一般
-    4) 重建索引（第一輪已改 map/檔名）
-    5) 第二輪遍歷（Case C）：只處理 temp
-    6) 儲存 map、寫 log、輸出統計
+    1) 建 logger、列印參數；若有前次中斷留下的日誌 → 依 recovery（replay / rollback）收尾
+    2) 讀 map → 建索引（有 state_db_path 時改由 SQLite 查詢，不重建三個 dict）
+    3) 掃描一次 Vault → 建 RenamePlan（記憶體中的資料夾檔名表）
+    4) 第一輪（Case A/B）：
+       - 跳過前次殘留的 temp
+       - 取首句、clean（延遲讀檔）
+       - 依檔名類型分派：uid / 一般；改名／讓位／刪除只寫入規劃
+    5) 第二輪（Case C）：只處理讓位佇列與殘留 temp，不再重走 Vault
+       （索引由 add_map_entry 即時同步，不需重建）
+    6) 套用規劃（刪除 → 首句寫回 → 置換改名，只有環才用暫存名）；
+       所有操作與 map 新增條目先寫入預寫日誌（預設 <map_path>.journal）再動檔案；
+       檔案操作經由 VaultFS（首句原子寫回、目錄快取），日誌 commit 前一次 fsync
+    7) 儲存 map（SQLite 交易 commit；JSON 以原子替換輸出以保相容）→ 日誌 commit、寫 log、輸出統計
+    8) 有 delta_path 時輸出本次 added / changed / retargeted 條目（含中斷復原補上的條目）；
+       第 7 步尚未消化的前次 delta 一併合併，並記下 map 的 sha1
+    事件：第 6 點每套用一筆操作 yield deleted / rewritten（首句，於原路徑）/ renamed（環狀改名含中繼名），
+    map 儲存後再對每個新條目 yield uid_assigned；generator 的 return 值為更新後的 truncation_map。
+    非 durable 的 fs（MemoryVaultFS）不寫預寫日誌：沒有會被中斷後留下的磁碟狀態。
     """
-    logger = Logger(log_path=log_path, verbose=verbose, title=None)
-    log_params(logger)
+    fs = fs or VaultFS(vault_path)
+    logger = Logger(log_path=log_path, verbose=verbose, title=None, fs=fs)
+    log_params(logger, uid_scheme)
+
+    store = StateStore(state_db_path) if state_db_path else None
+    if store is not None:
+        reconcile_store_with_json(store, get_safe_path(map_path), logger, fs)
+        before = snapshot_truncation_map(load_truncation_map_from_store(store))
+    else:
+        before = snapshot_truncation_map(load_truncation_map(get_safe_path(map_path), fs))
+    map_sha1_before = truncation_map_sha1(get_safe_path(map_path), fs)
+
+    journal = WriteAheadJournal(journal_path or f"{map_path}.journal") if fs.durable else None
+    if journal is not None and recover_from_journal(journal, get_safe_path(map_path), recovery, logger, store=store):
+        fs.invalidate()  # 復原直接動過檔案，目錄快取重新列舉
 
-    truncation_map = load_truncation_map(get_safe_path(map_path))
+    if store is not None:
+        truncation_map = load_truncation_map_from_store(store)
+        indices = StoreIndices(store)
+    else:
+        truncation_map = load_truncation_map(get_safe_path(map_path), fs)
+        indices = build_indices_from_map(truncation_map)
     map_count_before = len(truncation_map) 
-    indices = build_indices_from_map(truncation_map)
+    keys_before = set(truncation_map)
     stats = Stats()
+    plan = RenamePlan(iter_vault_md_files(vault_path, fs), uid_scheme=uid_scheme, fs=fs)
 
-    # ---------- Pass 1: Case A / B ----------
-    for path in iter_vault_md_files(vault_path):
-        if is_temp_file(path):
-            continue  # 第一輪跳過 Case C
-
-        lines = read_lines(path)
-        content_lines = skip_yaml(lines)
-        line = first_nonempty_line(content_lines)
-        cleaned = clean_markdown_line(line)
-        base_filename = path.stem
-
-        if (uid := uid_for_path(path)) is not None:
-            handle_uid_named_file(path, cleaned, truncation_map, indices, stats, logger)     # Case A
-        else:
-            handle_general_named_file(path, base_filename, cleaned, truncation_map, indices, stats, logger)  # Case B
-
-    # （可選）Checkpoint：第一輪後先存一次，便於復原／審計
-    # save_truncation_map(get_safe_path(map_path), truncation_map)
-    # logger.save()
+    plan_uid_renames(plan, truncation_map, indices, stats, logger)
 
-    # 重要：第一輪可能改了 map/檔名，第二輪前重建索引
-    indices = build_indices_from_map(truncation_map)
+    map_inserts = [(k, v) for k, v in truncation_map.items() if k not in keys_before]
+    vault_root = os.path.abspath(vault_path)
 
-    # ---------- Pass 2: Case C ----------
-    for path in iter_vault_md_files(vault_path):
-        if not is_temp_file(path):
-            continue  # 只處理 temp
+    def rel(path) -> str:
+        return os.path.relpath(str(path), vault_root)
 
-        lines = read_lines(path)
-        content_lines = skip_yaml(lines)
-        line = first_nonempty_line(content_lines)
-        cleaned = clean_markdown_line(line)
-
-        handle_temp_file(path, cleaned, truncation_map, indices, stats, logger)  # Case C
+    for op in plan.iter_apply(journal=journal, map_inserts=map_inserts):
+        if op["op"] == "delete":
+            yield ChangeEvent(DELETED, "uid", rel(op["path"]))
+        elif op["op"] == "headline":
+            yield ChangeEvent(REWRITTEN, "uid", rel(op["path"]))
+        else:
+            yield ChangeEvent(RENAMED, "uid", rel(op["src"]), new_path=rel(op["dst"]))
+    fs.sync()  # 檔案操作落盤後才 commit 日誌
 
     log_stats_summary(logger, stats, truncation_map, map_count_before=map_count_before)
-    save_truncation_map(get_safe_path(map_path), truncation_map)
+    if store is not None:
+        store.conn.commit()  # 本次新增條目（register 時已寫入）一次提交
+    save_truncation_map(get_safe_path(map_path), truncation_map, fs)
+    if journal is not None and journal.exists():
+        journal.commit()
+    final_paths = {f.name: plan.path_of(f) for f in plan.files if not f.deleted and f.name is not None}
+    for key, entry in map_inserts:
+        path = final_paths.get(f"{entry.uid}.md")
+        yield ChangeEvent(
+            UID_ASSIGNED, "uid", rel(path) if path is not None else f"{entry.uid}.md",
+            uid=entry.uid, full_sentence=entry.full_sentence,
+        )
+    if delta_path:
+        delta = compute_truncation_delta(before, truncation_map)
+        pending = load_pending_truncation_delta(delta_path, fs)
+        if pending is not None:
+            # 上次的 delta 尚未被第 7 步消化 → 合併；它若不是對應執行前的 map，合併結果也不可信 → 標為過期（第 7 步全量處理）
+            stale = pending.get("map_sha1") is None or pending.get("map_sha1") != map_sha1_before
+            delta = merge_truncation_delta(pending, delta, truncation_map)
+            logger.log(f"  - 併入尚未處理的 delta{'（已過期，第 7 步將全量處理）' if stale else ''}")
+        else:
+            stale = False
+        delta["map_sha1"] = None if stale else truncation_map_sha1(get_safe_path(map_path), fs)
+        save_truncation_delta(delta_path, delta, fs)
+        logger.log(
+            f"  - delta: added={len(delta['added'])}, changed={len(delta['changed'])}, "
+            f"retargeted={len(delta['retargeted'])} → {delta_path}"
+        )
+    if store is not None:
+        store.close()
     logger.save()
     return truncation_map
 
@@ -0,0 +1,510 @@
+# src/conversion_daemon.py
+
+import os
+import json
+import time
+import socket
+import socketserver
+from collections import Counter
+from itertools import islice
+from pathlib import Path
+
+from build_uid_map_for_truncated_titles import (
+    UID_SCHEME, RenamePlan, Stats, build_indices_from_map, load_truncation_map, log_event, plan_uid_renames,
+    recover_from_journal, save_truncation_map,
+)
+from convert_links_to_wikilinks import build_rename_name_map, normalize_filename
+from ingest_heptabase_backup import (
+    DirBackupSource, card_headline, load_ingest_manifest, read_headline, resolve_previous_output,
+    save_ingest_manifest, transform_card,
+)
+from rewrite_links_with_uid_alias import (
+    PREFIX_MATCH_MIN_BYTES, UidLinkResolver, build_title_trie, log_rewritten_file, rewrite_file_links,
+)
+from sanitize_md_filenames import pick_free_name
+from utils.backlink_index import BacklinkIndex, extract_link_targets, file_signature
+from utils.filename_tail import split_invalid_tail
+from utils.get_safe_path import get_safe_path
+from utils.logger import Logger
+from utils.undo_journal import UndoJournal
+from utils.vault_fs import VaultFS
+from utils.write_ahead_journal import WriteAheadJournal
+
+
+SOCKET_NAME = "daemon.sock"
+# 與 main.py 的 pipeline 共用的狀態檔（皆位於 log_dir）
+RENAME_MAP_NAME = "rename_map.json"
+INDENT_UNIT_MAP_NAME = "indent_unit_map.json"
+TRUNCATION_MAP_NAME = "truncation_map.json"
+BACKLINK_INDEX_NAME = "backlink_index.json"
+INGEST_MANIFEST_NAME = "ingest_manifest.json"
+STATE_NAMES = (RENAME_MAP_NAME, INDENT_UNIT_MAP_NAME, TRUNCATION_MAP_NAME, INGEST_MANIFEST_NAME)
+
+
+def _load_json(path, default):
+    if not os.path.exists(get_safe_path(path)):
+        return default
+    with open(get_safe_path(path), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_json(path, data):
+    p = get_safe_path(path)
+    os.makedirs(os.path.dirname(p), exist_ok=True)
+    tmp = p + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, p)
+
+
+class ConversionDaemon:
+    """常駐轉換程式：狀態常駐記憶體，單張（或少量）卡片的第 1–7 步只處理受影響的檔案。
+
+    常駐內容：匯入 manifest、改名對照表、縮排單位表、truncation_map 與其 Indices、前綴樹與筆記名稱、
+    反向連結索引、Vault 目錄快取。每次 convert 後就地更新，不重新走訪 Vault。
+
+    - 匯出資料夾（export_dir）的相對路徑即 manifest 的 key（與 ingest_heptabase_backup 相同）；
+      已轉換過的卡片依 manifest 找回上次的輸出位置（含第 6 步的 uid 檔名）直接覆寫，首句改變時移除舊輸出
+    - 第 6 步只規劃卡片所在資料夾，第一輪只處理本次寫入的卡片，讓位與殘留 temp 照常由 Case C 收尾；
+      檔案操作與 map 新增條目照樣先寫預寫日誌
+    - 第 7 步：本次寫入／改名的檔案以完整 map 改寫；其他檔案只改寫連到新條目（含前綴比對）的連結，
+      由反向連結索引找出
+    - 狀態檔（map、manifest 等）每次 convert 後寫回；反向連結索引只在記憶體維護（下次 pipeline 執行會依簽章自行補上）
+    - 狀態檔被外部改動（pipeline 重跑、rollback）時，下一個請求前自動重新載入
+    - undo=True 時每次 convert 記為一次還原日誌（python main.py rollback 可撤銷）
+    - Vault 在常駐期間被其他程式修改時，送 refresh 請求讓反向連結索引與目錄快取重新比對
+    """
+
+    def __init__(
+        self,
+        vault_path,
+        export_dir,
+        log_dir,
+        verbose=False,
+        uid_scheme=UID_SCHEME,
+        prefix_match=True,
+        prefix_min_bytes=PREFIX_MATCH_MIN_BYTES,
+        mark_symbol="@",
+        spaces_per_indent=4,
+        fallback_indent=4,
+        threshold=0.5,
+        undo=True,
+        undo_keep_runs=10,
+    ):
+        self.vault_path = os.path.abspath(vault_path)
+        self.export_dir = os.path.abspath(export_dir)
+        self.log_dir = log_dir
+        self.verbose = verbose
+        self.uid_scheme = uid_scheme
+        self.prefix_match = prefix_match
+        self.prefix_min_bytes = prefix_min_bytes
+        self.mark_symbol = mark_symbol
+        self.spaces_per_indent = spaces_per_indent
+        self.fallback_indent = fallback_indent
+        self.threshold = threshold
+        self.undo = undo
+        self.undo_keep_runs = undo_keep_runs
+        self.load()
+
+    def _path(self, name):
+        return os.path.join(self.log_dir, name)
+
+    # ===== 載入 =====
+    def load(self):
+        """由磁碟載入全部狀態（啟動、reload、狀態檔被外部改動時）。"""
+        started = time.perf_counter()
+        logger = Logger(log_path=self._path("daemon_load.log"), verbose=self.verbose, title="Conversion Daemon Load Log")
+        map_path = self._path(TRUNCATION_MAP_NAME)
+
+        self.fs = VaultFS(self.vault_path, fsync="batch")
+        self.source = DirBackupSource(self.export_dir)
+        if recover_from_journal(WriteAheadJournal(f"{map_path}.journal"), get_safe_path(map_path), "replay", logger):
+            self.fs.invalidate()
+
+        self.rename_map = _load_json(self._path(RENAME_MAP_NAME), {})
+        self.rename_name_map = build_rename_name_map(self.rename_map)
+        self.indent_unit_map = _load_json(self._path(INDENT_UNIT_MAP_NAME), {})
+        self.cards = load_ingest_manifest(self._path(INGEST_MANIFEST_NAME))
+        self.truncation_map = load_truncation_map(get_safe_path(map_path))
+        self.indices = build_indices_from_map(self.truncation_map)
+
+        def entry_by_key(key):
+            entry = self.truncation_map.get(key)
+            return entry.to_dict() if entry is not None else None
+
+        self._title_refs = Counter()  # 筆記名稱 → 檔案數（同名檔案分屬不同資料夾時，移除一個不影響另一個）
+        self.resolver = UidLinkResolver(entry_by_key, self.indices.uid_for_full, note_titles=self._title_refs.keys())
+        if self.prefix_match:
+            self.resolver.trie = build_title_trie(
+                ((k, v.uid, v.full_sentence) for k, v in self.truncation_map.items()), self.prefix_min_bytes
+            )
+            self._collect_titles()
+
+        self.index = BacklinkIndex.load(self._path(BACKLINK_INDEX_NAME))
+        self.index.refresh(self.vault_path)
+        self._state_sigs = self._state_signatures()
+        logger.log(
+            f"🔥 已載入：{len(self.cards)} 個 manifest 項目、{len(self.truncation_map)} 筆 map 條目、"
+            f"{len(self.index)} 個已索引檔案（{(time.perf_counter() - started) * 1000:.0f} ms）"
+        )
+        logger.save()
+
+    def refresh(self):
+        """Vault 被其他程式改動後：目錄快取重新列舉、反向連結索引依簽章重新比對。"""
+        self.fs.invalidate()
+        reindexed, removed = self.index.refresh(self.vault_path)
+        if self.prefix_match:
+            self._collect_titles()
+        return {"reindexed": len(reindexed), "removed": len(removed)}
+
+    def _state_signatures(self):
+        sigs = {}
+        for name in STATE_NAMES:
+            path = self._path(name)
+            sigs[name] = file_signature(path) if os.path.exists(get_safe_path(path)) else None
+        return sigs
+
+    def _reload_if_stale(self):
+        if self._state_sigs != self._state_signatures():
+            if self.verbose:
+                print("🔄 狀態檔已被外部更新，重新載入")
+            self.load()
+
+    # ===== 筆記名稱（同 collect_note_titles；前綴比對時，連結文字本身是既有筆記就不解析） =====
+    def _collect_titles(self):
+        self._title_refs.clear()
+        for root, _, files in self.fs.walk():
+            for file in files:
+                if file.endswith(".md"):
+                    self._add_title(os.path.relpath(os.path.join(root, file), self.vault_path))
+
+    def _add_title(self, rel_path):
+        rel = rel_path[:-3]
+        self._title_refs[rel.replace(os.sep, "/")] += 1
+        self._title_refs[os.path.basename(rel)] += 1
+
+    def _drop_title(self, rel_path):
+        rel = rel_path[:-3]
+        for title in (rel.replace(os.sep, "/"), os.path.basename(rel)):
+            self._title_refs[title] -= 1
+            if self._title_refs[title] <= 0:
+                del self._title_refs[title]
+
+    # ===== 轉換 =====
+    def source_rel(self, path):
+        """請求中的卡片路徑（絕對，或相對於匯出資料夾）→ 匯出資料夾內的相對路徑。"""
+        full_path = os.path.abspath(os.path.join(self.export_dir, path))
+        rel = os.path.relpath(full_path, self.export_dir)
+        if rel == os.curdir or rel.startswith(os.pardir + os.sep) or rel == os.pardir:
+            raise ValueError(f"不在匯出資料夾內：{path}")
+        if not os.path.isfile(get_safe_path(full_path)):
+            raise FileNotFoundError(f"找不到檔案：{full_path}")
+        return rel
+
+    def convert(self, paths):
+        """轉換匯出資料夾內的卡片／附件（第 1–7 步）。
+
+        Returns:
+            dict: {"outputs": {來源相對路徑: 最終輸出相對路徑或 None（重複而刪除）},
+                   "unchanged": [...], "rewritten": [...], "new_entries": int, "ms": float}
+        """
+        started = time.perf_counter()
+        self._reload_if_stale()
+        rels = list(dict.fromkeys(self.source_rel(p) for p in paths))
+        logger = Logger(log_path=self._path("daemon_convert.log"), verbose=self.verbose, title="Conversion Daemon Log")
+
+        journal = None
+        if self.undo:
+            journal = UndoJournal.start(
+                self._path("undo"), self.vault_path,
+                state_paths=[self._path(name) for name in STATE_NAMES], keep_runs=self.undo_keep_runs,
+            )
+            self.fs.undo = journal
+        try:
+            result = self._convert(rels, logger)
+        except BaseException:
+            self._state_sigs = None  # 記憶體狀態可能與磁碟不一致 → 下個請求重新載入
+            raise
+        finally:
+            if journal is not None:
+                self.fs.undo = None
+                journal.finish()
+            logger.save()
+        self._state_sigs = self._state_signatures()
+        result["ms"] = round((time.perf_counter() - started) * 1000, 1)
+        logger.log(f"\n⏱️ {result['ms']} ms")
+        logger.save()
+        return result
+
+    def _convert(self, rels, logger):
+        log = logger.log
+        vault = self.vault_path
+
+        # 目標資料夾可能在請求之間被其他程式改動：列舉快取只對這些資料夾重新 scandir
+        for dir_rel in {os.path.dirname(self.rename_map.get(rel, rel)) for rel in rels}:
+            self.fs.invalidate(os.path.join(vault, dir_rel))
+
+        # ---------- 第 1 步：檔名（沿用上次的改名；新卡片依 Vault 資料夾現有名稱挑選） ----------
+        jobs, unchanged, planned = [], [], {}
+        for rel in rels:
+            fp = self.source.fingerprint(rel)
+            prev = self.cards.get(rel)
+            out = None
+            if prev is not None:
+                out = resolve_previous_output(vault, prev, self.indices.uid_for_full)
+                if out is not None and rel.endswith(".md") and read_headline(os.path.join(vault, out)) != prev.get("headline"):
+                    out = None  # 首句被第 6 步加上 (n) 等：輸出檔對不上這張卡片
+            if prev is not None and out is not None and prev["fp"] == fp:
+                unchanged.append(rel)
+                log(f"☑️ 未變動：{rel}")
+                continue
+
+            stage = self.rename_map.get(rel, rel)
+            dir_rel, name = os.path.split(rel)
+            if rel not in self.rename_map and name.endswith(".md"):
+                clean_base, trailing = split_invalid_tail(name[:-3])
+                if trailing:
+                    taken = set(self.fs.listdir(os.path.join(vault, dir_rel))) | planned.setdefault(dir_rel, set())
+                    stage = os.path.join(dir_rel, pick_free_name(taken, clean_base, ".md"))
+                    planned[dir_rel].add(os.path.basename(stage))
+                    self.rename_map[rel] = stage
+                    self.rename_name_map[normalize_filename(rel)] = normalize_filename(stage)
+                    log(f"🔁 重新命名: {rel} → {stage}")
+            jobs.append((rel, fp, prev, out, stage))
+
+        # ---------- 第 2–5 步：記憶體轉換、寫入一次 ----------
+        written = {}  # 寫入的 .md（Vault 相對路徑）→ 來源相對路徑
+        for rel, fp, prev, out, stage in jobs:
+            self.fs.makedirs(os.path.dirname(os.path.join(vault, stage)))
+            if not rel.endswith(".md"):
+                self.source.put_attachment(rel, self.fs, os.path.join(vault, stage))
+                self.cards[rel] = {"fp": fp, "stage": stage}
+                log(f"📎 附件：{rel} → {stage}")
+                continue
+
+            content, unit = transform_card(
+                self.source.read_text(rel), stage, self.rename_name_map, log,
+                self.spaces_per_indent, self.fallback_indent, self.threshold,
+            )
+            headline = card_headline(content)
+            target = stage
+            if out is not None and headline == prev.get("headline"):
+                target = out  # 首句不變：覆寫上次的輸出（含 uid 檔名）
+            elif out is not None and out != stage:
+                self.fs.remove(os.path.join(vault, out))
+                self.index.remove_file(out)
+                self._drop_title(out)
+                log(f"🗑️ 首句已變更，移除舊輸出：{out}")
+
+            target_path = os.path.join(vault, target)
+            if not self.fs.exists(target_path):
+                self._add_title(target)
+            self.fs.write_text(target_path, content)
+            self.index.update_file(target, content, file_signature(target_path))
+            self.indent_unit_map[target] = unit
+            self.cards[rel] = {
+                "fp": fp,
+                "stage": stage,
+                "headline": headline,
+                "links": sorted(extract_link_targets(content)),
+            }
+            written[target] = rel
+            log(f"✅ {rel} → {target}")
+        self.fs.sync()
+
+        # ---------- 第 6 步：只規劃卡片所在資料夾 ----------
+        map_path = get_safe_path(self._path(TRUNCATION_MAP_NAME))
+        count_before = len(self.truncation_map)
+        origins = {}  # 規劃中的原始路徑 → Vault 相對路徑
+        for dir_rel in sorted({os.path.dirname(rel) for rel in written}):
+            for name, is_dir in list(self.fs.listdir(os.path.join(vault, dir_rel)).items()):
+                if not is_dir and name.lower().endswith(".md"):
+                    origins[Path(get_safe_path(os.path.join(vault, dir_rel, name)))] = os.path.join(dir_rel, name)
+        plan = RenamePlan(origins, uid_scheme=self.uid_scheme, fs=self.fs)
+        only = {origin for origin, rel in origins.items() if rel in written}
+        plan_uid_renames(plan, self.truncation_map, self.indices, Stats(), logger, only=only)
+        new_keys = list(islice(reversed(self.truncation_map), len(self.truncation_map) - count_before))[::-1]
+        wal = WriteAheadJournal(f"{map_path}.journal")
+        plan.apply(journal=wal, map_inserts=[(k, self.truncation_map[k]) for k in new_keys])
+        self.fs.sync()
+        if new_keys:
+            save_truncation_map(map_path, self.truncation_map)
+        if wal.exists():
+            wal.commit()
+
+        # 索引跟上第 6 步的刪除／改名／首句寫回
+        full_scope = set()
+        outputs = {}
+        for f in plan.files:
+            old_rel = origins[f.origin]
+            src_rel = written.get(old_rel)
+            if f.deleted:
+                self.index.remove_file(old_rel)
+                self._drop_title(old_rel)
+                if src_rel is not None:
+                    outputs[src_rel] = None
+                continue
+            new_rel = os.path.join(os.path.dirname(old_rel), f.name)
+            if new_rel != old_rel:
+                self.index.remove_file(old_rel)
+                self._drop_title(old_rel)
+                self._add_title(new_rel)
+                if old_rel in self.indent_unit_map:
+                    self.indent_unit_map[new_rel] = self.indent_unit_map.pop(old_rel)
+            if new_rel != old_rel or f.headline is not None or src_rel is not None:
+                self.index.reindex_file(os.path.join(vault, new_rel), new_rel)
+                full_scope.add(new_rel)
+            if src_rel is not None:
+                outputs[src_rel] = new_rel
+        for src_rel, out_rel in outputs.items():
+            if out_rel is None:
+                log(f"♻️ {src_rel}：與既有卡片完全相同，已刪除重複輸出")
+            elif out_rel != self.cards[src_rel]["stage"]:
+                log_event(logger, action="daemon-output", src=Path(src_rel), dst=Path(out_rel))
+
+        # ---------- 第 7 步：新卡片全量；其他檔案只改寫連到新條目的連結 ----------
+        new_entries = [(k, self.truncation_map[k]) for k in new_keys]
+        if new_entries and self.resolver.trie is not None:
+            for key, entry in new_entries:
+                self.resolver.trie.insert(entry.full_sentence, key)
+                self.resolver.trie.insert(key, key)
+            self.resolver.forget()
+        delta_keys = {k for k, _ in new_entries}
+        delta_fulls = {e.full_sentence for _, e in new_entries}
+        delta_uids = {e.uid for _, e in new_entries}
+        candidates = (
+            self.index.files_linking_to_any(delta_keys | delta_uids)
+            | self.index.files_linking_to_any(self._prefix_targets(new_entries))
+        ) - full_scope
+
+        rewritten = []
+        delta_lookups = self.resolver.delta_lookups(delta_keys, delta_fulls)
+        for rel_path, lookups in [(r, self.resolver.lookups()) for r in sorted(full_scope)] + [
+            (r, delta_lookups) for r in sorted(candidates)
+        ]:
+            found = rewrite_file_links(
+                self.fs, os.path.join(vault, rel_path), rel_path, lookups, self.mark_symbol, self.index
+            )
+            if found:
+                rewritten.append(rel_path)
+                log_rewritten_file(log, rel_path, found)
+        self.fs.sync()
+
+        # ---------- 狀態檔寫回 ----------
+        if self.rename_map:
+            _save_json(self._path(RENAME_MAP_NAME), self.rename_map)
+        _save_json(self._path(INDENT_UNIT_MAP_NAME), self.indent_unit_map)
+        save_ingest_manifest(self._path(INGEST_MANIFEST_NAME), self.cards)
+
+        log(
+            f"\n📊 轉換 {len(outputs)} 張卡片、{len(jobs) - len(written)} 個附件；未變動 {len(unchanged)}；"
+            f"新增 map 條目 {len(new_keys)}；改寫連結的檔案 {len(rewritten)}（候選 {len(candidates)}）"
+        )
+        return {"outputs": outputs, "unchanged": unchanged, "rewritten": rewritten, "new_entries": len(new_keys)}
+
+    def _prefix_targets(self, entries):
+        """索引中可能以前綴比對解析到這些條目的連結目標（full_sentence / key 的前綴）。"""
+        if self.resolver.trie is None:
+            return set()
+        targets = self.index.targets()
+        found = set()
+        for key, entry in entries:
+            for text in (entry.full_sentence, key):
+                size = 0
+                for i, ch in enumerate(text):
+                    size += len(ch.encode("utf-8"))
+                    if size >= self.prefix_min_bytes and text[:i + 1] in targets:
+                        found.add(text[:i + 1])
+        return found
+
+    # ===== 請求分派 =====
+    def handle(self, request):
+        op = request.get("op")
+        if op == "ping":
+            return {"ok": True, "pid": os.getpid(), "cards": len(self.cards), "map_entries": len(self.truncation_map)}
+        if op == "convert":
+            paths = request.get("paths") or []
+            if not paths:
+                return {"ok": False, "error": "convert 需要 paths"}
+            return {"ok": True, **self.convert(paths)}
+        if op == "refresh":
+            return {"ok": True, **self.refresh()}
+        if op == "reload":
+            self.load()
+            return {"ok": True}
+        if op == "shutdown":
+            return {"ok": True}
+        return {"ok": False, "error": f"未知的操作：{op}"}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """一行一個 JSON 請求、一行一個 JSON 回應；同一連線可送多個請求。"""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            op = None
+            try:
+                request = json.loads(line)
+                op = request.get("op")
+                response = self.server.daemon.handle(request)
+            except Exception as e:
+                response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            self.wfile.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+            self.wfile.flush()
+            if op == "shutdown":
+                self.server.stopping = True
+                return
+
+
+def serve(daemon, socket_path):
+    """在 Unix socket 上依序處理請求（單執行緒：請求之間不會交錯改寫狀態），直到收到 shutdown。"""
+    if not hasattr(socket, "AF_UNIX"):
+        raise OSError("此平台不支援 Unix socket")
+    socket_path = os.path.abspath(socket_path)
+    if os.path.exists(socket_path):
+        try:
+            send_request(socket_path, {"op": "ping"}, timeout=1)
+        except OSError:
+            os.remove(socket_path)  # 前次未正常結束留下的 socket 檔
+        else:
+            raise OSError(f"已有常駐程式在執行：{socket_path}")
+
+    server = socketserver.UnixStreamServer(socket_path, _RequestHandler)
+    server.daemon = daemon
+    server.stopping = False
+    os.chmod(socket_path, 0o600)
+    if daemon.verbose:
+        print(f"🟢 常駐程式已啟動：{socket_path}")
+    try:
+        while not server.stopping:
+            server.handle_request()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+    if daemon.verbose:
+        print("🛑 常駐程式已結束")
+
+
+def send_request(socket_path, request, timeout=None):
+    """送出單一請求並等待回應（main.py convert 使用）。"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError("常駐程式未回應")
+    return json.loads(line)
+
+
+if __name__ == "__main__":
+    BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    VAULT_PATH = os.path.join(BASE_DIR, "TestData")
+    EXPORT_DIR = os.path.join(BASE_DIR, "Export")
+    LOG_DIR = os.path.join(BASE_DIR, "log")
+
+    serve(ConversionDaemon(VAULT_PATH, EXPORT_DIR, LOG_DIR, verbose=True), os.path.join(LOG_DIR, SOCKET_NAME))
@@ -5,7 +5,17 @@ import re
 import json
 from datetime import datetime
 from urllib.parse import unquote
-from utils.get_safe_path import get_safe_path  # ← 確保 utils.py 有這個 function
+from utils.byte_prefilter import contains_in_order
+from utils.change_events import LINKS_CONVERTED, ChangeEvent, drain
+from utils.state_store import StateStore
+from utils.vault_fs import VaultFS
+
+
+# 前置過濾：要有 "](" 且其後出現 ".md)" 才可能有 markdown link 可轉
+MD_LINK_PREFILTER = contains_in_order(b"](", b".md)")
+
+MD_PATTERN = re.compile(r'(?<!\!)\[(.+?)\]\((.+?\.md)\)', re.DOTALL)
+YAML_PATTERN = re.compile(r'"?\[(.+?)\]\((.+?\.md)\)"?', re.DOTALL)
 
 
 def normalize_filename(link: str) -> str:
@@ -40,62 +50,79 @@ def shared_replace_function(rename_name_map, log, wrap_in_quotes=False):
     return replace
 
 
-def convert_links_to_wikilinks(vault_path, rename_map_path=None, log_path=None, verbose=False):
-    changed_files = []
-    rename_map = {}
+def convert_markdown_links(content, rename_name_map, log):
+    """單份內容：markdown link（含 YAML 內帶引號者）→ [[wikilink]]。回傳 (新內容, 轉換數)。"""
+    content, n1 = MD_PATTERN.subn(shared_replace_function(rename_name_map, log, wrap_in_quotes=False), content)
+    content, n2 = YAML_PATTERN.subn(shared_replace_function(rename_name_map, log, wrap_in_quotes=True), content)
+    return content, n1 + n2
 
-    if rename_map_path and os.path.exists(rename_map_path):
-        rename_map_path = get_safe_path(rename_map_path)
-        with open(rename_map_path, "r", encoding="utf-8") as f:
-            rename_map = json.load(f)
 
-    rename_name_map = {
+def build_rename_name_map(rename_map):
+    """{原相對路徑: 新相對路徑} → {原名稱: 新名稱}（去副檔名、解 URL 編碼）。"""
+    return {
         normalize_filename(orig): normalize_filename(new)
         for orig, new in rename_map.items()
     }
 
+
+def convert_links_to_wikilinks(vault_path, rename_map_path=None, log_path=None, verbose=False, state_db_path=None, fs=None):
+    return drain(iter_convert_links_to_wikilinks(vault_path, rename_map_path, log_path, verbose, state_db_path, fs))
+
+
+def iter_convert_links_to_wikilinks(
+    vault_path, rename_map_path=None, log_path=None, verbose=False, state_db_path=None, fs=None
+):
+    """convert_links_to_wikilinks 的串流版：每改寫一份卡片就 yield ChangeEvent(links_converted, count=處數)；
+    generator 的 return 值同 convert_links_to_wikilinks（有改寫的檔案）。
+    """
+    fs = fs or VaultFS(vault_path)
+    changed_files = []
+    rename_map = {}
+
+    if state_db_path:
+        store = StateStore(state_db_path)
+        rename_map = store.rename_map()
+        store.close()
+
+    if not rename_map and rename_map_path:
+        text = fs.read_state(rename_map_path)
+        if text is not None:
+            rename_map = json.loads(text)
+
+    rename_name_map = build_rename_name_map(rename_map)
+
     def log(msg):
         if log_path:
-            os.makedirs(os.path.dirname(log_path), exist_ok=True)
-            safe_log_path = get_safe_path(log_path)
-            with open(safe_log_path, "a", encoding="utf-8") as f:
-                f.write(msg + "\n")
+            fs.append_state(log_path, msg + "\n")
         if verbose:
             print(msg)
 
-    md_pattern = re.compile(r'(?<!\!)\[(.+?)\]\((.+?\.md)\)', re.DOTALL)
-    yaml_pattern = re.compile(r'"?\[(.+?)\]\((.+?\.md)\)"?', re.DOTALL)
-
-    def convert(content):
-        content, n1 = md_pattern.subn(shared_replace_function(rename_name_map, log, wrap_in_quotes=False), content)
-        content, n2 = yaml_pattern.subn(shared_replace_function(rename_name_map, log, wrap_in_quotes=True), content)
-        return content, n1 + n2
-
     if log_path:
-        safe_log_path = get_safe_path(log_path)
-        with open(safe_log_path, "w", encoding="utf-8") as f:
-            f.write(f"🔗 Link Conversion Log — {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+        fs.write_state(log_path, f"🔗 Link Conversion Log — {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
 
-    for root, _, files in os.walk(vault_path):
+    for root, _, files in fs.walk(vault_path):
         for file in files:
             if file.endswith(".md"):
                 full_path = os.path.join(root, file)
-                safe_full_path = get_safe_path(full_path)
                 rel_path = os.path.relpath(full_path, vault_path)
 
-                with open(safe_full_path, "r", encoding="utf-8") as f:
-                    content = f.read()
+                if not fs.may_match(full_path, MD_LINK_PREFILTER):
+                    log(f"☑️ {rel_path}：無需修改")
+                    continue
+
+                content = fs.read_text(full_path)
 
-                new_content, count = convert(content)
+                new_content, count = convert_markdown_links(content, rename_name_map, log)
 
                 if new_content != content:
-                    with open(safe_full_path, "w", encoding="utf-8") as f:
-                        f.write(new_content)
+                    fs.write_text(full_path, new_content)
                     changed_files.append(rel_path)
                     log(f"✅ {rel_path}：修正 {count} 處")
+                    yield ChangeEvent(LINKS_CONVERTED, "links", rel_path, count=count)
                 else:
                     log(f"☑️ {rel_path}：無需修改")
 
+    fs.sync()
     log(f"\n🎉 共更新 {len(changed_files)} 個檔案的 markdown link。" if changed_files else f"✅ 共更新 {len(changed_files)} 個檔案的 markdown link，沒有發現可轉換的 markdown link。")
     return changed_files
 
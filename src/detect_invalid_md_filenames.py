@@ -1,13 +1,14 @@
 # src/detect_invalid_md_filenames.py
 
 import os
-import unicodedata
 from datetime import datetime
+from sanitize_md_filenames import iter_filename_fixes
 
 def detect_invalid_md_filenames(vault_path, log_path=None, verbose=False):
     """
     掃描指定 Vault 目錄下的所有 .md 檔案，找出尾端包含非法字元的檔案。
     非法字元包括空白、句號、控制碼（如 \u200B, \u00A0, \u3000）。
+    （只偵測不改名；pipeline 改用 sanitize_md_filenames 一次完成偵測與改名）
 
     Args:
         vault_path (str): Vault 根目錄
@@ -22,28 +23,15 @@ def detect_invalid_md_filenames(vault_path, log_path=None, verbose=False):
             "path": 完整路徑
         }
     """
-    results = []
-
-    def is_invalid_tail_char(char):
-        return char in {" ", ".", "\u200B", "\u00A0", "\u3000"} or unicodedata.category(char).startswith("C")
-
-    for root, _, files in os.walk(vault_path):
-        for file in files:
-            if file.endswith(".md"):
-                base_name = file[:-3]
-                trailing = ""
-                i = len(base_name) - 1
-                while i >= 0 and is_invalid_tail_char(base_name[i]):
-                    trailing = base_name[i] + trailing
-                    i -= 1
-
-                if trailing:
-                    results.append({
-                        "filename": file,
-                        "trailing": trailing,
-                        "trailing_unicode": "".join(f"\\u{ord(c):04x}" for c in trailing),
-                        "path": os.path.join(root, file)
-                    })
+    results = [
+        {
+            "filename": fix.filename,
+            "trailing": fix.trailing,
+            "trailing_unicode": fix.trailing_unicode,
+            "path": fix.path
+        }
+        for fix in iter_filename_fixes(vault_path, apply=False)
+    ]
 
     if log_path:
         with open(log_path, "w", encoding="utf-8") as f:
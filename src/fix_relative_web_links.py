@@ -1,6 +1,11 @@
 import os
 import re
 from datetime import datetime
+from utils.byte_prefilter import file_may_match
+
+# 前置過濾：]( 之後緊接非 http(s) 的網域樣式，才可能有要補 https:// 的連結
+WEB_LINK_PREFILTER = re.compile(rb'\]\((?!https?://)[a-zA-Z0-9.-]+\.[a-z]{2,}')
+
 
 def fix_relative_web_links(vault_path, log_path=None, verbose=False):
     pattern = re.compile(r'\[([^\]]+?)\]\(((?!https?://)[a-zA-Z0-9.-]+\.[a-z]{2,}[^)\s]*)\)')
@@ -26,6 +31,10 @@ def fix_relative_web_links(vault_path, log_path=None, verbose=False):
                 rel_path = os.path.relpath(full_path, vault_path)
                 scanned_files += 1
 
+                if not file_may_match(full_path, WEB_LINK_PREFILTER):
+                    log(f"☑️ {rel_path}：無需修改")
+                    continue
+
                 with open(full_path, 'r', encoding='utf-8') as f:
                     content = f.read()
 
@@ -0,0 +1,466 @@
+# src/ingest_heptabase_backup.py
+
+import io
+import os
+import json
+import hashlib
+import zipfile
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from analyze_indent_stat import analyze_file_indent
+from build_uid_map_for_truncated_titles import (
+    build_indices_from_map, clean_markdown_line, first_nonempty_line, load_truncation_map, skip_yaml,
+)
+from convert_links_to_wikilinks import build_rename_name_map, convert_markdown_links
+from preprocess_heptabase_yaml import preprocess_yaml_content
+from sanitize_md_filenames import pick_free_name
+from standardize_md_indentation import iter_standardized_lines
+from utils.backlink_index import extract_link_targets
+from utils.filename_tail import split_invalid_tail
+from utils.get_safe_path import get_safe_path
+from utils.change_events import CREATED, ChangeEvent, drain
+from utils.logger import Logger
+from utils.md_lexer import FRONTMATTER, LexedDoc, iter_lexed_lines, split_lines
+from utils.state_store import StateStore
+from utils.vault_fs import VaultFS, state_fs
+
+
+class ZipBackupSource:
+    """Heptabase 備份 zip：逐一讀取項目，不先解壓到磁碟。"""
+
+    def __init__(self, zip_path: str):
+        self.zf = zipfile.ZipFile(get_safe_path(zip_path))
+        self._infos: Dict[str, zipfile.ZipInfo] = {}
+        for info in self.zf.infolist():
+            if info.is_dir():
+                continue
+            rel = safe_relpath(member_name(info))
+            if rel is not None:
+                self._infos[rel] = info
+
+    def files(self) -> List[str]:
+        return list(self._infos)
+
+    def skipped(self) -> List[str]:
+        kept = {info.filename for info in self._infos.values()}
+        return [member_name(i) for i in self.zf.infolist() if not i.is_dir() and i.filename not in kept]
+
+    def fingerprint(self, rel: str) -> str:
+        """取自 zip 目錄的 CRC32 + 大小：不必解壓就能判斷與上次是否相同。"""
+        info = self._infos[rel]
+        return f"crc32:{info.CRC:08x}:{info.file_size}"
+
+    def read_text(self, rel: str) -> str:
+        # 與磁碟上文字模式讀取相同：\r\n、\r 一律轉成 \n
+        text = self.zf.read(self._infos[rel]).decode("utf-8")
+        return text.replace("\r\n", "\n").replace("\r", "\n")
+
+    def put_attachment(self, rel: str, fs: VaultFS, dst: str) -> None:
+        with self.zf.open(self._infos[rel]) as src:
+            fs.write_stream(dst, src)
+
+    def close(self) -> None:
+        self.zf.close()
+
+
+class DirBackupSource:
+    """已解壓的備份資料夾：.md 讀進記憶體處理，附件以硬連結放進目標 Vault。"""
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def files(self) -> List[str]:
+        result = []
+        for root, _, files in os.walk(self.root):
+            for file in files:
+                result.append(os.path.relpath(os.path.join(root, file), self.root))
+        return result
+
+    def skipped(self) -> List[str]:
+        return []
+
+    def fingerprint(self, rel: str) -> str:
+        h = hashlib.sha1()
+        with open(get_safe_path(os.path.join(self.root, rel)), "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return f"sha1:{h.hexdigest()}"
+
+    def read_text(self, rel: str) -> str:
+        with open(get_safe_path(os.path.join(self.root, rel)), "r", encoding="utf-8") as f:
+            return f.read()
+
+    def put_attachment(self, rel: str, fs: VaultFS, dst: str) -> None:
+        fs.link(os.path.join(self.root, rel), dst)
+
+    def close(self) -> None:
+        pass
+
+
+def member_name(info: zipfile.ZipInfo) -> str:
+    """zip 項目名稱。未標 UTF-8 旗標（0x800）時 zipfile 以 cp437 解碼，但 Info-ZIP、Windows 檔案總管
+    實際寫入的多半是 UTF-8 → 還原成 UTF-8；不是合法 UTF-8 才保留 cp437 的結果。"""
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode("cp437").decode("utf-8")
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+
+def safe_relpath(name: str):
+    """zip 內路徑 → 本機相對路徑；絕對路徑或跳出根目錄（..）的項目回傳 None。"""
+    rel = os.path.normpath(name.replace("\\", "/"))
+    if os.path.isabs(rel) or rel == ".." or rel.startswith(".." + os.sep) or rel == ".":
+        return None
+    return rel
+
+
+def plan_md_renames(rel_files: List[str], invalid_char_check=None) -> Dict[str, str]:
+    """第 1 步的純規劃版：依各資料夾內的名稱集合挑選不衝突的新檔名。回傳 {原相對路徑: 新相對路徑}（只含需改名者）。"""
+    listings: Dict[str, set] = {}
+    for rel in rel_files:
+        parts = rel.split(os.sep)
+        for depth in range(len(parts)):
+            listings.setdefault(os.sep.join(parts[:depth]), set()).add(parts[depth])
+
+    rename_map = {}
+    for rel in rel_files:
+        dir_rel, name = os.path.split(rel)
+        if not name.endswith(".md"):
+            continue
+        clean_base, trailing = split_invalid_tail(name[:-3], invalid_char_check)
+        if not trailing:
+            continue
+        taken = listings[dir_rel]
+        safe_name = pick_free_name(taken, clean_base, ".md")
+        taken.discard(name)
+        taken.add(safe_name)
+        rename_map[rel] = os.path.join(dir_rel, safe_name)
+    return rename_map
+
+
+# ===== 增量匯入：manifest =====
+MANIFEST_VERSION = 1
+
+
+def load_ingest_manifest(manifest_path: Optional[str], fs: Optional[VaultFS] = None) -> Dict[str, dict]:
+    """{來源相對路徑: {"fp", "stage", ["headline", "links"]}}；不存在或版本不符回傳空 dict（等同全量）。"""
+    if not manifest_path:
+        return {}
+    try:
+        text = state_fs(fs).read_state(get_safe_path(manifest_path))
+        if text is None:
+            return {}
+        raw = json.loads(text)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    if raw.get("version") != MANIFEST_VERSION:
+        return {}
+    return raw.get("cards", {})
+
+
+def save_ingest_manifest(manifest_path: str, cards: Dict[str, dict], fs: Optional[VaultFS] = None) -> None:
+    state_fs(fs).write_state(
+        get_safe_path(manifest_path),
+        json.dumps({"version": MANIFEST_VERSION, "cards": cards}, ensure_ascii=False, indent=2),
+        atomic=True,
+    )
+
+
+def card_headline(content: str) -> str:
+    """與第 6 步相同的首句（跳過 YAML、第一個非空行、清理 markdown）。"""
+    return clean_markdown_line(first_nonempty_line(skip_yaml(split_lines(content))))
+
+
+def read_headline(path: str) -> str:
+    """只讀到首句為止的 card_headline（逐行，不整檔載入）。"""
+    with open(get_safe_path(path), "r", encoding="utf-8", errors="ignore") as f:
+        for line, kind in iter_lexed_lines(f):
+            if kind != FRONTMATTER and line.strip():
+                return clean_markdown_line(line)
+    return clean_markdown_line("")
+
+
+def resolve_previous_output(previous_vault: str, entry: dict, uid_for_full: Callable[[str], Optional[str]]) -> Optional[str]:
+    """上次的輸出位置：原檔名仍在 → 原檔名；被第 6 步改成 uid → 以首句查上次的 map 得到 uid_XXX.md。找不到回傳 None。"""
+    stage = entry["stage"]
+    if os.path.exists(get_safe_path(os.path.join(previous_vault, stage))):
+        return stage
+    uid = uid_for_full(entry["headline"]) if entry.get("headline") else None
+    if uid:
+        out = os.path.join(os.path.dirname(stage), f"{uid}.md")
+        if os.path.exists(get_safe_path(os.path.join(previous_vault, out))):
+            return out
+    return None
+
+
+def links_touch(links: Iterable[str], names: Set[str]) -> bool:
+    """連結目標是否可能解析到 names 中的卡片（含前綴比對的截斷連結）。"""
+    for target in links:
+        if target in names or any(n.startswith(target) or target.startswith(n) for n in names):
+            return True
+    return False
+
+
+def _card_name(rel: str) -> str:
+    return os.path.splitext(os.path.basename(rel))[0]
+
+
+def transform_card(content, rel_path, rename_name_map, log, spaces_per_indent=4, fallback_indent=4, threshold=0.5, global_indent_diffs=None, stream=False):
+    """單張卡片在記憶體中依序套用第 2–5 步，結果與逐步寫回磁碟相同。回傳 (新內容, 縮排單位)。
+    stream=True（大檔）：第 4、5 步逐行走兩遍，不建 LexedDoc 的行列表。
+    """
+    # 2️⃣ 清理 YAML
+    cleaned = preprocess_yaml_content(content, log_fn=log)
+    if cleaned.strip() != content.strip():
+        content = cleaned
+    # 3️⃣ markdown link → wikilink
+    content, _ = convert_markdown_links(content, rename_name_map, log)
+    if stream:
+        # 4️⃣ 5️⃣ 逐行（與第 4、5 步串流大檔的切行相同）
+        unit, summary = analyze_file_indent(iter_lexed_lines(io.StringIO(content)), rel_path, fallback_indent, threshold, global_indent_diffs)
+        log(summary)
+        content = "".join(iter_standardized_lines(iter_lexed_lines(io.StringIO(content)), unit, spaces_per_indent))
+        return content, unit
+    # 4️⃣ 縮排單位
+    doc = LexedDoc(content)
+    unit, summary = analyze_file_indent(zip(doc.lines, doc.kinds), rel_path, fallback_indent, threshold, global_indent_diffs)
+    log(summary)
+    # 5️⃣ 統一縮排
+    content = "".join(iter_standardized_lines(zip(doc.lines, doc.kinds), unit, spaces_per_indent))
+    return content, unit
+
+
+def plan_reuse(rel_files, rename_map, fingerprints, previous_cards, previous_vault, truncation_map_path, log):
+    """決定哪些項目可沿用上次輸出。回傳 {來源相對路徑: (上次輸出相對路徑, manifest 條目)}。"""
+    uid_for_full = lambda _: None
+    if truncation_map_path and os.path.exists(get_safe_path(truncation_map_path)):
+        uid_for_full = build_indices_from_map(load_truncation_map(get_safe_path(truncation_map_path))).uid_for_full
+
+    reusable = {}
+    changed_names: Set[str] = set()
+    for rel in rel_files:
+        stage = rename_map.get(rel, rel)
+        prev = previous_cards.get(rel)
+        if prev is not None and prev["fp"] == fingerprints[rel] and prev["stage"] == stage:
+            if rel.endswith(".md"):
+                out = resolve_previous_output(previous_vault, prev, uid_for_full)
+                # 首句被第 6 步加上 (n) 等情況：輸出檔對不上這張卡片，不沿用
+                if out is not None and read_headline(os.path.join(previous_vault, out)) != prev.get("headline"):
+                    out = None
+            else:
+                out = stage if os.path.exists(get_safe_path(os.path.join(previous_vault, stage))) else None
+            if out is not None:
+                reusable[rel] = (out, prev)
+                continue
+        if rel.endswith(".md"):
+            changed_names.add(_card_name(stage))
+            if prev is not None:
+                changed_names.add(_card_name(prev["stage"]))
+
+    # 多張來源卡片對到同一個輸出（同首句重複卡片、被第 6 步合併或刪除）：無法判斷，全部重跑
+    claims = Counter(out for out, _ in reusable.values())
+    for rel in [r for r, (out, _) in reusable.items() if claims[out] > 1]:
+        del reusable[rel]
+        changed_names.add(_card_name(rename_map.get(rel, rel)))
+    present = set(rel_files)
+    for rel, prev in previous_cards.items():
+        if rel not in present and rel.endswith(".md"):
+            changed_names.add(_card_name(prev["stage"]))
+
+    # 連到變動卡片的沿用卡片：對方的 uid / 首句可能變了，連結 alias 要重新產生
+    if changed_names:
+        for rel in [r for r in reusable if r.endswith(".md")]:
+            if links_touch(reusable[rel][1].get("links", ()), changed_names):
+                del reusable[rel]
+                log(f"🔗 連到變動卡片，重新處理：{rel}")
+    log(f"♻️ 可沿用 {len(reusable)}/{len(rel_files)} 個項目；變動卡片名稱 {len(changed_names)} 個\n")
+    return reusable
+
+
+def ingest_heptabase_backup(
+    source_path,
+    target_path,
+    log_path=None,
+    verbose=False,
+    rename_map_path=None,
+    indent_unit_map_path=None,
+    invalid_char_check=None,
+    spaces_per_indent=4,
+    fallback_indent=4,
+    threshold=0.5,
+    state_db_path=None,
+    manifest_path=None,
+    previous_vault=None,
+    truncation_map_path=None,
+    fs=None,
+):
+    """
+    由 Heptabase 備份（.zip 或已解壓資料夾）直接產生 Vault：第 1–5 步在記憶體中完成，每張卡片只寫入一次。
+    附件不解碼：zip 項目以串流複製，資料夾來源則建立硬連結（無法連結時複製）。
+    第 6、7 步需要全 Vault 資訊，仍於匯入後在 target_path 上照常執行。
+
+    增量模式（previous_vault + manifest_path）：
+    - 來源指紋（zip CRC32 + 大小／資料夾 sha1）與規劃檔名都和上次相同的卡片，直接沿用上次的最終輸出
+      （含第 6 步的 uid 檔名與第 7 步改寫過的連結），不解碼、不重跑
+    - 連到新增／變動／刪除卡片的沿用卡片仍重跑（alias 可能過期）
+    - 之後的第 6 步沿用上次的 truncation_map.json，既有 uid_XXX 不變；第 1 步的改名由新備份的檔名重新規劃即可
+
+    Args:
+        source_path (str): 備份 zip 或解壓後的資料夾
+        target_path (str): 輸出的 Vault 資料夾（須不存在或為空）
+        log_path (str): 匯入 log
+        verbose (bool): 是否印出 log
+        rename_map_path (str): 若提供，輸出第 1 步的改名對照表 JSON
+        indent_unit_map_path (str): 若提供，輸出第 4 步的縮排單位對應表 JSON
+        invalid_char_check (callable): 自定非法尾端字元判斷
+        spaces_per_indent / fallback_indent / threshold: 同第 4、5 步
+        state_db_path (str): 若提供，改名對照表與縮排單位同時寫入 SQLite 狀態庫
+        manifest_path (str): 匯入 manifest（每張卡片的來源指紋、輸出位置、首句、連結）；提供即輸出供下次增量使用
+        previous_vault (str): 上次轉換完成的 Vault；與 manifest_path 同時提供時啟用增量模式
+        truncation_map_path (str): 上次的 truncation_map.json，用來找出被改成 uid 的輸出檔
+        fs (VaultFS): 目標 Vault 的檔案系統層；未提供則自建
+
+    Returns:
+        Tuple[int, int, dict, dict]: (卡片數, 附件數, rename_map, indent_unit_map)
+    """
+    return drain(iter_ingest_heptabase_backup(
+        source_path, target_path, log_path, verbose, rename_map_path, indent_unit_map_path, invalid_char_check,
+        spaces_per_indent, fallback_indent, threshold, state_db_path, manifest_path, previous_vault,
+        truncation_map_path, fs,
+    ))
+
+
+def iter_ingest_heptabase_backup(
+    source_path,
+    target_path,
+    log_path=None,
+    verbose=False,
+    rename_map_path=None,
+    indent_unit_map_path=None,
+    invalid_char_check=None,
+    spaces_per_indent=4,
+    fallback_indent=4,
+    threshold=0.5,
+    state_db_path=None,
+    manifest_path=None,
+    previous_vault=None,
+    truncation_map_path=None,
+    fs=None,
+):
+    """ingest_heptabase_backup 的串流版：每寫出一個檔案（卡片、附件、沿用的上次輸出）就 yield ChangeEvent(created)，
+    path 為 Vault 內的輸出相對路徑；對照表與 manifest 於匯入結束後輸出。
+    """
+    fs = fs or VaultFS(target_path)
+    target_path = os.path.abspath(target_path)
+    if fs.listdir(target_path):
+        raise FileExistsError(f"目標資料夾不是空的：{target_path}")
+
+    logger = Logger(log_path=log_path, verbose=verbose, title="Heptabase Backup Ingest Log", fs=fs)
+    log = logger.log
+
+    is_zip = os.path.isfile(get_safe_path(source_path)) and zipfile.is_zipfile(get_safe_path(source_path))
+    source = ZipBackupSource(source_path) if is_zip else DirBackupSource(source_path)
+    log(f"📦 來源：{source_path}（{'zip' if is_zip else '資料夾'}）→ {target_path}\n")
+
+    md_count = attachment_count = reused_count = 0
+    file_indent_map = {}
+    global_indent_diffs = Counter()
+    cards: Dict[str, dict] = {}
+    try:
+        for name in source.skipped():
+            log(f"⚠️ 略過不安全的路徑：{name}")
+
+        rel_files = source.files()
+        rename_map = plan_md_renames(rel_files, invalid_char_check)
+        for old, new in rename_map.items():
+            log(f"🔁 重新命名: {old} → {new}")
+        rename_name_map = build_rename_name_map(rename_map)
+
+        fingerprints = {rel: source.fingerprint(rel) for rel in rel_files} if manifest_path else {}
+        reusable = {}
+        if previous_vault and manifest_path:
+            reusable = plan_reuse(
+                rel_files, rename_map, fingerprints, load_ingest_manifest(manifest_path, fs),
+                previous_vault, truncation_map_path, log,
+            )
+
+        for rel in rel_files:
+            new_rel = rename_map.get(rel, rel)
+            out_rel, prev_entry = reusable.get(rel, (None, None))
+            dst = os.path.join(target_path, out_rel or new_rel)
+            fs.makedirs(os.path.dirname(dst))
+            if out_rel is not None and not fs.exists(dst):
+                # 沿用上次的最終輸出：.md 複製（之後步驟可能改寫），附件硬連結
+                src = os.path.join(previous_vault, out_rel)
+                if rel.endswith(".md"):
+                    fs.copy(src, dst)
+                    md_count += 1
+                else:
+                    fs.link(src, dst)
+                    attachment_count += 1
+                cards[rel] = prev_entry
+                reused_count += 1
+                yield ChangeEvent(CREATED, "ingest", out_rel)
+                continue
+
+            dst = os.path.join(target_path, new_rel)
+            if rel.endswith(".md"):
+                content, unit = transform_card(
+                    source.read_text(rel), new_rel, rename_name_map, log,
+                    spaces_per_indent, fallback_indent, threshold, global_indent_diffs,
+                )
+                fs.write_text(dst, content)
+                file_indent_map[new_rel] = unit
+                md_count += 1
+                if manifest_path:
+                    cards[rel] = {
+                        "fp": fingerprints[rel],
+                        "stage": new_rel,
+                        "headline": card_headline(content),
+                        "links": sorted(extract_link_targets(content)),
+                    }
+            else:
+                source.put_attachment(rel, fs, dst)
+                attachment_count += 1
+                if manifest_path:
+                    cards[rel] = {"fp": fingerprints[rel], "stage": new_rel}
+            yield ChangeEvent(CREATED, "ingest", new_rel)
+    finally:
+        source.close()
+    fs.sync()
+    if manifest_path:
+        save_ingest_manifest(manifest_path, cards, fs)
+
+    if rename_map_path and rename_map:
+        fs.write_state(rename_map_path, json.dumps(rename_map, indent=2, ensure_ascii=False))
+    if indent_unit_map_path:
+        fs.write_state(indent_unit_map_path, json.dumps(file_indent_map, indent=2, ensure_ascii=False))
+    if state_db_path:
+        store = StateStore(state_db_path)
+        if rename_map:
+            store.upsert_rename_map(rename_map)
+        store.upsert_indent_units(file_indent_map)
+        store.close()
+
+    log("\n📊 全域縮排差異統計：")
+    for diff, count in sorted(global_indent_diffs.items()):
+        log(f"{diff:+3d} → {count} 次")
+    log(f"\n✅ 匯入完成：{md_count} 張卡片、{attachment_count} 個附件、重新命名 {len(rename_map)} 個檔案")
+    if previous_vault and manifest_path:
+        log(f"♻️ 沿用上次輸出 {reused_count} 個、重新處理 {md_count + attachment_count - reused_count} 個")
+    logger.save()
+    return md_count, attachment_count, rename_map, file_indent_map
+
+
+if __name__ == "__main__":
+    import sys
+    BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    ingest_heptabase_backup(
+        sys.argv[1],
+        sys.argv[2] if len(sys.argv) > 2 else os.path.join(BASE_DIR, "TestData"),
+        log_path=os.path.join(BASE_DIR, "log", "backup_ingest.log"),
+        verbose=True,
+    )
@@ -2,32 +2,98 @@
 
 import os
 import sys
+import time
+import argparse
 sys.path.append(os.path.dirname(__file__))
 
-from detect_invalid_md_filenames import detect_invalid_md_filenames
-from rename_md_files_safely import rename_md_files_safely
-from preprocess_heptabase_yaml import clean_yaml_artifacts
-from convert_links_to_wikilinks import convert_links_to_wikilinks
+from ingest_heptabase_backup import ingest_heptabase_backup, iter_ingest_heptabase_backup
+from sanitize_md_filenames import iter_sanitize_md_filenames, sanitize_md_filenames
+from preprocess_heptabase_yaml import clean_yaml_artifacts, iter_clean_yaml_artifacts
+from convert_links_to_wikilinks import convert_links_to_wikilinks, iter_convert_links_to_wikilinks
 from analyze_indent_stat import analyze_indent_diffs
-from standardize_md_indentation import standardize_md_indentation
+from standardize_md_indentation import iter_standardize_md_indentation, standardize_md_indentation
 from unwrap_hard_wraps import unwrap_hard_wraps
-from build_uid_map_for_truncated_titles import build_uid_map_for_truncated_titles
-from rewrite_links_with_uid_alias import rewrite_links_with_uid_alias
+from build_uid_map_for_truncated_titles import build_uid_map_for_truncated_titles, iter_build_uid_map_for_truncated_titles
+from rewrite_links_with_uid_alias import iter_rewrite_links_with_uid_alias, rewrite_links_with_uid_alias
+from rollback_pipeline_run import rollback_pipeline_run
+from sweep_thresholds import (
+    DEFAULT_MIN_WRAP_LENS, DEFAULT_TITLEISH_MAXES, DEFAULT_TRUNCATION_THRESHOLDS, sweep_thresholds,
+)
+from conversion_daemon import SOCKET_NAME, ConversionDaemon, send_request, serve
+from watch_export import watch_export
+from transform_cards_in_place import iter_transform_cards_in_place, transform_cards_in_place
+from utils.step_scheduler import (
+    ATTACHMENTS, BACKLINK_INDEX, BODY, FRONTMATTER, INDENT_UNIT_MAP, INGEST_MANIFEST, NAMES,
+    RENAME_MAP, TRUNCATION_DELTA, TRUNCATION_MAP, apply_fusions, plan_waves, run_steps,
+)
+from utils.logger import Logger
+from utils.undo_journal import UndoJournal
+from utils.vault_fs import VaultFS
+from utils.vault_sample import sample_cards
 
 
-def run_pipeline_step(step_func, *args, name=None):
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_VAULT_PATH = os.path.join(BASE_DIR, "TestData")
+DEFAULT_LOG_DIR = os.path.join(BASE_DIR, "log")
+UNDO_KEEP_RUNS = 10
+PREFIX_LINK_MATCH = True  # 第 7 步：以前綴樹解析截斷位置不同的 [[連結]]（歧義者只記錄、不改寫）
+UID_SCHEME = "sequential"  # 或 "content"：UID 由首句雜湊決定，重複匯出同一備份時 UID 不變
+# --steps 可用編號或 id；有備份來源時 1–5 皆對應到匯入步驟
+STEP_NUMBERS = {
+    "1": "sanitize",
+    "2": "yaml",
+    "3": "links",
+    "4": "indent_analyze",
+    "5": "indent_fix",
+    "6": "uid",
+    "7": "uid_links",
+}
+
+
+def run_pipeline_step(step_func, *args, name=None, **kwargs):
     print(f"\n🚀 執行模組：{name}")
-    result = step_func(*args)
+    result = step_func(*args, **kwargs)
     print(f"✅ {name} 完成")
     return result
 
 
-def main():
-    BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-    VAULT_PATH = os.path.join(BASE_DIR, "TestData")
-    LOG_DIR = os.path.join(BASE_DIR, "log")
-    os.makedirs(LOG_DIR, exist_ok=True)
-    VERBOSE = True
+def run_pipeline_step_quiet(step_func, *args, name=None, **kwargs):
+    """批次模式：每步只印一行（名稱與耗時）。"""
+    started = time.perf_counter()
+    result = step_func(*args, **kwargs)
+    print(f"   ✓ {name}（{time.perf_counter() - started:.1f}s）")
+    return result
+
+
+def build_pipeline(vault_path, log_dir, verbose=True, state_db_path=None, backup_source=None, previous_vault=None, fs=None):
+    """組出單一 Vault 的步驟表。回傳 (steps, fusions, state_paths)。
+
+    backup_source：直接由備份 zip（或解壓後的資料夾）匯入，第 1–5 步於記憶體完成、每張卡片只寫入一次；vault_path 須不存在或為空
+    previous_vault：增量匯入時上次轉換完成的 Vault（搭配 log_dir 內上次的 manifest 與 truncation_map.json）
+    步驟的 "events" 為同參數的串流版（yield ChangeEvent），供 iter_vault_events 使用；沒有的步驟不產生事件
+    """
+    VAULT_PATH = vault_path
+    LOG_DIR = log_dir
+    VERBOSE = verbose
+    # 選用：SQLite 狀態庫（None = 僅使用 JSON）；JSON 仍會照常輸出以保相容
+    STATE_DB_PATH = state_db_path
+    STATE_KWARGS = {"state_db_path": STATE_DB_PATH}
+    # 各步驟共用同一個檔案系統層：目錄列舉只做一次、寫入一律原子替換，fsync 於每步結束時批次執行
+    FS_KWARGS = {"fs": fs or VaultFS(VAULT_PATH, fsync="batch")}
+    BACKLINK_INDEX_PATH = os.path.join(LOG_DIR, "backlink_index.json")  # 反向連結索引（跨次執行增量維護）
+    TRUNCATION_DELTA_PATH = os.path.join(LOG_DIR, "truncation_delta.json")  # 第 6 步輸出、第 7 步只處理受影響連結
+    INGEST_MANIFEST_PATH = os.path.join(LOG_DIR, "ingest_manifest.json")
+
+    # 本次執行會改寫的狀態檔，一併記入還原日誌
+    state_paths = [
+        os.path.join(LOG_DIR, "rename_map.json"),
+        os.path.join(LOG_DIR, "indent_unit_map.json"),
+        os.path.join(LOG_DIR, "truncation_map.json"),
+        BACKLINK_INDEX_PATH,
+        TRUNCATION_DELTA_PATH,
+        INGEST_MANIFEST_PATH,
+        STATE_DB_PATH,
+    ]
 
     INDENT_ANALYSIS_LOG = os.path.join(LOG_DIR, "indent_analysis.log")
     INDENT_UNIT_MAP_PATH = os.path.join(LOG_DIR, "indent_unit_map.json")
@@ -36,46 +102,56 @@ def main():
 
     steps = [
         {
-            "name": "1️⃣ 檢查非法檔名",
-            "func": detect_invalid_md_filenames,
+            "id": "sanitize",
+            "name": "1️⃣ 檢查並重命名非法檔名",
+            "reads": {NAMES},
+            "writes": {NAMES, RENAME_MAP},
+            "func": sanitize_md_filenames,
+            "events": iter_sanitize_md_filenames,
             "args": (
                 VAULT_PATH,
                 os.path.join(LOG_DIR, "invalid_filenames.log"),
-                VERBOSE
-            ),
-        },
-        {
-            "name": "2️⃣ 重命名非法檔名",
-            "func": rename_md_files_safely,
-            "args": (
-                VAULT_PATH,
                 os.path.join(LOG_DIR, "rename_map.json"),
                 os.path.join(LOG_DIR, "rename_phase.log"),
                 None,  # invalid_char_check
                 VERBOSE
             ),
+            "kwargs": {**STATE_KWARGS, **FS_KWARGS},
         },
         {
-            "name": "3️⃣ 清理 YAML 結構與雙引號",
+            "id": "yaml",
+            "name": "2️⃣ 清理 YAML 結構與雙引號",
+            "reads": {NAMES, FRONTMATTER},
+            "writes": {FRONTMATTER},
             "func": clean_yaml_artifacts,
+            "events": iter_clean_yaml_artifacts,
             "args": (
                 VAULT_PATH,
                 os.path.join(LOG_DIR, "yaml_preprocess.log"),
                 VERBOSE
             ),
+            "kwargs": FS_KWARGS,
         },
         {
-            "name": "4️⃣ 轉換 markdown link 成 wiki link",
+            "id": "links",
+            "name": "3️⃣ 轉換 markdown link 成 wiki link",
+            "reads": {NAMES, FRONTMATTER, BODY, RENAME_MAP},
+            "writes": {FRONTMATTER, BODY},
             "func": convert_links_to_wikilinks,
+            "events": iter_convert_links_to_wikilinks,
             "args": (
                 VAULT_PATH,
                 os.path.join(LOG_DIR, "rename_map.json"),
                 os.path.join(LOG_DIR, "link_conversion.log"),
                 VERBOSE
             ),
+            "kwargs": {**STATE_KWARGS, **FS_KWARGS},
         },
         {
-            "name": "5️⃣ 分析縮排單位",
+            "id": "indent_analyze",
+            "name": "4️⃣ 分析縮排單位",
+            "reads": {NAMES, FRONTMATTER, BODY},
+            "writes": {INDENT_UNIT_MAP},
             "func": analyze_indent_diffs,
             "args": (
                 VAULT_PATH,
@@ -85,10 +161,15 @@ def main():
                 0.5,
                 VERBOSE
             ),
+            "kwargs": {**STATE_KWARGS, **FS_KWARGS},
         },
         {
-            "name": "6️⃣ 統一縮排格式",
+            "id": "indent_fix",
+            "name": "5️⃣ 統一縮排格式",
+            "reads": {NAMES, FRONTMATTER, BODY, INDENT_UNIT_MAP},
+            "writes": {BODY},
             "func": standardize_md_indentation,
+            "events": iter_standardize_md_indentation,
             "args": (
                 VAULT_PATH,
                 INDENT_FIX_LOG,
@@ -97,20 +178,30 @@ def main():
                 INDENT_UNIT_MAP_PATH,
                 4       # fallback_unit
             ),
+            "kwargs": {**STATE_KWARGS, **FS_KWARGS},
         },
         {
-            "name": "7️⃣ 掃描語意斷句並重新命名為 UID",
+            "id": "uid",
+            "name": "6️⃣ 掃描語意斷句並重新命名為 UID",
+            "reads": {NAMES, FRONTMATTER, BODY, TRUNCATION_MAP},
+            "writes": {NAMES, BODY, TRUNCATION_MAP, TRUNCATION_DELTA},
             "func": build_uid_map_for_truncated_titles,
+            "events": iter_build_uid_map_for_truncated_titles,
             "args": (
                 VAULT_PATH,
                 os.path.join(LOG_DIR, "truncation_map.json"),
                 os.path.join(LOG_DIR, "truncation_detect.log"),
                 VERBOSE
             ),
+            "kwargs": {**STATE_KWARGS, **FS_KWARGS, "uid_scheme": UID_SCHEME, "delta_path": TRUNCATION_DELTA_PATH},
         },
         {
-            "name": "8️⃣ 替換 link 為 UID 與語意 alias",
+            "id": "uid_links",
+            "name": "7️⃣ 替換 link 為 UID 與語意 alias",
+            "reads": {NAMES, BODY, TRUNCATION_MAP, TRUNCATION_DELTA, BACKLINK_INDEX},
+            "writes": {BODY, BACKLINK_INDEX},
             "func": rewrite_links_with_uid_alias,
+            "events": iter_rewrite_links_with_uid_alias,
             "args": (
                 VAULT_PATH,
                 os.path.join(LOG_DIR, "truncation_map.json"),
@@ -118,32 +209,540 @@ def main():
                 "@",
                 VERBOSE
             ),
+            "kwargs": {
+                **STATE_KWARGS,
+                **FS_KWARGS,
+                "backlink_index_path": BACKLINK_INDEX_PATH,
+                "delta_path": TRUNCATION_DELTA_PATH,
+                "prefix_match": PREFIX_LINK_MATCH,
+            },
         },
 
     ]
 
+    if backup_source:
+        steps = [
+            {
+                "id": "ingest",
+                "name": "📦 由備份匯入（第 1–5 步）",
+                "reads": {TRUNCATION_MAP, INGEST_MANIFEST},
+                "writes": {NAMES, FRONTMATTER, BODY, ATTACHMENTS, RENAME_MAP, INDENT_UNIT_MAP, INGEST_MANIFEST},
+                "func": ingest_heptabase_backup,
+                "events": iter_ingest_heptabase_backup,
+                "args": (
+                    backup_source,
+                    VAULT_PATH,
+                    os.path.join(LOG_DIR, "backup_ingest.log"),
+                    VERBOSE,
+                    os.path.join(LOG_DIR, "rename_map.json"),
+                    INDENT_UNIT_MAP_PATH,
+                ),
+                "kwargs": {
+                    **STATE_KWARGS,
+                    **FS_KWARGS,
+                    "manifest_path": INGEST_MANIFEST_PATH,
+                    "previous_vault": previous_vault,
+                    "truncation_map_path": os.path.join(LOG_DIR, "truncation_map.json"),
+                },
+            },
+        ] + steps[5:]
+
+    fusions = [
+        {
+            "id": "card_transform",
+            "name": "2️⃣–5️⃣ 卡片轉換（YAML、wikilink、縮排；單次走訪）",
+            "replaces": ["yaml", "links", "indent_analyze", "indent_fix"],
+            "func": transform_cards_in_place,
+            "events": iter_transform_cards_in_place,
+            "args": (
+                VAULT_PATH,
+                os.path.join(LOG_DIR, "rename_map.json"),
+                INDENT_UNIT_MAP_PATH,
+                os.path.join(LOG_DIR, "card_transform.log"),
+                VERBOSE,
+                4,      # spaces_per_indent
+                4,      # fallback_indent
+                0.5,    # threshold
+            ),
+            "kwargs": {**STATE_KWARGS, **FS_KWARGS},
+        },
+    ]
+    return steps, fusions, state_paths
+
+
+def parse_step_spec(spec):
+    """--steps "1-5,7" / "uid,uid_links" → 步驟 id 集合；spec 為空回傳 None（全選）。"""
+    if not spec:
+        return None
+    wanted = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if "-" in part and all(p.strip().isdigit() for p in part.split("-", 1)):
+            lo, hi = (int(p) for p in part.split("-", 1))
+            wanted.update(STEP_NUMBERS[str(n)] for n in range(lo, hi + 1) if str(n) in STEP_NUMBERS)
+        elif part:
+            wanted.add(STEP_NUMBERS.get(part, part))
+    unknown = wanted - set(STEP_NUMBERS.values()) - {"ingest"}
+    if unknown:
+        raise ValueError(f"未知的步驟：{', '.join(sorted(unknown))}")
+    if wanted & {"sanitize", "yaml", "links", "indent_analyze", "indent_fix"}:
+        wanted.add("ingest")
+    return wanted
+
+
+def select_steps(steps, step_ids):
+    """只保留選到的步驟（順序不變）；step_ids 為 None 則全選。"""
+    if step_ids is None:
+        return steps
+    return [step for step in steps if step["id"] in step_ids]
+
+
+def run_vault(
+    vault_path,
+    log_dir,
+    verbose=True,
+    step_ids=None,
+    jobs=None,
+    fuse=False,
+    undo=True,
+    quiet=False,
+    state_db_path=None,
+    backup_source=None,
+    previous_vault=None,
+    confirm=None,
+    show_plan=None,
+    fs=None,
+):
+    """對單一 Vault 執行 pipeline（互動與批次模式共用）。
+
+    fuse：第 2–5 步皆執行時融合為單次走訪（較快，但四步的 log 合併為 card_transform.log，故預設不融合）；
+    jobs：同層步驟並行數（None = 全部並行，1 = 依序）；目前的第 1–7 步兩兩都有讀寫衝突，每層只有一步，
+          實際上一律依序執行，此參數保留給日後可並行的步驟
+    undo：記錄還原日誌（log_dir/undo，python main.py rollback 可撤銷）
+    confirm(該層步驟) 回傳 False 即停止；show_plan(steps, waves) 於開始前呼叫（例如互動模式詢問執行方式）
+    fs：傳入 MemoryVaultFS 即整個 pipeline 在記憶體中執行（log、map、索引也寫在其中；不記還原日誌）
+    """
+    fs, steps, state_paths = prepare_vault_run(
+        vault_path, log_dir, verbose and not quiet, step_ids, fuse, state_db_path, backup_source, previous_vault, fs,
+    )
+    if show_plan is not None:
+        show_plan(steps, plan_waves(steps))
+
+    journal = start_undo_journal(fs, vault_path, log_dir, state_paths) if undo else None
+    try:
+        return run_steps(
+            steps,
+            run_pipeline_step_quiet if quiet else run_pipeline_step,
+            max_workers=jobs,
+            before_wave=confirm,
+        )
+    finally:
+        if journal is not None:
+            run_dir = journal.finish()
+            if not quiet:
+                print(f"\n⏪ 還原日誌：{run_dir}（python main.py rollback 可撤銷本次執行）")
+
+
+def prepare_vault_run(vault_path, log_dir, verbose, step_ids, fuse, state_db_path, backup_source, previous_vault, fs):
+    """run_vault / iter_vault_events 共用：建立檔案系統層與步驟表（已篩選、融合）。回傳 (fs, steps, state_paths)。"""
+    fs = fs or VaultFS(vault_path, fsync="batch")
+    if fs.durable:
+        os.makedirs(log_dir, exist_ok=True)
+    steps, fusions, state_paths = build_pipeline(
+        vault_path, log_dir, verbose, state_db_path, backup_source, previous_vault, fs=fs,
+    )
+    steps = select_steps(steps, step_ids)
+    if fuse:
+        steps = apply_fusions(steps, fusions)
+    return fs, steps, state_paths
+
+
+def start_undo_journal(fs, vault_path, log_dir, state_paths):
+    """開始記錄還原日誌並掛到 fs 上；記憶體中的 Vault 不記錄（回傳 None）。"""
+    if not fs.durable:
+        return None
+    journal = UndoJournal.start(
+        os.path.join(log_dir, "undo"), vault_path, state_paths=state_paths, keep_runs=UNDO_KEEP_RUNS,
+    )
+    fs.undo = journal
+    return journal
+
+
+def iter_vault_events(
+    vault_path,
+    log_dir,
+    step_ids=None,
+    fuse=False,
+    undo=True,
+    state_db_path=None,
+    backup_source=None,
+    previous_vault=None,
+    fs=None,
+):
+    """run_vault 的串流版：依步驟順序逐一執行（不並行、不印出），邊執行邊 yield ChangeEvent，
+    下游（索引、同步）可在轉換進行中就開始處理。沒有串流版的步驟（第 4 步分析）照常執行、不產生事件。
+    log、map 照常輸出；呼叫端中途停止（break / close）時，已完成的變更保留，還原日誌照常收尾。
+    generator 的 return 值同 run_vault：{步驟名稱: 回傳值}。
+    """
+    fs, steps, state_paths = prepare_vault_run(
+        vault_path, log_dir, False, step_ids, fuse, state_db_path, backup_source, previous_vault, fs,
+    )
+    journal = start_undo_journal(fs, vault_path, log_dir, state_paths) if undo else None
+    results = {}
+    try:
+        for step in steps:
+            args, kwargs = step.get("args", ()), step.get("kwargs", {})
+            if "events" in step:
+                results[step["name"]] = yield from step["events"](*args, **kwargs)
+            else:
+                results[step["name"]] = step["func"](*args, **kwargs)
+    finally:
+        if journal is not None:
+            journal.finish()
+    return results
+
+
+def preview_vault_run(
+    vault_path,
+    scratch_dir,
+    fraction=0.02,
+    stratify=True,
+    seed=0,
+    step_ids=None,
+    fuse=False,
+    jobs=None,
+    quiet=False,
+    state_dir=None,
+):
+    """抽樣試跑：從 Vault 抽出約 fraction 比例的卡片，複製到 scratch_dir/preview-<時間>/vault 後執行所選步驟，
+    log 與狀態檔寫在同層的 log/（內容同正式執行），並依樣本耗時推估整個 Vault 的執行時間。原 Vault 不會被改動。
+
+    stratify：依資料夾分層抽樣（否則整個 Vault 隨機）；seed 相同則樣本相同
+    state_dir：正式執行的 log 資料夾；其中的 truncation_map.json 會複製過去，UID 判定沿用既有對照表
+    樣本外的卡片不存在，指向它們的連結不會被解析，連結相關統計偏低；時間推估同樣只是近似（第 6、7 步部分成本與 map 大小有關）。
+    回傳 {"run_dir", "sampled", "total", "elapsed", "estimate", "results"}。
+    """
+    vault_path = os.path.abspath(vault_path)
+    run_dir = os.path.abspath(os.path.join(scratch_dir, f"preview-{time.strftime('%Y%m%d-%H%M%S')}"))
+    if os.path.commonpath([vault_path, run_dir]) == vault_path:
+        raise ValueError(f"試跑資料夾不可位於 Vault 內：{run_dir}")
+    preview_vault, preview_log = os.path.join(run_dir, "vault"), os.path.join(run_dir, "log")
+
+    source = VaultFS(vault_path)
+    cards = [os.path.relpath(p, vault_path) for p in source.iter_md_files()]
+    sampled = sample_cards(cards, fraction, stratify=stratify, seed=seed)
+    total_bytes = sum(source.size(os.path.join(vault_path, rel)) for rel in cards)
+    sampled_bytes = sum(source.size(os.path.join(vault_path, rel)) for rel in sampled)
+
+    scratch = VaultFS(preview_vault)
+    scratch.makedirs(preview_vault)
+    for rel in sampled:
+        dst = os.path.join(preview_vault, rel)
+        scratch.makedirs(os.path.dirname(dst))
+        scratch.copy(os.path.join(vault_path, rel), dst)
+    scratch.makedirs(preview_log)
+    map_path = os.path.join(state_dir, "truncation_map.json") if state_dir else None
+    if map_path and os.path.isfile(map_path):
+        scratch.copy(map_path, os.path.join(preview_log, "truncation_map.json"))
+
+    started = time.perf_counter()
+    results = run_vault(
+        preview_vault, preview_log,
+        verbose=not quiet,
+        step_ids=step_ids,
+        jobs=jobs,
+        fuse=fuse,
+        undo=False,
+        quiet=quiet,
+    )
+    elapsed = time.perf_counter() - started
+    # 以內容大小推估（步驟成本主要在讀寫與逐行處理）；張數比例作為參考
+    estimate = elapsed * total_bytes / sampled_bytes if sampled_bytes else 0.0
+    estimate_by_count = elapsed * len(cards) / len(sampled) if sampled else 0.0
+
+    logger = Logger(os.path.join(preview_log, "preview.log"), verbose=not quiet, title="Preview Run Log")
+    log = logger.log
+    log(f"🧪 抽樣試跑：{vault_path}")
+    log(f"   {'依資料夾分層' if stratify else '隨機'}抽樣 {len(sampled)}/{len(cards)} 張卡片"
+        f"（{fraction:.1%}，seed={seed}；{sampled_bytes}/{total_bytes} bytes）")
+    log(f"   輸出：{preview_vault}")
+    log(f"⏱️ 樣本耗時 {elapsed:.1f}s → 整個 Vault 預估約 {estimate:.1f}s（依大小）／{estimate_by_count:.1f}s（依張數）")
+    log("\n📄 樣本卡片：")
+    for rel in sampled:
+        log(f"   {rel}")
+    logger.save()
+    return {
+        "run_dir": run_dir,
+        "sampled": sampled,
+        "total": len(cards),
+        "elapsed": elapsed,
+        "estimate": estimate,
+        "results": results,
+    }
+
+
+def print_plan(steps, waves):
     print("\n📋 將執行以下步驟：")
-    for step in steps:
-        print(f"   - {step['name']}")
+    for n, wave in enumerate(waves, 1):
+        names = "  ∥  ".join(steps[j]["name"] for j in wave)
+        print(f"   {n}. {names}")
 
-    print("\n🔧 請選擇執行模式：")
-    print("1. 每步執行後需確認")
-    print("2. 一次執行整個流程")
-    mode = input("輸入 1 或 2：").strip()
 
-    for step in steps:
-        if mode == "1":
-            print(f"\n⏳ 即將執行：{step['name']}")
-            user_input = input("➡️ 按 Enter 執行，或輸入 q 離開：").strip().lower()
-            if user_input == "q":
-                print("🛑 執行中止。")
-                break
+def interactive_main():
+    """原本的互動流程：TestData、列出步驟、選擇逐步確認或一次執行。"""
+    mode = {}
 
-        run_pipeline_step(step["func"], *step["args"], name=step["name"])
+    def show_plan(steps, waves):
+        print_plan(steps, waves)
+        print("\n🔧 請選擇執行模式：")
+        print("1. 每步執行後需確認")
+        print("2. 一次執行整個流程")
+        mode["value"] = input("輸入 1 或 2：").strip()
 
+    def confirm(batch):
+        if mode.get("value") != "1":
+            return True
+        print(f"\n⏳ 即將執行：{'、'.join(step['name'] for step in batch)}")
+        user_input = input("➡️ 按 Enter 執行，或輸入 q 離開：").strip().lower()
+        if user_input == "q":
+            print("🛑 執行中止。")
+            return False
+        return True
+
+    run_vault(DEFAULT_VAULT_PATH, DEFAULT_LOG_DIR, verbose=True, confirm=confirm, show_plan=show_plan)
+    return 0
+
+
+def vault_names(vault_paths):
+    """各 Vault 的資料夾名（同名者加序號），作為每個 Vault 專屬狀態的名稱。"""
+    names, seen = [], {}
+    for vault in vault_paths:
+        name = os.path.basename(os.path.normpath(vault)) or "vault"
+        seen[name] = seen.get(name, 0) + 1
+        names.append(name if seen[name] == 1 else f"{name}-{seen[name]}")
+    return names
+
+
+def vault_log_dirs(vault_paths, log_dir):
+    """單一 Vault 直接用 log_dir；多個 Vault 各用 log_dir/<資料夾名>（同名者加序號）。"""
+    if len(vault_paths) == 1:
+        return [log_dir]
+    return [os.path.join(log_dir, name) for name in vault_names(vault_paths)]
 
-if __name__ == "__main__":
-    main()
 
+def vault_state_db_paths(vault_paths, state_db_path):
+    """同 vault_log_dirs：單一 Vault 直接用 state_db_path；多個 Vault 各用 <檔名主體>.<資料夾名><副檔名>，
+    狀態庫不可共用（map 條目、UID 會跨 Vault 混在一起）。"""
+    if not state_db_path or len(vault_paths) == 1:
+        return [state_db_path] * len(vault_paths)
+    stem, ext = os.path.splitext(state_db_path)
+    return [f"{stem}.{name}{ext or '.sqlite'}" for name in vault_names(vault_paths)]
 
-    
+
+def batch_main(args):
+    """非互動批次：多個 Vault 依序處理，共用同一個直譯器（模組載入、編譯好的 regex 只做一次）。"""
+    if args.backup and len(args.vaults) != 1:
+        raise SystemExit("--backup 只能搭配單一 Vault")
+    try:
+        step_ids = parse_step_spec(args.steps)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if not args.backup:
+        missing = [vault for vault in args.vaults if not os.path.isdir(vault)]
+        if missing:
+            raise SystemExit(f"找不到 Vault 資料夾：{', '.join(missing)}")
+    failed = []
+    log_dirs = vault_log_dirs(args.vaults, args.log_dir)
+    state_db_paths = vault_state_db_paths(args.vaults, args.state_db)
+    for n, (vault, log_dir, state_db_path) in enumerate(zip(args.vaults, log_dirs, state_db_paths), 1):
+        print(f"\n📂 [{n}/{len(args.vaults)}] {vault}")
+        started = time.perf_counter()
+        try:
+            run_vault(
+                vault, log_dir,
+                verbose=not args.quiet,
+                step_ids=step_ids,
+                jobs=args.jobs,
+                fuse=args.fuse,
+                undo=not args.no_undo,
+                quiet=args.quiet,
+                state_db_path=state_db_path,
+                backup_source=args.backup,
+                previous_vault=args.previous_vault,
+                show_plan=None if args.quiet else print_plan,
+            )
+        except Exception as e:
+            failed.append(vault)
+            print(f"❌ {vault}：{type(e).__name__}: {e}")
+            continue
+        print(f"✅ {vault} 完成（{time.perf_counter() - started:.1f}s）")
+    print(f"\n🎉 共處理 {len(args.vaults)} 個 Vault，成功 {len(args.vaults) - len(failed)}、失敗 {len(failed)}")
+    return 1 if failed else 0
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Heptabase → Obsidian 轉換 pipeline（不帶參數 = 互動模式）")
+    sub = parser.add_subparsers(dest="command")
+
+    run = sub.add_parser("run", help="非互動批次執行（可一次處理多個 Vault）")
+    run.add_argument("vaults", nargs="+", help="Vault 資料夾（依序處理）")
+    run.add_argument("--log-dir", default=DEFAULT_LOG_DIR, help="log 與狀態檔資料夾；多個 Vault 時各用其下的子資料夾")
+    run.add_argument("--steps", help='要執行的步驟，例如 "1-5,7" 或 "uid,uid_links"（預設全部）')
+    run.add_argument("--jobs", type=int, default=None, help="同層步驟並行數（預設全部並行，1 = 依序；目前各步驟彼此相依、每層只有一步，實際不影響執行）")
+    run.add_argument("--quiet", action="store_true", help="不印各步驟明細，只印每步一行進度")
+    run.add_argument("--fuse", action="store_true", help="第 2–5 步融合為單次走訪（較快；四步的 log 合併為 card_transform.log）")
+    run.add_argument("--no-undo", action="store_true", help="不記錄還原日誌")
+    run.add_argument("--state-db", help="SQLite 狀態庫路徑（多個 Vault 時各用 <檔名主體>.<資料夾名>.sqlite）")
+    run.add_argument("--backup", help="由備份 zip / 資料夾匯入（取代第 1–5 步，Vault 須不存在或為空）")
+    run.add_argument("--previous-vault", help="增量匯入：上次轉換完成的 Vault")
+
+    daemon = sub.add_parser("daemon", help="常駐轉換程式：狀態留在記憶體，經 Unix socket 接收單張卡片的轉換請求")
+    daemon.add_argument("--vault", default=DEFAULT_VAULT_PATH)
+    daemon.add_argument("--export", required=True, help="Heptabase 匯出資料夾（請求中的卡片路徑以此為準）")
+    daemon.add_argument("--log-dir", default=DEFAULT_LOG_DIR, help="狀態檔資料夾（與 run 共用）")
+    daemon.add_argument("--socket", help=f"socket 路徑（預設 <log-dir>/{SOCKET_NAME}）")
+    daemon.add_argument("--no-undo", action="store_true", help="不記錄還原日誌")
+    daemon.add_argument("--quiet", action="store_true")
+
+    convert = sub.add_parser("convert", help="請常駐程式轉換匯出資料夾內的卡片")
+    convert.add_argument("paths", nargs="+", help="卡片路徑（絕對，或相對於匯出資料夾）")
+    convert.add_argument("--log-dir", default=DEFAULT_LOG_DIR)
+    convert.add_argument("--socket", help=f"socket 路徑（預設 <log-dir>/{SOCKET_NAME}）")
+
+    watch = sub.add_parser("watch", help="監看匯出資料夾，新增／變動的卡片靜置後整批轉換")
+    watch.add_argument("--vault", default=DEFAULT_VAULT_PATH)
+    watch.add_argument("--export", required=True, help="Heptabase 匯出資料夾")
+    watch.add_argument("--log-dir", default=DEFAULT_LOG_DIR, help="狀態檔資料夾（與 run 共用）")
+    watch.add_argument("--interval", type=float, default=1.0, help="輪詢間隔（秒）")
+    watch.add_argument("--debounce", type=float, default=2.0, help="最後一次變動後再等多久才處理（秒）")
+    watch.add_argument("--max-wait", type=float, default=30.0, help="持續有變動時最多等多久就處理（秒）")
+    watch.add_argument("--no-undo", action="store_true", help="不記錄還原日誌")
+    watch.add_argument("--quiet", action="store_true")
+
+    rollback = sub.add_parser("rollback", help="依還原日誌撤銷最近的執行")
+    rollback.add_argument("--vault", default=DEFAULT_VAULT_PATH)
+    rollback.add_argument("--log-dir", default=DEFAULT_LOG_DIR)
+    rollback.add_argument("--runs", type=int, default=1, help="撤銷最近幾次執行")
+    rollback.add_argument("--force", action="store_true", help="檔案在執行後又被修改時仍以舊內容覆蓋")
+    rollback.add_argument("--quiet", action="store_true")
+
+    preview = sub.add_parser("preview", help="抽樣試跑：只拿部分卡片到暫存資料夾執行，並推估整個 Vault 的耗時")
+    preview.add_argument("vault", nargs="?", default=DEFAULT_VAULT_PATH)
+    preview.add_argument("--fraction", type=float, default=0.02, help="抽樣比例（預設 0.02 = 2%%）")
+    preview.add_argument("--random", action="store_true", help="整個 Vault 隨機抽樣（預設依資料夾分層）")
+    preview.add_argument("--seed", type=int, default=0)
+    preview.add_argument("--steps", help='要執行的步驟，例如 "1-5" 或 "uid"（預設全部）')
+    preview.add_argument("--log-dir", default=DEFAULT_LOG_DIR, help="正式執行的 log 資料夾（沿用其中的 truncation_map.json）")
+    preview.add_argument("--scratch", help="試跑輸出資料夾（預設 <log-dir>/preview）")
+    preview.add_argument("--jobs", type=int, default=None, help="同 run --jobs（目前實際不影響執行）")
+    preview.add_argument("--fuse", action="store_true")
+    preview.add_argument("--quiet", action="store_true")
+
+    sweep = sub.add_parser("sweep", help="門檻掃描：估算 unwrap / 截斷判定門檻的各種設定會造成多少變更（不改 Vault）")
+    sweep.add_argument("--vault", default=DEFAULT_VAULT_PATH)
+    sweep.add_argument("--log-dir", default=DEFAULT_LOG_DIR)
+    sweep.add_argument("--min-wrap-len", type=int_list, default=DEFAULT_MIN_WRAP_LENS, help='例如 "60,80,100"')
+    sweep.add_argument("--titleish-max", type=int_list, default=DEFAULT_TITLEISH_MAXES, help='例如 "48,64"')
+    sweep.add_argument("--truncation-threshold", type=int_list, default=DEFAULT_TRUNCATION_THRESHOLDS, help='例如 "60,70,97"')
+    sweep.add_argument("--quiet", action="store_true")
+    return parser.parse_args(argv)
+
+
+def int_list(text):
+    try:
+        return [int(v) for v in text.split(",") if v.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"需為以逗號分隔的整數：{text}")
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.command == "run":
+        return batch_main(args)
+    if args.command in ("daemon", "watch"):
+        if not os.path.isdir(args.export):
+            raise SystemExit(f"找不到匯出資料夾：{args.export}")
+        daemon = ConversionDaemon(
+            args.vault, args.export, args.log_dir,
+            verbose=args.command == "daemon" and not args.quiet,
+            uid_scheme=UID_SCHEME,
+            prefix_match=PREFIX_LINK_MATCH,
+            undo=not args.no_undo,
+            undo_keep_runs=UNDO_KEEP_RUNS,
+        )
+        if args.command == "watch":
+            watch_export(
+                daemon,
+                os.path.join(args.log_dir, "watch_export.log"),
+                verbose=not args.quiet,
+                interval=args.interval,
+                debounce=args.debounce,
+                max_wait=args.max_wait,
+            )
+            return 0
+        serve(daemon, args.socket or os.path.join(args.log_dir, SOCKET_NAME))
+        return 0
+    if args.command == "convert":
+        socket_path = args.socket or os.path.join(args.log_dir, SOCKET_NAME)
+        try:
+            response = send_request(socket_path, {"op": "convert", "paths": [os.path.abspath(p) for p in args.paths]})
+        except OSError as e:
+            raise SystemExit(f"無法連線到常駐程式（{socket_path}）：{e}")
+        if not response.get("ok"):
+            print(f"❌ {response.get('error')}")
+            return 1
+        for src, out in response["outputs"].items():
+            print(f"✅ {src} → {out or '（與既有卡片相同，未保留）'}")
+        for src in response["unchanged"]:
+            print(f"☑️ {src}：未變動")
+        print(f"🔗 改寫連結 {len(response['rewritten'])} 個檔案（{response['ms']} ms）")
+        return 0
+    if args.command == "rollback":
+        rolled_back = rollback_pipeline_run(
+            args.vault,
+            os.path.join(args.log_dir, "undo"),
+            os.path.join(args.log_dir, "rollback.log"),
+            verbose=not args.quiet,
+            runs=args.runs,
+            force=args.force,
+        )
+        return 0 if rolled_back else 1
+    if args.command == "preview":
+        try:
+            step_ids = parse_step_spec(args.steps)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        if not os.path.isdir(args.vault):
+            raise SystemExit(f"找不到 Vault 資料夾：{args.vault}")
+        try:
+            preview_vault_run(
+                args.vault,
+                args.scratch or os.path.join(args.log_dir, "preview"),
+                fraction=args.fraction,
+                stratify=not args.random,
+                seed=args.seed,
+                step_ids=step_ids,
+                fuse=args.fuse,
+                jobs=args.jobs,
+                quiet=args.quiet,
+                state_dir=args.log_dir,
+            )
+        except ValueError as e:
+            raise SystemExit(str(e))
+        return 0
+    if args.command == "sweep":
+        sweep_thresholds(
+            args.vault,
+            os.path.join(args.log_dir, "sweep_thresholds.log"),
+            verbose=not args.quiet,
+            min_wrap_lens=args.min_wrap_len,
+            titleish_maxes=args.titleish_max,
+            truncation_thresholds=args.truncation_threshold,
+            report_path=os.path.join(args.log_dir, "sweep_thresholds.json"),
+        )
+        return 0
+    return interactive_main()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
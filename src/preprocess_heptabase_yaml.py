@@ -5,8 +5,14 @@ import re
 import urllib.parse
 from pathlib import Path
 from datetime import datetime
+from utils.byte_prefilter import in_first_line
+from utils.change_events import REWRITTEN, ChangeEvent, drain
 from utils.get_safe_path import get_safe_path
+from utils.md_lexer import find_frontmatter
+from utils.vault_fs import VaultFS
 
+# 前置過濾：第一行要含 "---" 才可能有 YAML 區塊
+YAML_PREFILTER = in_first_line(b"---")
 
 
 def encode_url(url: str) -> str:
@@ -117,16 +123,14 @@ def preprocess_yaml_content(content: str, log_fn=print) -> str:
     block_lines = []
     block_key = ""
     original_op = ""
-    if len(lines) > 0 and lines[0].strip() == "---":
-        try:
-            header_end = next(i for i in range(1, len(lines)) if lines[i].strip() == "---")
-            header_start = 0
-        except StopIteration:
+    frontmatter = find_frontmatter(lines)
+    if frontmatter is None:
+        if lines and lines[0].strip() == "---":
             log_fn("⚠️ YAML 區塊未正確關閉（找不到結尾 `---`），跳過此檔案")
-            return content
-    else:
-        log_fn("⚠️ 無合法 YAML 區塊（第 0 行不是 `---`），跳過此檔案")
+        else:
+            log_fn("⚠️ 無合法 YAML 區塊（第 0 行不是 `---`），跳過此檔案")
         return content
+    header_start, header_end = frontmatter
 
 
     pre_yaml = lines[:header_start + 1]
@@ -164,7 +168,13 @@ def preprocess_yaml_content(content: str, log_fn=print) -> str:
     return "\n".join(result)
 
 
-def clean_yaml_artifacts(vault_path, log_path=None, verbose=False):
+def clean_yaml_artifacts(vault_path, log_path=None, verbose=False, fs=None):
+    return drain(iter_clean_yaml_artifacts(vault_path, log_path, verbose, fs))
+
+
+def iter_clean_yaml_artifacts(vault_path, log_path=None, verbose=False, fs=None):
+    """clean_yaml_artifacts 的串流版：每清理一份卡片就 yield ChangeEvent(rewritten)。"""
+    fs = fs or VaultFS(vault_path)
     modified_files = []
     logs = []
 
@@ -173,18 +183,21 @@ def clean_yaml_artifacts(vault_path, log_path=None, verbose=False):
         if verbose:
             print(msg)
 
-    for root, _, files in os.walk(vault_path):
+    for root, _, files in fs.walk(vault_path):
         for file in files:
             if not file.endswith(".md"):
                 continue
 
             full_path = os.path.join(root, file)
-            rel_path = Path(full_path).relative_to(vault_path)
+            rel_path = Path(os.path.relpath(full_path, vault_path))
 
             full_path = get_safe_path(full_path)
 
-            with open(full_path, "r", encoding="utf-8") as f:
-                content = f.read()
+            if not fs.may_match(full_path, YAML_PREFILTER):
+                log(f"☑️ no changes: {rel_path}")
+                continue
+
+            content = fs.read_text(full_path)
 
             cleaned = preprocess_yaml_content(content, log_fn=log)
 
@@ -197,22 +210,19 @@ def clean_yaml_artifacts(vault_path, log_path=None, verbose=False):
                     if c1 != c2:
                         log(f"  第 {i} 字元不同: '{c1}' vs '{c2}'")
                         break
-                with open(full_path, "w", encoding="utf-8") as f:
-                    f.write(cleaned)
+                fs.write_text(full_path, cleaned)
                 modified_files.append(str(rel_path))
                 log(f"🧼 cleaned: {rel_path}")
+                yield ChangeEvent(REWRITTEN, "yaml", str(rel_path))
             else:
                 log(f"☑️ no changes: {rel_path}")
+    fs.sync()
     if verbose:
         log(f"\n📄 總共修改 {len(modified_files)} 個檔案。")
 
     if log_path:
-        os.makedirs(os.path.dirname(log_path), exist_ok=True)
-        with open(log_path, "w", encoding="utf-8") as f:
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            f.write(f"🧼 YAML Clean Log — {timestamp}\n\n")
-            for msg in logs:
-                f.write(f"{msg}\n")
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        fs.write_state(log_path, f"🧼 YAML Clean Log — {timestamp}\n\n" + "".join(f"{msg}\n" for msg in logs))
 
 
 
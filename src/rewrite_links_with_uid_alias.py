@@ -3,9 +3,243 @@
 import os
 import re
 import json
-from datetime import datetime
 from utils.get_safe_path import get_safe_path
+from utils.change_events import LINKS_CONVERTED, ChangeEvent, drain
 from utils.logger import Logger
+from utils.state_store import StateStore, truncation_map_sha1
+from utils.backlink_index import BacklinkIndex, extract_link_targets_from_lines
+from utils.byte_prefilter import WIKILINK_OPEN
+from utils.title_trie import TitleTrie
+from utils.vault_fs import VaultFS, state_fs
+
+
+PREFIX_MATCH_MIN_BYTES = 40  # 前綴比對的最短連結文字（UTF-8 位元組）；太短的前綴容易誤中其他卡片
+
+
+# 單一樣式同時處理兩種連結（整份檔案一次掃描）：
+#   group 1/2：[[uid_xxx|@Some sentence]] → 可能指錯 uid 的 alias
+#   group 3  ：[[title]] 但不是 embed（!）或 alias（|）
+LINK_PATTERN = re.compile(r"\[\[(uid_\d+)\|\@([^\]\n]+)\]\]|(?<!\!)\[\[([^\[\]\|\n]+?)\]\]")
+
+
+def rewrite_links_in_text(content, entry_for_key, uid_for_alias, mark_symbol="@"):
+    """對整份內容做 UID 連結改寫。
+    - [[title]]（title 為 truncation_map key）→ [[uid|@full_sentence]]
+    - [[uid_123|@Sentence]] 指錯 uid → [[uid_456|@Sentence]]
+
+    Returns:
+        Tuple[str, List[tuple]]: (新內容, [(offset, 原目標, uid, alias), ...])
+    """
+    parts = []
+    replacements = []
+    last = 0
+    for m in LINK_PATTERN.finditer(content):
+        current_uid, alias_text, target = m.group(1), m.group(2), m.group(3)
+        if target is not None:
+            entry = entry_for_key(target)
+            if entry is None:
+                continue
+            uid = entry["uid"]
+            alias = f"{mark_symbol}{entry['full_sentence']}"
+            replacements.append((m.start(), target, uid, alias))
+            new_link = f"[[{uid}|{alias}]]"
+        else:
+            correct_uid = uid_for_alias(alias_text)
+            if not correct_uid or correct_uid == current_uid:
+                continue
+            replacements.append((m.start(), current_uid, correct_uid, alias_text))
+            new_link = f"[[{correct_uid}|@{alias_text}]]"
+        parts.append(content[last:m.start()])
+        parts.append(new_link)
+        last = m.end()
+    if not replacements:
+        return content, replacements
+    parts.append(content[last:])
+    return "".join(parts), replacements
+
+
+def iter_rewritten_lines(lines, entry_for_key, uid_for_alias, mark_symbol, found):
+    """rewrite_links_in_text 的逐行版（連結不跨行），供大檔串流；found 收集 (行號, 原目標, uid, alias)。"""
+    for line_num, line in enumerate(lines, 1):
+        if "[[" not in line:
+            yield line
+            continue
+        new_line, replacements = rewrite_links_in_text(line, entry_for_key, uid_for_alias, mark_symbol)
+        found.extend((line_num, orig, uid, alias) for _, orig, uid, alias in replacements)
+        yield new_line
+
+
+def offsets_to_line_numbers(content, offsets):
+    """把遞增的字元位移轉成 1-based 行號（只掃描到最後一個位移為止）。"""
+    line_numbers = []
+    line = 1
+    pos = 0
+    for offset in offsets:
+        line += content.count("\n", pos, offset)
+        pos = offset
+        line_numbers.append(line)
+    return line_numbers
+
+
+def load_truncation_delta(delta_path, fs=None):
+    """讀取 build_uid_map_for_truncated_titles 輸出、尚未處理的 delta；不存在回傳 None（→ 全量處理）。"""
+    text = state_fs(fs).read_state(get_safe_path(delta_path))
+    if text is None:
+        return None
+    delta = json.loads(text)
+    for section in ("added", "changed", "retargeted"):
+        delta.setdefault(section, {})
+    return delta
+
+
+def delta_scope(delta):
+    """delta → (受影響的 key, 受影響的 full_sentence, 受影響的 uid)。"""
+    keys, fulls, uids = set(), set(), set()
+    for section in ("added", "changed", "retargeted"):
+        for key, entry in delta[section].items():
+            keys.add(key)
+            fulls.add(entry["full_sentence"])
+            uids.add(entry["uid"])
+            if "old_full_sentence" in entry:
+                fulls.add(entry["old_full_sentence"])
+            if "old_uid" in entry:
+                uids.add(entry["old_uid"])
+    return keys, fulls, uids
+
+
+def collect_note_titles(vault_path, fs=None):
+    """Vault 內既有筆記可被 [[...]] 指到的名稱（檔名、相對路徑，皆不含 .md）。"""
+    titles = set()
+    for file_path in iter_md_paths(vault_path, fs):
+        rel = os.path.relpath(file_path, vault_path)[:-3]
+        titles.add(rel.replace(os.sep, "/"))
+        titles.add(os.path.basename(rel))
+    return titles
+
+
+def build_title_trie(entries, min_bytes=PREFIX_MATCH_MIN_BYTES):
+    """entries: (key, uid, full_sentence) → 以 full_sentence 與 key 為字串、key 為值的前綴樹。"""
+    trie = TitleTrie(min_bytes=min_bytes)
+    for key, _, full_sentence in entries:
+        trie.insert(full_sentence, key)
+        trie.insert(key, key)
+    return trie
+
+
+class UidLinkResolver:
+    """連結目標 → truncation_map 條目：先比對完整 key；有前綴樹時，
+    再解析「截斷位置不同」的連結（目標本身是既有筆記則不動），結果快取於 prefix_hits。
+
+    entry_by_key(key) → {"uid", "full_sentence"} 或 None；uid_for_alias(full_sentence) → uid 或 None。
+    map 有新增 / 變更時呼叫 forget()，前綴比對的快取與歧義紀錄重算。
+    """
+
+    def __init__(self, entry_by_key, uid_for_alias, trie=None, note_titles=None):
+        self.entry_by_key = entry_by_key
+        self.uid_for_alias = uid_for_alias
+        self.trie = trie
+        self.note_titles = note_titles if note_titles is not None else set()
+        self.prefix_hits = {}   # 連結目標 → 解析出的 key
+        self.ambiguous = {}     # 連結目標 → 候選 key
+
+    def resolve_key(self, target):
+        if self.entry_by_key(target) is not None:
+            return target
+        if self.trie is None or target in self.note_titles:
+            return None
+        if target in self.prefix_hits:
+            return self.prefix_hits[target]
+        key, candidates = self.trie.resolve(target)
+        if key is not None:
+            self.prefix_hits[target] = key
+        elif candidates:
+            self.ambiguous[target] = candidates
+        return key
+
+    def entry_for_key(self, target):
+        key = self.resolve_key(target)
+        return self.entry_by_key(key) if key is not None else None
+
+    def lookups(self):
+        """全量改寫用的 (entry_for_key, uid_for_alias)。"""
+        return self.entry_for_key, self.uid_for_alias
+
+    def delta_lookups(self, delta_keys, delta_fulls):
+        """只改寫 delta 影響到的連結。"""
+        def delta_entry_for_key(target):
+            key = self.resolve_key(target)
+            return self.entry_by_key(key) if key in delta_keys else None
+
+        def delta_uid_for_alias(alias_text):
+            return self.uid_for_alias(alias_text) if alias_text in delta_fulls else None
+
+        return delta_entry_for_key, delta_uid_for_alias
+
+    def forget(self):
+        self.prefix_hits.clear()
+        self.ambiguous.clear()
+
+
+def rewrite_file_links(fs, file_path, rel_path, lookups, mark_symbol="@", index=None):
+    """單檔改寫（小檔整份、大檔串流）；有改寫時同步更新反向連結索引。
+    回傳 [(行號, 原目標, uid, alias), ...]（空 list = 未改動）。
+    """
+    # 預篩：沒有 [[ 的檔案不可能有要改的連結（bytes 層檢查，不解碼）
+    if not fs.may_match(file_path, WIKILINK_OPEN):
+        return []
+
+    if fs.should_stream(file_path):
+        # 大檔：逐行改寫到暫存檔再替換，不整檔載入
+        found = []
+        fs.stream_rewrite(
+            file_path, lambda lines: iter_rewritten_lines(lines, *lookups, mark_symbol, found)
+        )
+        if found and index is not None:
+            index.update_file_links(
+                rel_path, extract_link_targets_from_lines(fs.iter_lines(file_path)), fs.signature(file_path)
+            )
+        return found
+
+    content = fs.read_text(file_path)
+
+    new_content, replacements = rewrite_links_in_text(content, *lookups, mark_symbol)
+    if not replacements:
+        return []
+
+    fs.write_text(file_path, new_content)
+    if index is not None:
+        index.update_file(rel_path, new_content, fs.signature(file_path))
+
+    # 行號只在有變更的檔案才計算
+    line_numbers = offsets_to_line_numbers(content, [r[0] for r in replacements])
+    return [(line_num, orig, uid, alias) for line_num, (_, orig, uid, alias) in zip(line_numbers, replacements)]
+
+
+def log_rewritten_file(log, rel_path, found):
+    log(f"📄 修改檔案：{rel_path}")
+    log("\n".join(
+        f"  🔁 第 {line_num} 行：[[{orig}]] → [[{uid}|@{alias}]]"
+        for line_num, orig, uid, alias in found
+    ))
+    log("")
+
+
+def log_link_locations(log, index, fs, vault_path, target, limit=10):
+    """who links here：列出引用 target 的檔案與行號（由索引中的位移換算；最多 limit 檔）。"""
+    refs = index.who_links_here(target)
+    for rel_path, offsets in sorted(refs.items())[:limit]:
+        content = fs.read_text(os.path.join(vault_path, rel_path))
+        line_numbers = offsets_to_line_numbers(content, sorted(offsets))
+        log(f"     📍 {rel_path}：第 {'、'.join(str(n) for n in line_numbers)} 行")
+    if len(refs) > limit:
+        log(f"     …另有 {len(refs) - limit} 檔")
+
+
+def iter_md_paths(vault_path, fs=None):
+    for root, _, files in (fs.walk(vault_path) if fs is not None else os.walk(vault_path)):
+        for file in files:
+            if file.endswith(".md"):
+                yield os.path.join(root, file)
 
 
 def rewrite_links_with_uid_alias(
@@ -13,99 +247,170 @@ def rewrite_links_with_uid_alias(
     truncation_map_path,
     log_path,
     mark_symbol="@",
-    verbose=False
+    verbose=False,
+    state_db_path=None,
+    backlink_index_path=None,
+    delta_path=None,
+    prefix_match=False,
+    prefix_min_bytes=PREFIX_MATCH_MIN_BYTES,
+    fs=None
+):
+    return drain(iter_rewrite_links_with_uid_alias(
+        vault_path, truncation_map_path, log_path, mark_symbol, verbose, state_db_path,
+        backlink_index_path, delta_path, prefix_match, prefix_min_bytes, fs,
+    ))
+
+
+def iter_rewrite_links_with_uid_alias(
+    vault_path,
+    truncation_map_path,
+    log_path,
+    mark_symbol="@",
+    verbose=False,
+    state_db_path=None,
+    backlink_index_path=None,
+    delta_path=None,
+    prefix_match=False,
+    prefix_min_bytes=PREFIX_MATCH_MIN_BYTES,
+    fs=None
 ):
+    """rewrite_links_with_uid_alias 的串流版：每改寫一個檔案就 yield ChangeEvent(links_converted, count=處數)；
+    generator 的 return 值同 rewrite_links_with_uid_alias（被修改檔案數, 替換數）。
+    """
+    fs = fs or VaultFS(vault_path)
     truncation_map_path = get_safe_path(truncation_map_path)
-    logger = Logger(log_path=log_path, verbose=verbose, title=None)
+    logger = Logger(log_path=log_path, verbose=verbose, title=None, fs=fs)
     log = logger.log
 
+    # 有狀態庫時逐筆查詢（key / full_sentence 皆有索引），否則整包載入 JSON
+    store = StateStore(state_db_path) if state_db_path else None
+    if store is not None:
+        def entry_by_key(key):
+            row = store.truncation_entry(key)
+            return {"uid": row[0], "full_sentence": row[1]} if row else None
+        uid_for_alias = store.uid_for_full
+        iter_entries = store.iter_truncation_entries
+    else:
+        text = fs.read_state(truncation_map_path)
+        if text is None:
+            raise FileNotFoundError(truncation_map_path)
+        truncation_map = json.loads(text)
 
-    with open(truncation_map_path, "r", encoding="utf-8") as f:
-        truncation_map = json.load(f)
-
-    # 快速查表：alias_text → uid
-    alias_to_uid = {
-        v["full_sentence"]: v["uid"]
-        for v in truncation_map.values()
-    }
+        # 快速查表：alias_text → uid
+        alias_to_uid = {
+            v["full_sentence"]: v["uid"]
+            for v in truncation_map.values()
+        }
+        entry_by_key = truncation_map.get
+        uid_for_alias = alias_to_uid.get
 
-    # [[title]] 但不是 embed（!）或 alias（|）
-    wiki_link_pattern = re.compile(r"(?<!\!)\[\[([^\[\]\|\n]+?)\]\]")
+        def iter_entries():
+            return ((k, v["uid"], v["full_sentence"]) for k, v in truncation_map.items())
 
-    # [[uid_xxx|@Some sentence]]
-    alias_link_pattern = re.compile(r"\[\[(uid_\d+)\|\@([^\]]+)\]\]")
+    # 連結目標 → truncation_map key：先比對完整 key；開啟前綴比對時，
+    # 再以前綴樹解析「截斷位置不同」的連結（目標本身是既有筆記則不動）
+    resolver = UidLinkResolver(entry_by_key, uid_for_alias)
+    if prefix_match:
+        resolver.trie = build_title_trie(iter_entries(), prefix_min_bytes)
+        resolver.note_titles = collect_note_titles(vault_path, fs)
+        log(f"🔎 前綴比對：{len(resolver.trie)} 個標題字串，最短 {prefix_min_bytes} bytes\n")
+    resolve_key = resolver.resolve_key
+    prefix_hits = resolver.prefix_hits
+    ambiguous = resolver.ambiguous
 
     modified_file_count = 0
     total_replacements = 0
-    log_lines = []
 
-    for root, _, files in os.walk(vault_path):
-        for file in files:
-            if not file.endswith(".md"):
-                continue
+    # delta 模式需要反向連結索引才能知道哪些檔案自上次執行後有變動
+    delta = load_truncation_delta(delta_path, fs) if delta_path else None
+    if delta is not None and not backlink_index_path:
+        log("⚠️ 提供了 delta 但未提供 backlink_index_path，改為全量處理\n")
+        delta = None
+    if delta is not None and delta.get("map_sha1") != truncation_map_sha1(truncation_map_path, fs):
+        log("⚠️ delta 與目前的 truncation_map 不符（已過期），改為全量處理\n")
+        delta = None
+
+    # 有反向連結索引時：只開啟引用 map key（或 uid_ alias）的檔案
+    index = None
+    reindexed = set()
+    if backlink_index_path:
+        index = BacklinkIndex.load(backlink_index_path, fs)
+        reindexed, removed = index.refresh(vault_path, fs)
+        linked = index.files_linking_to_any(
+            t for t in index.targets() if t.startswith("uid_") or resolve_key(t) is not None
+        )
+        if delta is None:
+            candidates = linked
+        else:
+            # 變動過的檔案照全量 map 處理；其餘檔案只處理 delta 影響到的連結
+            delta_keys, delta_fulls, delta_uids = delta_scope(delta)
+            candidates = (
+                index.files_linking_to_any(delta_keys | delta_uids)
+                | index.files_linking_to_any(t for t in prefix_hits if prefix_hits[t] in delta_keys)
+                | (reindexed & linked)
+            )
+            log(
+                f"🧮 delta：added={len(delta['added'])}, changed={len(delta['changed'])}, "
+                f"retargeted={len(delta['retargeted'])}"
+            )
+        log(f"🗂️ 反向連結索引：重新索引 {len(reindexed)} 檔、移除 {len(removed)} 檔；需檢查 {len(candidates)}/{len(index)} 檔\n")
+        file_paths = [os.path.join(vault_path, rel) for rel in sorted(candidates)]
+    else:
+        file_paths = iter_md_paths(vault_path, fs)
+
+    if delta is not None:
+        delta_lookups = resolver.delta_lookups(delta_keys, delta_fulls)
+
+    for file_path in file_paths:
+        rel_path = os.path.relpath(file_path, vault_path)
+
+        lookups = resolver.lookups()
+        if delta is not None and rel_path not in reindexed:
+            lookups = delta_lookups
+
+        found = rewrite_file_links(fs, file_path, rel_path, lookups, mark_symbol, index)
+        if not found:
+            continue
+
+        modified_file_count += 1
+        total_replacements += len(found)
+        log_rewritten_file(log, rel_path, found)
+        yield ChangeEvent(LINKS_CONVERTED, "uid_links", rel_path, count=len(found))
+
+    fs.sync()
+    if index is not None:
+        index.save(backlink_index_path, fs)
+    if delta_path:
+        fs.remove_state(get_safe_path(delta_path))  # 已處理完畢（全量處理亦涵蓋 delta）；中途失敗則保留到下次
+
+    if delta is not None:
+        # 本次 delta 條目改寫後的引用者（連結已是 [[uid|@...]]，以 uid 查索引）
+        log("🔗 delta 條目的引用：")
+        for section in ("added", "changed", "retargeted"):
+            for key, entry in sorted(delta[section].items()):
+                refs = sorted(index.who_links_here(entry["uid"]))
+                listed = "：" + "、".join(refs[:10]) + ("…" if len(refs) > 10 else "") if refs else ""
+                log(f"  [{section}] {entry['uid']}（{key}）← {len(refs)} 檔{listed}")
+        log("")
 
-            file_path = os.path.join(root, file)
-            safe_file_path = get_safe_path(file_path)
-            rel_path = os.path.relpath(file_path, vault_path)
-
-            with open(safe_file_path, "r", encoding="utf-8") as f:
-                lines = f.readlines()
-
-            modified = False
-            new_lines = []
-            file_log = []
-
-            for line_num, line in enumerate(lines):
-                replacements = []
-
-                # 處理非 alias 的 [[title]] → [[uid|@full_sentence]]
-                def replace_link(match):
-                    target = match.group(1)
-                    if "|" in target or target not in truncation_map:
-                        return match.group(0)
-                    uid = truncation_map[target]["uid"]
-                    full = truncation_map[target]["full_sentence"]
-                    alias = f"{mark_symbol}{full}"
-                    replacements.append((target, uid, alias))
-                    return f"[[{uid}|{alias}]]"
-
-                # 處理 alias 錯誤指向的 [[uid_123|@Sentence]] → [[uid_456|@Sentence]]
-                def correct_alias_uid(match):
-                    current_uid, alias_text = match.group(1), match.group(2)
-                    correct_uid = alias_to_uid.get(alias_text)
-                    if correct_uid and correct_uid != current_uid:
-                        replacements.append((current_uid, correct_uid, alias_text))
-                        return f"[[{correct_uid}|@{alias_text}]]"
-                    return match.group(0)
-
-                # 執行替換
-                new_line = wiki_link_pattern.sub(replace_link, line)
-                new_line = alias_link_pattern.sub(correct_alias_uid, new_line)
-
-                if replacements:
-                    modified = True
-                    for orig, uid, alias in replacements:
-                        file_log.append(
-                            f"  🔁 第 {line_num + 1} 行：[[{orig}]] → [[{uid}|@{alias}]]"
-                        )
-
-                new_lines.append(new_line)
-
-            if modified:
-                with open(safe_file_path, "w", encoding="utf-8") as f:
-                    f.writelines(new_lines)
-                modified_file_count += 1
-                total_replacements += len(file_log)
-                log(f"📄 修改檔案：{rel_path}")
-                log("\n".join(file_log))
-                log("")
+    if ambiguous:
+        log("⚠️ 前綴比對有歧義（未改寫，需人工確認）：")
+        for target, candidates in sorted(ambiguous.items()):
+            log(f"  ❓ [[{target}]] → 候選：" + "、".join(f"[[{c}]]" for c in candidates))
+            if index is not None:
+                log_link_locations(log, index, fs, vault_path, target)
+        log("")
 
     # 日誌結尾與總結
     log("\n")
     log("📊 統計摘要\n")
     log(f"📝 被修改檔案數：{modified_file_count} 筆\n")
     log(f"🔁 替換 wiki link 數：{total_replacements} 筆\n")
+    if prefix_match:
+        log(f"🔎 前綴比對解析連結目標：{len(prefix_hits)} 個；歧義：{len(ambiguous)} 個\n")
 
+    if store is not None:
+        store.close()
     logger.save()
 
     return modified_file_count, total_replacements
@@ -0,0 +1,65 @@
+# src/rollback_pipeline_run.py
+
+import os
+from utils.logger import Logger
+from utils.undo_journal import UndoConflict, list_runs, read_records, revert_run
+
+
+def rollback_pipeline_run(
+    vault_path,
+    undo_dir,
+    log_path=None,
+    verbose=False,
+    runs=1,
+    force=False,
+):
+    """
+    依還原日誌撤銷最近 runs 次 pipeline 執行（由新到舊），Vault 與狀態檔回到執行前的內容。
+
+    Args:
+        vault_path (str): Vault 根目錄
+        undo_dir (str): 還原日誌資料夾（main.py 的 UNDO_DIR）
+        log_path (str): log 檔案完整路徑
+        verbose (bool): 是否印出 log
+        runs (int): 要撤銷的執行次數
+        force (bool): 檔案在該次執行後又被手動修改時，仍以舊內容覆蓋（反向差異無法強制套用者仍會中止）
+
+    Returns:
+        List[str]: 已撤銷的 run_id（由新到舊）
+    """
+    logger = Logger(log_path=log_path, verbose=verbose, title="Rollback Log")
+    log = logger.log
+    rolled_back = []
+
+    available = list_runs(undo_dir)
+    if not available:
+        log("☑️ 沒有可還原的執行紀錄")
+        logger.save()
+        return rolled_back
+
+    for run_id in reversed(available[-runs:]):
+        run_dir = os.path.join(undo_dir, run_id)
+        records = read_records(run_dir)
+        finished = any(r.get("op") == "end" for r in records)
+        log(f"\n⏪ 還原執行 {run_id}{'' if finished else '（未正常結束）'}")
+        try:
+            count = revert_run(run_dir, vault_path, force=force, log=log)
+        except UndoConflict as e:
+            log(f"❌ 中止：{e}")
+            log("   已還原的部分已記錄，排除衝突後重新執行即可接續")
+            break
+        rolled_back.append(run_id)
+        log(f"✅ {run_id}：共還原 {count} 筆操作")
+
+    log(f"\n🎉 共撤銷 {len(rolled_back)} 次執行")
+    logger.save()
+    return rolled_back
+
+
+if __name__ == "__main__":
+    BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    VAULT_DIR = os.path.join(BASE_DIR, "TestData")
+    UNDO_DIR = os.path.join(BASE_DIR, "log", "undo")
+    LOG_PATH = os.path.join(BASE_DIR, "log", "rollback.log")
+
+    rollback_pipeline_run(VAULT_DIR, UNDO_DIR, LOG_PATH, verbose=True)
@@ -0,0 +1,199 @@
+# src/sanitize_md_filenames.py
+
+import os
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Iterator, Optional, Set
+
+from utils.change_events import RENAMED, ChangeEvent, drain
+from utils.filename_tail import split_invalid_tail, unicode_escape
+from utils.state_store import StateStore
+from utils.vault_fs import VaultFS
+
+
+@dataclass(slots=True)
+class FilenameFix:
+    """單一尾端非法的 .md 檔名與其（規劃或已套用的）新名稱。"""
+    path: str        # 原完整路徑
+    filename: str    # 原檔名（含 .md）
+    trailing: str    # 被去除的尾端字串
+    new_path: str    # 新完整路徑
+
+    @property
+    def trailing_unicode(self) -> str:
+        return unicode_escape(self.trailing)
+
+
+def pick_free_name(taken: Set[str], base_name: str, ext: str) -> str:
+    """在同目錄既有名稱集合中挑選不衝突的檔名：base.md → base (1).md → base (2).md …"""
+    candidate = base_name + ext
+    count = 1
+    while candidate in taken:
+        candidate = f"{base_name} ({count}){ext}"
+        count += 1
+    return candidate
+
+
+def iter_filename_fixes(
+    vault_path: str,
+    invalid_char_check: Optional[Callable[[str], bool]] = None,
+    apply: bool = True,
+    fs: Optional[VaultFS] = None,
+) -> Iterator[FilenameFix]:
+    """單次走訪 Vault（VaultFS 目錄快取，每個資料夾只 scandir 一次），逐一產出尾端非法的 .md 檔名。
+
+    - 衝突判定查記憶體中的名稱集合（不反覆 os.path.exists）
+    - apply=True 時當場改名（目的地若意外存在，例如不分大小寫的檔案系統，改以磁碟為準再挑名）
+    - 以 generator 回傳，呼叫端可邊走訪邊寫 log
+    """
+    fs = fs or VaultFS(vault_path)
+    for dir_path, _, files in fs.walk():
+        taken = set(fs.listdir(dir_path))
+        for name in files:
+            if not name.endswith(".md"):
+                continue
+            clean_base, trailing = split_invalid_tail(name[:-3], invalid_char_check)
+            if not trailing:
+                continue
+            path = os.path.join(dir_path, name)
+            safe_name = pick_free_name(taken, clean_base, ".md")
+            new_path = os.path.join(dir_path, safe_name)
+            if apply:
+                if fs.exists_uncached(new_path):
+                    fs.invalidate(dir_path)
+                    taken.update(fs.listdir(dir_path))
+                    safe_name = pick_free_name(taken, clean_base, ".md")
+                    new_path = os.path.join(dir_path, safe_name)
+                fs.rename(path, new_path)
+                taken.discard(name)
+            taken.add(safe_name)
+            yield FilenameFix(path, name, trailing, new_path)
+
+
+def sanitize_md_filenames(
+    vault_path,
+    detect_log_path=None,
+    map_path=None,
+    rename_log_path=None,
+    invalid_char_check=None,
+    verbose=False,
+    state_db_path=None,
+    dry_run=False,
+    fs=None
+):
+    """
+    單次走訪：偵測尾端非法字元的 .md 檔名並重新命名（合併原第 1、2 步）。
+    參數與回傳值同 iter_sanitize_md_filenames（不逐筆產生事件）。
+    """
+    return drain(iter_sanitize_md_filenames(
+        vault_path, detect_log_path, map_path, rename_log_path, invalid_char_check, verbose, state_db_path, dry_run, fs
+    ))
+
+
+def iter_sanitize_md_filenames(
+    vault_path,
+    detect_log_path=None,
+    map_path=None,
+    rename_log_path=None,
+    invalid_char_check=None,
+    verbose=False,
+    state_db_path=None,
+    dry_run=False,
+    fs=None
+):
+    """
+    sanitize_md_filenames 的串流版：每改名一個檔案就 yield ChangeEvent(renamed)；
+    對照表、狀態庫與 log 仍於走訪結束後輸出，generator 的 return 值同 sanitize_md_filenames。
+    兩份 log 維持原格式：detect_log_path（非法尾端報告）、rename_log_path（重新命名紀錄）。
+
+    Args:
+        vault_path (str): Vault 根目錄
+        detect_log_path (str): 非法尾端報告 log（同 detect_invalid_md_filenames）
+        map_path (str): 對照表 JSON 的完整路徑
+        rename_log_path (str): 重新命名 log（同 rename_md_files_safely）
+        invalid_char_check (callable): 自定非法尾端字元判斷
+        verbose (bool): 是否印出 log
+        state_db_path (str): 若提供，對照表同時 upsert 進 SQLite 狀態庫
+        dry_run (bool): 只偵測、不改名（對照表不輸出）
+        fs (VaultFS): 共用的檔案系統層（目錄快取）；未提供則自建
+
+    Yields:
+        ChangeEvent: renamed（dry_run 時不產生）
+
+    Returns:
+        Tuple[int, dict]: (偵測到的檔案數, rename_map)
+    """
+    fs = fs or VaultFS(vault_path)
+    rename_map = {}
+    detected = 0
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def log(msg):
+        if rename_log_path:
+            fs.append_state(rename_log_path, msg + "\n")
+        if verbose:
+            print(msg)
+
+    detect_log = None
+    if detect_log_path:
+        detect_log = [f"🕵️ Invalid filename trailing report @ {timestamp}\n\n"]
+    if rename_log_path:
+        fs.write_state(rename_log_path, f"📁 Rename Phase Log — {timestamp}\n\n")
+    log("🔍 開始掃描並重新命名含非法尾端字元的 .md 檔案...\n")
+
+    try:
+        for fix in iter_filename_fixes(vault_path, invalid_char_check, apply=not dry_run, fs=fs):
+            detected += 1
+            if detect_log:
+                detect_log.append(f"- {fix.filename} → '{fix.trailing}' [{fix.trailing_unicode}]\n")
+                detect_log.append(f"  ↳ {fix.path}\n\n")
+            if dry_run:
+                continue
+            relative_path = os.path.relpath(fix.path, vault_path)
+            new_rel = os.path.relpath(fix.new_path, vault_path)
+            rename_map[relative_path] = new_rel
+            log(f"🔁 重新命名: {relative_path} → {new_rel}")
+            yield ChangeEvent(RENAMED, "sanitize", relative_path, new_path=new_rel)
+        if detect_log and not detected:
+            detect_log.append("✅ 所有 .md 檔案尾端都乾淨。\n")
+    finally:
+        if detect_log:
+            fs.write_state(detect_log_path, "".join(detect_log))
+    fs.sync()
+
+    if verbose and detect_log_path:
+        print(f"🔍 結果已寫入：{detect_log_path}")
+        if not detected:
+            print("✅ 所有 .md 檔案尾端都乾淨。")
+        else:
+            print(f"🧨 共發現 {detected} 筆非法尾端檔名，詳見 log")
+
+    if rename_map and map_path:
+        fs.write_state(map_path, json.dumps(rename_map, indent=2, ensure_ascii=False))
+        log(f"\n✅ 已重新命名 {len(rename_map)} 個檔案，對照表儲存為 {map_path}")
+    else:
+        log("✅ 沒有需要重新命名的檔案。所有檔名尾端皆為合法字元。")
+
+    if rename_map and state_db_path:
+        store = StateStore(state_db_path)
+        store.upsert_rename_map(rename_map)
+        store.close()
+
+    if rename_log_path:
+        log(f"\n📄 Log 儲存於 {rename_log_path}")
+    return detected, rename_map
+
+
+if __name__ == "__main__":
+    BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    VAULT_DIR = os.path.join(BASE_DIR, "TestData")
+    LOG_DIR = os.path.join(BASE_DIR, "log")
+
+    sanitize_md_filenames(
+        VAULT_DIR,
+        os.path.join(LOG_DIR, "invalid_filenames.log"),
+        os.path.join(LOG_DIR, "rename_map.json"),
+        os.path.join(LOG_DIR, "rename_phase.log"),
+        verbose=True
+    )
@@ -1,10 +1,23 @@
 # src/standardize_md_indentation.py
 
 import os
+import re
 import json
 from datetime import datetime
-from utils.get_safe_path import get_safe_path
+from utils.byte_prefilter import LEADING_WHITESPACE, any_of
+from utils.change_events import REWRITTEN, ChangeEvent, drain
 from utils.logger import Logger
+from utils.md_lexer import FRONTMATTER, iter_lexed_lines
+from utils.state_store import StateStore
+from utils.vault_fs import VaultFS
+
+
+# 前置過濾：行首有空白（縮排需換算）、行尾反斜線、或最後一行沒有換行，才可能需要改寫
+INDENT_PREFILTER = any_of(
+    LEADING_WHITESPACE,
+    re.compile(rb"\\(?:[\r\n]|\Z)"),
+    lambda buf: len(buf) > 0 and buf[-1:] not in (b"\n", b"\r"),
+)
 
 
 def get_leading_indent(line: str, tab_size=4) -> int:
@@ -19,11 +32,19 @@ def get_leading_indent(line: str, tab_size=4) -> int:
     return count
 
 
-def find_yaml_block(lines):
-    yaml_boundaries = [i for i, l in enumerate(lines[:20]) if l.strip() == "---"]
-    if len(yaml_boundaries) >= 2 and yaml_boundaries[0] == 0:
-        return yaml_boundaries[0], yaml_boundaries[1]
-    return None, None
+def iter_standardized_lines(lexed_lines, indent_unit, spaces_per_indent=4):
+    """(line, 種類) → 統一縮排後的行，逐行產出（frontmatter 原樣保留）；小檔與串流大檔共用。"""
+    for line, kind in lexed_lines:
+        if kind == FRONTMATTER:
+            yield line
+            continue
+
+        space_indent = get_leading_indent(line, tab_size=indent_unit)
+        indent_level = space_indent // indent_unit
+        stripped = line.lstrip().rstrip('\n')
+        if stripped.endswith('\\'):
+            stripped = stripped[:-1].rstrip()
+        yield ' ' * (spaces_per_indent * indent_level) + stripped + '\n'
 
 
 def standardize_md_indentation(
@@ -33,69 +54,87 @@ def standardize_md_indentation(
     spaces_per_indent=4,
     indent_unit_map_path=None,
     fallback_unit=4,
+    state_db_path=None,
+    fs=None,
 ):
+    return drain(iter_standardize_md_indentation(
+        vault_path, log_path, verbose, spaces_per_indent, indent_unit_map_path, fallback_unit, state_db_path, fs
+    ))
+
+
+def iter_standardize_md_indentation(
+    vault_path,
+    log_path=None,
+    verbose=False,
+    spaces_per_indent=4,
+    indent_unit_map_path=None,
+    fallback_unit=4,
+    state_db_path=None,
+    fs=None,
+):
+    """standardize_md_indentation 的串流版：每統一一份卡片的縮排就 yield ChangeEvent(rewritten)。"""
+    fs = fs or VaultFS(vault_path)
     changed_files = []
 
+    # 有狀態庫時逐檔查詢縮排單位，不整包載入 JSON
+    store = StateStore(state_db_path) if state_db_path else None
     indent_unit_map = {}
-    if indent_unit_map_path and os.path.exists(indent_unit_map_path):
-        with open(get_safe_path(indent_unit_map_path), "r", encoding="utf-8") as f:
-            indent_unit_map = json.load(f)
+    if store is None and indent_unit_map_path:
+        text = fs.read_state(indent_unit_map_path)
+        if text is not None:
+            indent_unit_map = json.loads(text)
 
-    logger = Logger(log_path=log_path, verbose=verbose, title="Indent Fix Log")
+    logger = Logger(log_path=log_path, verbose=verbose, title="Indent Fix Log", fs=fs)
     log = logger.log
     
     if log_path:
-        with open(get_safe_path(log_path), "w", encoding="utf-8") as f:
-            f.write(f"\U0001f9f9 Indentation Fix Log — {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+        fs.write_state(log_path, f"\U0001f9f9 Indentation Fix Log — {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
 
-    for root, _, files in os.walk(vault_path):
+    for root, _, files in fs.walk(vault_path):
         for file in files:
             if not file.endswith(".md"):
                 continue
 
             file_path = os.path.join(root, file)
-            safe_file_path = get_safe_path(file_path)
             rel_path = os.path.relpath(file_path, vault_path)
 
-            indent_unit = indent_unit_map.get(rel_path, fallback_unit)
-
-            with open(safe_file_path, "r", encoding="utf-8") as f:
-                lines = f.readlines()
-
-            yaml_start, yaml_end = find_yaml_block(lines)
-            new_lines = []
-            changed = False
-
-            for i, line in enumerate(lines):
-                if yaml_start is not None and yaml_start <= i <= yaml_end:
-                    new_lines.append(line)
-                    continue
+            if store is not None:
+                indent_unit = store.indent_unit_for(rel_path) or fallback_unit
+            else:
+                indent_unit = indent_unit_map.get(rel_path, fallback_unit)
 
-                raw_line = line
-                space_indent = get_leading_indent(line, tab_size=indent_unit)
-                indent_level = space_indent // indent_unit
-                stripped = line.lstrip().rstrip('\n')
-                if stripped.endswith('\\'):
-                    stripped = stripped[:-1].rstrip()
-                rebuilt_line = ' ' * (spaces_per_indent * indent_level) + stripped + '\n'
+            if not fs.may_match(file_path, INDENT_PREFILTER):
+                log(f"☑️ {rel_path}：縮排正常（依空格單位={indent_unit} 推算層級 → 每層為 {spaces_per_indent} space）")
+                continue
 
-                if rebuilt_line != raw_line:
-                    changed = True
-                new_lines.append(rebuilt_line)
+            if fs.should_stream(file_path):
+                # 大檔：逐行讀、逐行寫暫存檔，有變更才替換
+                changed = fs.stream_rewrite(
+                    file_path,
+                    lambda lines: iter_standardized_lines(iter_lexed_lines(lines), indent_unit, spaces_per_indent),
+                )
+            else:
+                doc = fs.lex(file_path)
+                new_lines = list(iter_standardized_lines(zip(doc.lines, doc.kinds), indent_unit, spaces_per_indent))
+                changed = new_lines != doc.lines
+                if changed:
+                    fs.write_text(file_path, "".join(new_lines))
 
             if changed:
-                with open(safe_file_path, "w", encoding="utf-8") as f:
-                    f.writelines(new_lines)
                 changed_files.append(rel_path)
+                yield ChangeEvent(REWRITTEN, "indent_fix", rel_path)
                 log(f"✅ {rel_path}：已統一縮排（依空格單位={indent_unit} 推算層級 → 每層轉為 {spaces_per_indent} space）")
             else:
                 log(f"☑️ {rel_path}：縮排正常（依空格單位={indent_unit} 推算層級 → 每層為 {spaces_per_indent} space）")
 
+    fs.sync()
     if changed_files:
         log(f"\n🎉 共修正 {len(changed_files)} 個檔案的縮排")
     else:
         log("✅ 所有檔案縮排皆已一致")
 
+    if store is not None:
+        store.close()
     logger.save()
     
     return changed_files
@@ -0,0 +1,287 @@
+# src/sweep_thresholds.py
+
+import bisect
+import json
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import unwrap_hard_wraps as unwrap
+from build_uid_map_for_truncated_titles import (
+    LONG_FILENAME_UTF8_BYTES_THRESHOLD, clean_markdown_line, compare_filename_and_line, first_nonempty_line,
+    is_temp_file, is_truncated, iter_vault_md_files, read_lines, remove_trailing_number, skip_yaml, uid_for_path,
+)
+from utils.logger import Logger
+from utils.md_lexer import CODE, FENCE, FRONTMATTER, TABLE, iter_lexed_lines
+from utils.vault_fs import VaultFS, state_fs
+
+# 預設掃描範圍（含目前的設定值）
+DEFAULT_MIN_WRAP_LENS = (60, 70, 80, 90, 100)
+DEFAULT_TITLEISH_MAXES = (48, 56, 64, 72, 80)
+DEFAULT_TRUNCATION_THRESHOLDS = (50, 60, 70, 80, 90, 97)
+MAX_LISTED_FLIPS = 20  # log 中每個設定最多列出幾個翻轉檔案（完整清單見 report）
+
+
+# ===== unwrap_hard_wraps：逐行特徵 =====
+@dataclass(frozen=True, slots=True)
+class PrevFeatures:
+    """一段（可能已合併多行）作為 should_unwrap 的 prev_line 時，與門檻無關的特徵。"""
+    bq: str              # blockquote 前綴
+    is_list: bool        # prev_is_list
+    indent: int
+    opener: bool         # 標題或區塊起點 → 不合併
+    shape: bool          # has_titleish_shape（長度另計）
+    nbytes: int          # strip 後 UTF-8 bytes
+    stop: bool           # 句尾標點或 HARD_BREAK
+
+
+@dataclass(frozen=True, slots=True)
+class NextFeatures:
+    """一行作為 should_unwrap 的 curr_line 時，與門檻無關的特徵。"""
+    bq: str
+    starter: bool        # 區塊起點（同層 blockquote 例外）
+    empty: bool
+    indent: int
+    indented_text: bool  # next_indented_text
+    pure_wikilink: bool
+    token: int           # first_token_bytes
+
+
+def prev_features(text: str) -> PrevFeatures:
+    ps = text.rstrip("\n").strip()
+    return PrevFeatures(
+        bq=unwrap.split_bq_prefix(text)[0],
+        is_list=bool(unwrap.LIST_BULLET.match(text.lstrip()) or unwrap.LIST_ORDERED.match(text.lstrip())),
+        indent=unwrap.get_leading_indent(text),
+        opener=unwrap.is_header_line(ps) or unwrap.is_block_starter(ps),
+        shape=unwrap.has_titleish_shape(ps),
+        nbytes=len(ps.encode("utf-8")),
+        stop=ps.endswith(unwrap.SENTENCE_ENDERS) or unwrap.ends_with_forced_break(text),
+    )
+
+
+def next_features(line: str) -> NextFeatures:
+    cs = line.rstrip("\n").strip()
+    return NextFeatures(
+        bq=unwrap.split_bq_prefix(line)[0],
+        starter=unwrap.is_block_starter(line),
+        empty=not cs,
+        indent=unwrap.get_leading_indent(line),
+        indented_text=bool(
+            (line.startswith("  ") or line.startswith("\t")) and
+            not (unwrap.LIST_BULLET.match(line) or unwrap.LIST_ORDERED.match(line) or unwrap.BLOCKQUOTE.match(line)
+                 or unwrap.CODE_FENCE.match(line) or unwrap.ATX_HEADING.match(line))
+        ),
+        pure_wikilink=unwrap.is_pure_wikilink(cs),
+        token=unwrap.first_token_bytes(cs),
+    )
+
+
+def decide_unwrap(p: PrevFeatures, n: NextFeatures, same_bq_level: bool, min_wrap_len: int, titleish_max: int) -> bool:
+    """should_unwrap 的同一套判斷順序，只換成預先算好的特徵與傳入的門檻。"""
+    if n.starter and not same_bq_level:
+        return False
+    if n.empty:
+        return False
+    titleish = p.shape and p.nbytes <= titleish_max
+    if p.is_list and n.indented_text and not titleish and not n.pure_wikilink:
+        return True
+    if p.opener:
+        return False
+    if titleish and p.nbytes < min_wrap_len:
+        return False
+    if p.stop or n.indent < p.indent:
+        return False
+    eff_prev_len = p.nbytes + (n.token + 1 if n.token > 0 else 0)
+    return eff_prev_len >= min_wrap_len
+
+
+def count_unwrap_merges(lexed_lines: Iterable[Tuple[str, str]], grid: List[Tuple[int, int]]) -> List[int]:
+    """(line, 種類) → 每組 (MIN_WRAP_LEN, TITLEISH_MAX) 的合併次數。
+    只走一次檔案：每行特徵算一次，再推進每組設定各自的「目前段落」；
+    連鎖合併時後續判斷取決於合併後的整段，所以只有真的合併時才對新段落重算 prev 特徵。
+    """
+    segments: List[Optional[Tuple[PrevFeatures, str]]] = [None] * len(grid)
+    merges = [0] * len(grid)
+    for line, kind in lexed_lines:
+        boundary = kind in (FRONTMATTER, CODE, TABLE)
+        keeps = kind in (FRONTMATTER, FENCE, CODE, TABLE)
+        nf = None if boundary or not any(segments) else next_features(line)
+        pf = None if keeps else prev_features(line)
+        for g, (min_wrap_len, titleish_max) in enumerate(grid):
+            seg = segments[g]
+            if seg is not None and nf is not None:
+                p, text = seg
+                same_bq_level = p.bq != "" and p.bq == nf.bq
+                if decide_unwrap(p, nf, same_bq_level, min_wrap_len, titleish_max):
+                    text = unwrap.join_wrapped(text, line, same_bq_level)
+                    segments[g] = (prev_features(text), text)
+                    merges[g] += 1
+                    continue
+            segments[g] = None if keeps else (pf, line)
+    return merges
+
+
+def sweep_unwrap(
+    vault_path,
+    min_wrap_lens: Iterable[int] = DEFAULT_MIN_WRAP_LENS,
+    titleish_maxes: Iterable[int] = DEFAULT_TITLEISH_MAXES,
+    fs=None,
+):
+    """
+    對 MIN_WRAP_LEN × TITLEISH_MAX 的每一組設定，計算 unwrap_hard_wraps 會合併幾處硬斷行（不改寫任何檔案）。
+
+    Returns:
+        Tuple[List[Tuple[int, int]], Dict[str, List[int]]]:
+            (grid, {相對路徑: 各設定的合併次數（順序同 grid）})；只列出至少一組設定會合併的檔案
+    """
+    fs = fs or VaultFS(vault_path)
+    grid = [(m, t) for m in min_wrap_lens for t in titleish_maxes]
+    per_file: Dict[str, List[int]] = {}
+    for root, _, files in fs.walk(vault_path):
+        for file in files:
+            if not file.endswith(".md"):
+                continue
+            fp = os.path.join(root, file)
+            if fs.should_stream(fp):
+                merges = count_unwrap_merges(iter_lexed_lines(fs.iter_lines(fp)), grid)
+            else:
+                doc = fs.lex(fp)
+                merges = count_unwrap_merges(zip(doc.lines, doc.kinds), grid)
+            if any(merges):
+                per_file[os.path.relpath(fp, vault_path)] = merges
+    return grid, per_file
+
+
+# ===== build_uid_map_for_truncated_titles：逐檔特徵 =====
+def sweep_truncation(vault_path, thresholds: Iterable[int] = DEFAULT_TRUNCATION_THRESHOLDS, fs=None):
+    """
+    對每個 LONG_FILENAME_UTF8_BYTES_THRESHOLD 計算第 6 步 Case B（一般檔名）會判定為截斷的檔案（不改名、不寫 map）。
+    is_truncated 對門檻單調：每檔只需知道「任何門檻都截斷」「任何門檻都不截斷」或「門檻 ≤ 檔名 bytes 才截斷」。
+
+    Returns:
+        Tuple[List[int], List[str], Dict[str, int]]:
+            (各門檻的截斷數, 恆為截斷的檔案, {門檻相關的檔案: 檔名 bytes（門檻 ≤ 此值即截斷）})
+    """
+    vp = os.path.abspath(vault_path)
+    thresholds = list(thresholds)
+    always: List[str] = []
+    flip_points: Dict[str, int] = {}
+    for path in iter_vault_md_files(vp, fs):
+        if is_temp_file(path) or uid_for_path(path) is not None:
+            continue  # Case A / C 不經 is_truncated
+        cleaned = clean_markdown_line(first_nonempty_line(skip_yaml(read_lines(path, fs))))
+        ok, _ = compare_filename_and_line(path.stem, cleaned)
+        if not ok:
+            continue
+        filename_clean = remove_trailing_number(path.stem)
+        rel = os.path.relpath(str(path), vp)
+        if is_truncated(filename_clean, cleaned, float("inf"))[0]:
+            always.append(rel)  # 補述為符號
+        elif is_truncated(filename_clean, cleaned, 0)[0]:
+            flip_points[rel] = len(filename_clean.encode("utf-8"))
+    points = sorted(flip_points.values())
+    counts = [len(always) + len(points) - bisect.bisect_left(points, t) for t in thresholds]
+    return counts, always, flip_points
+
+
+# ===== 主流程 =====
+def sweep_thresholds(
+    vault_path,
+    log_path=None,
+    verbose=False,
+    min_wrap_lens: Iterable[int] = DEFAULT_MIN_WRAP_LENS,
+    titleish_maxes: Iterable[int] = DEFAULT_TITLEISH_MAXES,
+    truncation_thresholds: Iterable[int] = DEFAULT_TRUNCATION_THRESHOLDS,
+    report_path=None,
+    fs=None,
+):
+    """
+    門檻掃描：一次抽出每行／每檔的特徵，再對整組門檻同時求值，不必為每個值複製 Vault 重跑步驟。
+    - unwrap_hard_wraps：MIN_WRAP_LEN × TITLEISH_MAX → 各設定的合併數、改寫檔案數
+    - build_uid_map_for_truncated_titles：LONG_FILENAME_UTF8_BYTES_THRESHOLD → 各門檻的截斷判定數
+    - 翻轉：與目前設定（模組常數）相比，結果不同的檔案（unwrap 為是否改寫，截斷為是否判定截斷）
+    Vault 應處於該步驟執行前的狀態（unwrap 在第 2–5 步之後、截斷判定在第 6 步之前）；Vault 只讀不寫。
+
+    Args:
+        vault_path (str): Vault 根目錄
+        log_path (str): log 檔案完整路徑
+        verbose (bool): 是否印出 log
+        min_wrap_lens / titleish_maxes / truncation_thresholds: 各參數要掃描的值（單位：UTF-8 bytes）
+        report_path (str): 完整結果寫成 JSON（每檔各設定的合併數、截斷翻轉點）
+        fs (VaultFS): 檔案存取（預設磁碟）
+
+    Returns:
+        dict: {"unwrap": [...], "truncation": [...]}，每個設定一筆統計
+    """
+    fs = fs or VaultFS(vault_path)
+    min_wrap_lens = sorted(set(min_wrap_lens) | {unwrap.MIN_WRAP_LEN})
+    titleish_maxes = sorted(set(titleish_maxes) | {unwrap.TITLEISH_MAX})
+    truncation_thresholds = sorted(set(truncation_thresholds) | {LONG_FILENAME_UTF8_BYTES_THRESHOLD})
+
+    logger = Logger(log_path=log_path, verbose=verbose, title="Threshold Sweep Log", fs=fs)
+    log = logger.log
+
+    # --- unwrap_hard_wraps ---
+    grid, per_file = sweep_unwrap(vault_path, min_wrap_lens, titleish_maxes, fs)
+    base = grid.index((unwrap.MIN_WRAP_LEN, unwrap.TITLEISH_MAX))
+    log(f"🧵 unwrap_hard_wraps（目前：MIN_WRAP_LEN={unwrap.MIN_WRAP_LEN}, TITLEISH_MAX={unwrap.TITLEISH_MAX}）")
+    unwrap_rows = []
+    for g, (min_wrap_len, titleish_max) in enumerate(grid):
+        gained = sorted(rel for rel, m in per_file.items() if m[g] and not m[base])
+        lost = sorted(rel for rel, m in per_file.items() if m[base] and not m[g])
+        row = {
+            "min_wrap_len": min_wrap_len,
+            "titleish_max": titleish_max,
+            "merged": sum(m[g] for m in per_file.values()),
+            "files": sum(1 for m in per_file.values() if m[g]),
+            "count_changed": sum(1 for m in per_file.values() if m[g] != m[base]),
+            "gained": gained,
+            "lost": lost,
+        }
+        unwrap_rows.append(row)
+        mark = "👉" if g == base else "  "
+        log(f"{mark} MIN_WRAP_LEN={min_wrap_len:>4} TITLEISH_MAX={titleish_max:>4} │ 合併 {row['merged']:>6} 處、"
+            f"改寫 {row['files']:>5} 檔 │ 合併數不同 {row['count_changed']} 檔，翻轉 +{len(gained)} / -{len(lost)}")
+        log_flips(log, gained, lost)
+
+    # --- build_uid_map_for_truncated_titles ---
+    counts, always, flip_points = sweep_truncation(vault_path, truncation_thresholds, fs)
+    log(f"\n✂️ build_uid_map_for_truncated_titles（目前：LONG_FILENAME_UTF8_BYTES_THRESHOLD={LONG_FILENAME_UTF8_BYTES_THRESHOLD}）")
+    log(f"   補述為符號、任何門檻皆截斷：{len(always)} 檔；截斷與否取決於門檻：{len(flip_points)} 檔")
+    truncation_rows = []
+    for threshold, count in zip(truncation_thresholds, counts):
+        lo, hi = sorted((threshold, LONG_FILENAME_UTF8_BYTES_THRESHOLD))
+        flipped = sorted(rel for rel, nbytes in flip_points.items() if lo <= nbytes < hi)
+        gained, lost = (flipped, []) if threshold < LONG_FILENAME_UTF8_BYTES_THRESHOLD else ([], flipped)
+        truncation_rows.append({"threshold": threshold, "truncated": count, "gained": gained, "lost": lost})
+        mark = "👉" if threshold == LONG_FILENAME_UTF8_BYTES_THRESHOLD else "  "
+        log(f"{mark} THRESHOLD={threshold:>4} │ 截斷 {count:>6} 檔 │ 翻轉 +{len(gained)} / -{len(lost)}")
+        log_flips(log, gained, lost)
+
+    result = {"unwrap": unwrap_rows, "truncation": truncation_rows}
+    if report_path:
+        report = dict(result, unwrap_per_file={
+            "grid": [list(g) for g in grid],
+            "merges": per_file,
+        }, truncation_flip_points=flip_points, truncation_always=always)
+        state_fs(fs).write_state(report_path, json.dumps(report, ensure_ascii=False, indent=2))
+        log(f"\n💾 完整結果：{report_path}")
+    logger.save()
+    return result
+
+
+def log_flips(log, gained: List[str], lost: List[str]) -> None:
+    for sign, rels in (("+", gained), ("-", lost)):
+        for rel in rels[:MAX_LISTED_FLIPS]:
+            log(f"      {sign} {rel}")
+        if len(rels) > MAX_LISTED_FLIPS:
+            log(f"      {sign} …另 {len(rels) - MAX_LISTED_FLIPS} 檔")
+
+
+if __name__ == "__main__":
+    BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    VAULT = os.path.join(BASE_DIR, "TestData")
+    LOG = os.path.join(BASE_DIR, "log", "sweep_thresholds.log")
+    REPORT = os.path.join(BASE_DIR, "log", "sweep_thresholds.json")
+    sweep_thresholds(VAULT, log_path=LOG, verbose=True, report_path=REPORT)
@@ -0,0 +1,132 @@
+# src/transform_cards_in_place.py
+
+import os
+import json
+from collections import Counter
+from utils.change_events import REWRITTEN, ChangeEvent, drain
+from utils.logger import Logger
+from utils.state_store import StateStore
+from utils.vault_fs import VaultFS
+from convert_links_to_wikilinks import build_rename_name_map
+from ingest_heptabase_backup import transform_card
+
+
+def transform_cards_in_place(
+    vault_path,
+    rename_map_path=None,
+    indent_unit_map_path=None,
+    log_path=None,
+    verbose=False,
+    spaces_per_indent=4,
+    fallback_indent=4,
+    threshold=0.5,
+    state_db_path=None,
+    fs=None,
+):
+    """
+    第 2–5 步融合為單次走訪：每張卡片讀一次、在記憶體依序清理 YAML → 轉 wikilink → 推算縮排單位 → 統一縮排，
+    有變更才寫回一次。卡片內容、indent_unit_map 與狀態庫的結果和依序執行四步相同（四步各自的 log 改為合併成一份）。
+    main.py 指定 --fuse（fuse=True）且第 2–5 步都要執行時以此取代；預設逐步執行，以保留四步各自的 log。
+
+    Args:
+        vault_path (str): Vault 根目錄
+        rename_map_path (str): 第 1 步輸出的改名對照表（第 3 步用）
+        indent_unit_map_path (str): 若提供，輸出縮排單位對應表 JSON（同第 4 步）
+        log_path (str): 合併的 log
+        verbose (bool): 是否印出 log
+        spaces_per_indent / fallback_indent / threshold: 同第 4、5 步
+        state_db_path (str): 若提供，改名對照表由狀態庫讀取、縮排單位寫回狀態庫
+        fs (VaultFS): 共用的檔案系統層
+
+    Returns:
+        Tuple[List[str], dict]: (有改寫的檔案, indent_unit_map)
+    """
+    return drain(iter_transform_cards_in_place(
+        vault_path, rename_map_path, indent_unit_map_path, log_path, verbose,
+        spaces_per_indent, fallback_indent, threshold, state_db_path, fs,
+    ))
+
+
+def iter_transform_cards_in_place(
+    vault_path,
+    rename_map_path=None,
+    indent_unit_map_path=None,
+    log_path=None,
+    verbose=False,
+    spaces_per_indent=4,
+    fallback_indent=4,
+    threshold=0.5,
+    state_db_path=None,
+    fs=None,
+):
+    """transform_cards_in_place 的串流版：每寫回一張卡片就 yield ChangeEvent(rewritten)
+    （四步的變更合併為一筆，含 wikilink 轉換）；indent_unit_map 於走訪結束後輸出。
+    """
+    fs = fs or VaultFS(vault_path)
+    logger = Logger(log_path=log_path, verbose=verbose, title="Card Transform Log (steps 2–5)", fs=fs)
+    log = logger.log
+
+    rename_map = {}
+    if state_db_path:
+        store = StateStore(state_db_path)
+        rename_map = store.rename_map()
+        store.close()
+    if not rename_map and rename_map_path:
+        text = fs.read_state(rename_map_path)
+        if text is not None:
+            rename_map = json.loads(text)
+    rename_name_map = build_rename_name_map(rename_map)
+
+    changed_files = []
+    file_indent_map = {}
+    global_indent_diffs = Counter()
+    for root, _, files in fs.walk(vault_path):
+        for file in files:
+            if not file.endswith(".md"):
+                continue
+
+            full_path = os.path.join(root, file)
+            rel_path = os.path.relpath(full_path, vault_path)
+            content = fs.read_text(full_path)
+            new_content, unit = transform_card(
+                content, rel_path, rename_name_map, log,
+                spaces_per_indent, fallback_indent, threshold, global_indent_diffs,
+                stream=fs.should_stream(full_path),
+            )
+            file_indent_map[rel_path] = unit
+            if new_content != content:
+                fs.write_text(full_path, new_content)
+                changed_files.append(rel_path)
+                log(f"✅ {rel_path}：已更新")
+                yield ChangeEvent(REWRITTEN, "card_transform", rel_path)
+            else:
+                log(f"☑️ {rel_path}：無需修改")
+
+    fs.sync()
+    if indent_unit_map_path:
+        fs.write_state(indent_unit_map_path, json.dumps(file_indent_map, indent=2, ensure_ascii=False))
+    if state_db_path:
+        store = StateStore(state_db_path)
+        store.upsert_indent_units(file_indent_map)
+        store.close()
+
+    log("\n📊 全域縮排差異統計：")
+    for diff, count in sorted(global_indent_diffs.items()):
+        log(f"{diff:+3d} → {count} 次")
+    log(f"\n🎉 共 {len(file_indent_map)} 張卡片、改寫 {len(changed_files)} 個檔案")
+    logger.save()
+    return changed_files, file_indent_map
+
+
+if __name__ == "__main__":
+    BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    VAULT_PATH = os.path.join(BASE_DIR, "TestData")
+    LOG_DIR = os.path.join(BASE_DIR, "log")
+
+    transform_cards_in_place(
+        VAULT_PATH,
+        rename_map_path=os.path.join(LOG_DIR, "rename_map.json"),
+        indent_unit_map_path=os.path.join(LOG_DIR, "indent_unit_map.json"),
+        log_path=os.path.join(LOG_DIR, "card_transform.log"),
+        verbose=True,
+    )
@@ -2,23 +2,23 @@
 
 import os
 import re
+from collections import Counter
 from datetime import datetime
-from utils.get_safe_path import get_safe_path
+from utils.change_events import REWRITTEN, ChangeEvent, drain
 from utils.logger import Logger
+from utils.md_lexer import (
+    FRONTMATTER, FENCE, CODE, TABLE, iter_lexed_lines,
+    MD_TABLE_LINE, HR_LINE, ATX_HEADING, LIST_BULLET, LIST_ORDERED, CODE_FENCE,
+    BLOCKQUOTE_LINE as BLOCKQUOTE,
+)
+from utils.vault_fs import VaultFS
 
 # === 可調參數（單位：UTF-8 bytes） ===
 MIN_WRAP_LEN = 80     # 視為「很長一行」的長度門檻（全英文約120字，全中文約40字）
 TITLEISH_MAX = 64     # 視為「短標題」的長度上限（全英文約80字，全中文約26字）
 SENTENCE_ENDERS = ("。", "！", "？", ".", "!", "?")
 
-# === Markdown 模式 ===
-MD_TABLE_LINE = re.compile(r'^\s*\|')   # 表格
-HR_LINE = re.compile(r'^\s*(-{3,}|\*{3,}|_{3,})\s*$')
-ATX_HEADING = re.compile(r'^\s{0,3}#{1,6}\s')
-LIST_BULLET = re.compile(r'^\s{0,}[*\-+]\s+')
-LIST_ORDERED = re.compile(r'^\s{0,}\d{1,3}[.)]\s+')
-BLOCKQUOTE = re.compile(r'^\s{0,3}>\s?')
-CODE_FENCE = re.compile(r'^\s{0,3}```')
+# === Markdown 模式（區塊模式共用 utils.md_lexer） ===
 HARD_BREAK = re.compile(r'(  |\s\\)$')  # 兩空白或反斜線結尾的強制換行
 BQ_PREFIX = re.compile(r'^(\s{0,3}>\s?)')  # 抓 blockquote 前綴（支援最多3空白）
 
@@ -38,13 +38,6 @@ def split_bq_prefix(line: str):
         return "", line
     return m.group(0), line[m.end():]
 
-def find_yaml_block(lines):
-    """回傳 (start, end) 或 (None, None)"""
-    boundaries = [i for i, l in enumerate(lines[:20]) if l.strip() == "---"]
-    if len(boundaries) >= 2 and boundaries[0] == 0:
-        return boundaries[0], boundaries[1]
-    return None, None
-
 # === 工具函式 ===
 def is_header_line(s: str) -> bool:
     return ATX_HEADING.match(s.lstrip()) is not None
@@ -77,15 +70,18 @@ def is_block_starter(s: str) -> bool:
 def looks_titleish(s: str) -> bool:
     """短、像標題/名詞/連結的行：不當作續行來源"""
     txt = s.strip()
-    if len(txt.encode("utf-8")) <= TITLEISH_MAX:
-        # 純連結/粗體/名詞傾向
-        if txt.endswith(("]]", ")")):
-            return True
-        if (txt.startswith("**") and txt.endswith("**")) or (txt.startswith("[[") and txt.endswith("]]")):
-            return True
-        # 只有一兩個詞的標題感
-        if ":" not in txt and all(len(w) <= 20 for w in txt.replace("**", "").split()):
-            return True
+    return len(txt.encode("utf-8")) <= TITLEISH_MAX and has_titleish_shape(txt)
+
+def has_titleish_shape(txt: str) -> bool:
+    """looks_titleish 中與長度無關的部分（txt 已 strip）；門檻掃描只需算一次"""
+    # 純連結/粗體/名詞傾向
+    if txt.endswith(("]]", ")")):
+        return True
+    if (txt.startswith("**") and txt.endswith("**")) or (txt.startswith("[[") and txt.endswith("]]")):
+        return True
+    # 只有一兩個詞的標題感
+    if ":" not in txt and all(len(w) <= 20 for w in txt.replace("**", "").split()):
+        return True
     return False
 
 def ends_with_forced_break(prev_raw: str) -> bool:
@@ -192,124 +188,127 @@ def should_unwrap(
     log(f"{base} | 🚫 SKIP — default (did not meet merge conditions)")
     return False
 
+def join_wrapped(curr: str, nxt: str, same_bq_level: bool) -> str:
+    """把下一行接到 curr 後面（中間一個空白）"""
+    if same_bq_level:
+        # blockquote 內部合併：保留一個前綴，把內容接起來
+        curr_bq, curr_body = split_bq_prefix(curr)
+        _, nxt_body = split_bq_prefix(nxt)
+        return curr_bq + curr_body.rstrip("\n").rstrip() + " " + nxt_body.lstrip()
+    return curr.rstrip("\n").rstrip() + " " + nxt.lstrip()
+
+# === 連鎖合併（逐行產出，小檔與串流大檔共用） ===
+def iter_unwrapped_lines(lexed_lines, log, rel, stats):
+    """(line, 種類) → 合併硬斷行後的行。
+    以 curr 為基底一路吃能併的下一行；記憶體只持有目前這一段（最長段落），stats["merged"] 累計合併次數。
+    """
+    curr = None
+    start = 0  # curr 的起始行號
+    for j, (nxt, kind) in enumerate(lexed_lines):
+        if curr is not None:
+            # 下一行若是 YAML/fence 內容/表格，就停（fence 開關行交給 should_unwrap 判斷）
+            if kind in (FRONTMATTER, CODE, TABLE):
+                reason = "yaml/fence/table boundary"
+                log(f"⛔ [{rel}] L{start}->{j} stop: {reason}")
+            else:
+                # 允許在同層 blockquote 內合併：只要 prev/nxt 都是 blockquote 且前綴一致
+                curr_bq, _ = split_bq_prefix(curr)
+                nxt_bq, _ = split_bq_prefix(nxt)
+                same_bq_level = (curr_bq != "" and curr_bq == nxt_bq)
+
+                # 計算清單續行旗標
+                prev_is_list = bool(LIST_BULLET.match(curr.lstrip()) or LIST_ORDERED.match(curr.lstrip()))
+                next_indented_text = bool(
+                    (nxt.startswith("  ") or nxt.startswith("\t")) and
+                    not (LIST_BULLET.match(nxt) or LIST_ORDERED.match(nxt) or BLOCKQUOTE.match(nxt) or CODE_FENCE.match(nxt) or ATX_HEADING.match(nxt))
+                )
+
+                # 判斷是否合併
+                if should_unwrap(
+                    curr, nxt,
+                    prev_is_list=prev_is_list,
+                    next_indented_text=next_indented_text,
+                    same_bq_level=same_bq_level,
+                    log=log, rel=rel, i=j-1
+                ):
+                    curr = join_wrapped(curr, nxt, same_bq_level)
+                    stats["merged"] += 1
+                    continue
+
+            # 寫出本段（可能已合併多行），nxt 重新當作起點判斷
+            yield curr
+            curr = None
+
+        # YAML 區塊、fence 開關行、fenced code、表格行保留（不跨行合併）
+        if kind in (FRONTMATTER, FENCE, CODE, TABLE):
+            yield nxt
+        else:
+            curr, start = nxt, j
+
+    if curr is not None:
+        yield curr
+
 # === 主流程 ===
-def unwrap_hard_wraps(vault_path, log_path=None, verbose=False):
+def unwrap_hard_wraps(vault_path, log_path=None, verbose=False, fs=None):
+    return drain(iter_unwrap_hard_wraps(vault_path, log_path, verbose, fs))
+
+
+def iter_unwrap_hard_wraps(vault_path, log_path=None, verbose=False, fs=None):
+    """unwrap_hard_wraps 的串流版：每改寫一份檔案就 yield ChangeEvent(rewritten)。"""
+    fs = fs or VaultFS(vault_path)
     changed_files = 0
     changed_lines_total = 0
 
-    logger = Logger(log_path=log_path, verbose=verbose, title="Unwrap Hard Wraps Log")
+    logger = Logger(log_path=log_path, verbose=verbose, title="Unwrap Hard Wraps Log", fs=fs)
     log = logger.log
     log(f"🧵 Unwrap Hard Wraps Log — {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
     log(f"Params: MIN_WRAP_LEN={MIN_WRAP_LEN} bytes, TITLEISH_MAX={TITLEISH_MAX} bytes\n")
 
-    for root, _, files in os.walk(vault_path):
+    for root, _, files in fs.walk(vault_path):
         for file in files:
             if not file.endswith(".md"):
                 continue
 
             fp = os.path.join(root, file)
-            sfp = get_safe_path(fp)
             rel = os.path.relpath(fp, vault_path)
 
-            try:
-                with open(sfp, "r", encoding="utf-8") as f:
-                    lines = f.readlines()
-            except Exception as e:
-                log(f"⚠️  無法讀取 {rel}: {e}")
-                continue
-
-            yaml_start, yaml_end = find_yaml_block(lines)
-            in_fence = False
-            out = []
-            i = 0
-            merged_count = 0
-
-            def in_yaml(idx):
-                return yaml_start is not None and yaml_start <= idx <= yaml_end
-
-            while i < len(lines):
-                line = lines[i]
-
-                # YAML 區塊保留
-                if in_yaml(i):
-                    out.append(line)
-                    i += 1
-                    continue
-
-                # fenced code 切換
-                if CODE_FENCE.match(line):
-                    in_fence = not in_fence
-                    out.append(line)
-                    i += 1
+            stats = Counter()
+            if fs.should_stream(fp):
+                # 大檔：逐行讀、逐行寫暫存檔，有變更才替換；記憶體上限為最長段落
+                try:
+                    changed = fs.stream_rewrite(
+                        fp, lambda src: iter_unwrapped_lines(iter_lexed_lines(src), log, rel, stats)
+                    )
+                except Exception as e:
+                    log(f"⚠️  無法改寫 {rel}: {e}")
                     continue
-
-                # 表格行保留（不跨行合併）
-                if in_fence or MD_TABLE_LINE.match(line):
-                    out.append(line)
-                    i += 1
+            else:
+                try:
+                    doc = fs.lex(fp)
+                    lines, kinds = doc.lines, doc.kinds
+                except Exception as e:
+                    log(f"⚠️  無法讀取 {rel}: {e}")
                     continue
 
-                # 嘗試「連鎖合併」：以 curr 為基底一路吃能併的下一行
-                curr = line
-                j = i + 1
-
-                while j < len(lines):
-                    nxt = lines[j]
-
-                    # 下一行若是 YAML/fence/表格，或我們目前在 fence 中，就停
-                    if in_yaml(j) or in_fence or MD_TABLE_LINE.match(nxt):
-                        reason = "yaml/fence/table boundary"
-                        log(f"⛔ [{rel}] L{i}->{j} stop: {reason}")
-                        break
-
-                    # 允許在同層 blockquote 內合併：只要 prev/nxt 都是 blockquote 且前綴一致
-                    curr_bq, curr_body = split_bq_prefix(curr)
-                    nxt_bq, nxt_body = split_bq_prefix(nxt)
-                    same_bq_level = (curr_bq != "" and curr_bq == nxt_bq)
-
-                    # 計算清單續行旗標
-                    prev_is_list = bool(LIST_BULLET.match(curr.lstrip()) or LIST_ORDERED.match(curr.lstrip()))
-                    next_indented_text = bool(
-                        (nxt.startswith("  ") or nxt.startswith("\t")) and
-                        not (LIST_BULLET.match(nxt) or LIST_ORDERED.match(nxt) or BLOCKQUOTE.match(nxt) or CODE_FENCE.match(nxt) or ATX_HEADING.match(nxt))
-                    )
-
-                    # 判斷是否合併
-                    if should_unwrap(
-                        curr, nxt,
-                        prev_is_list=prev_is_list,
-                        next_indented_text=next_indented_text,
-                        same_bq_level=same_bq_level,
-                        log=log, rel=rel, i=j-1
-                    ):
-                        if same_bq_level:
-                            # blockquote 內部合併：保留一個前綴，把內容接起來
-                            merged = curr_bq + curr_body.rstrip("\n").rstrip() + " " + nxt_body.lstrip()
-                        else:
-                            merged = curr.rstrip("\n").rstrip() + " " + nxt.lstrip()
-                        curr = merged
-                        j += 1
-                        merged_count += 1
+                out = list(iter_unwrapped_lines(zip(lines, kinds), log, rel, stats))
+                changed = out != lines
+                if changed:
+                    try:
+                        fs.write_text(fp, "".join(out))
+                    except Exception as e:
+                        log(f"⚠️  無法寫入 {rel}: {e}")
                         continue
-                    else:
-                        break
-
-                # 寫出本段（可能已合併多行）
-                out.append(curr)
-                i = j
 
-            if out != lines:
-                try:
-                    with open(sfp, "w", encoding="utf-8") as f:
-                        f.writelines(out)
-                    changed_files += 1
-                    changed_lines_total += merged_count
-                    log(f"✅ {rel}：合併 {merged_count} 處硬斷行")
-                except Exception as e:
-                    log(f"⚠️  無法寫入 {rel}: {e}")
+            if changed:
+                merged_count = stats["merged"]
+                changed_files += 1
+                changed_lines_total += merged_count
+                log(f"✅ {rel}：合併 {merged_count} 處硬斷行")
+                yield ChangeEvent(REWRITTEN, "unwrap", rel)
             else:
                 log(f"☑️ {rel}：無需變更")
 
+    fs.sync()
     log(f"\n📊 統計：修正 {changed_files} 份檔案，共合併 {changed_lines_total} 處硬斷行")
     logger.save()
     return changed_files, changed_lines_total
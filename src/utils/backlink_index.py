@@ -0,0 +1,155 @@
+# src/utils/backlink_index.py
+
+import os
+import json
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from utils.byte_prefilter import WIKILINK_OPEN
+from utils.get_safe_path import get_safe_path
+from utils.md_lexer import WIKILINK_TARGET
+from utils.vault_fs import STREAM_THRESHOLD_BYTES, VaultFS, state_fs
+
+
+def extract_link_targets(content: str) -> Dict[str, List[int]]:
+    """掃描內容 → {連結目標: [字元位移, ...]}。"""
+    links: Dict[str, List[int]] = {}
+    if "[[" not in content:
+        return links
+    for m in WIKILINK_TARGET.finditer(content):
+        links.setdefault(m.group(1), []).append(m.start())
+    return links
+
+
+def extract_link_targets_from_lines(lines: Iterable[str]) -> Dict[str, List[int]]:
+    """extract_link_targets 的逐行版（wikilink 不跨行），位移一樣是整份內容的字元位移；供大檔串流使用。"""
+    links: Dict[str, List[int]] = {}
+    base = 0
+    for line in lines:
+        if "[[" in line:
+            for m in WIKILINK_TARGET.finditer(line):
+                links.setdefault(m.group(1), []).append(base + m.start())
+        base += len(line)
+    return links
+
+
+class BacklinkIndex:
+    """全 Vault 反向連結索引：連結目標 → {引用檔相對路徑: [位移, ...]}。
+
+    - refresh：依 (mtime_ns, size) 只重新讀取有變動的檔案
+    - update_file / remove_file：由改寫連結的步驟就地維護
+    - save / load：以 JSON 保存，下次執行沿用
+    """
+
+    VERSION = 1
+
+    def __init__(self):
+        self._files: Dict[str, dict] = {}                    # rel → {"sig": [mtime_ns, size], "links": {...}}
+        self._by_target: Dict[str, Dict[str, List[int]]] = {}
+
+    # ===== 查詢 =====
+    def who_links_here(self, target: str) -> Dict[str, List[int]]:
+        """回傳引用 target 的檔案與位移（第 7 步 log 的歧義連結位置、delta 條目引用者）。"""
+        return dict(self._by_target.get(target, {}))
+
+    def targets(self) -> Iterable[str]:
+        return self._by_target.keys()
+
+    def files_linking_to_any(self, targets: Iterable[str]) -> Set[str]:
+        result: Set[str] = set()
+        for t in targets:
+            result.update(self._by_target.get(t, ()))
+        return result
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    # ===== 維護 =====
+    def update_file(self, rel_path: str, content: str, sig: Optional[Tuple[int, int]] = None) -> None:
+        self.update_file_links(rel_path, extract_link_targets(content), sig)
+
+    def update_file_links(self, rel_path: str, links: Dict[str, List[int]], sig: Optional[Tuple[int, int]] = None) -> None:
+        self.remove_file(rel_path)
+        self._files[rel_path] = {"sig": list(sig) if sig else None, "links": links}
+        for target, offsets in links.items():
+            self._by_target.setdefault(target, {})[rel_path] = offsets
+
+    def remove_file(self, rel_path: str) -> None:
+        old = self._files.pop(rel_path, None)
+        if not old:
+            return
+        for target in old["links"]:
+            refs = self._by_target.get(target)
+            if refs is not None:
+                refs.pop(rel_path, None)
+                if not refs:
+                    del self._by_target[target]
+
+    def reindex_file(
+        self, full_path: str, rel_path: str, sig: Optional[Tuple[int, int]] = None, fs: Optional[VaultFS] = None
+    ) -> None:
+        """重新讀取單一檔案的連結（大檔逐行）；未提供 fs 時直接讀磁碟。"""
+        fs = state_fs(fs)
+        sig = sig or fs.signature(full_path)
+        if not fs.may_match(full_path, WIKILINK_OPEN):
+            self.update_file(rel_path, "", sig)  # 沒有 [[ 就沒有連結，不必解碼
+        elif sig[1] >= STREAM_THRESHOLD_BYTES:
+            self.update_file_links(rel_path, extract_link_targets_from_lines(fs.iter_lines(full_path)), sig)
+        else:
+            self.update_file(rel_path, fs.read_text(full_path), sig)
+
+    def refresh(self, vault_path: str, fs: Optional[VaultFS] = None) -> Tuple[Set[str], Set[str]]:
+        """與 Vault 同步：只重讀簽章（磁碟為 (mtime_ns, size)）改變的 .md，移除已不存在的檔案。
+        回傳 (重新索引的相對路徑, 移除的相對路徑)。
+        """
+        seen: Set[str] = set()
+        reindexed: Set[str] = set()
+        walk = fs.walk(vault_path) if fs is not None else os.walk(vault_path)
+        for root, _, files in walk:
+            for file in files:
+                if not file.endswith(".md"):
+                    continue
+                full_path = os.path.join(root, file)
+                rel_path = os.path.relpath(full_path, vault_path)
+                seen.add(rel_path)
+                sig = fs.signature(full_path) if fs is not None else file_signature(full_path)
+                cached = self._files.get(rel_path)
+                if cached is not None and cached["sig"] == list(sig):
+                    continue
+                self.reindex_file(full_path, rel_path, sig, fs)
+                reindexed.add(rel_path)
+        removed = {rel for rel in self._files if rel not in seen}
+        for rel in removed:
+            self.remove_file(rel)
+        return reindexed, removed
+
+    # ===== I/O =====
+    def save(self, path: str, fs: Optional[VaultFS] = None) -> None:
+        state_fs(fs).write_state(
+            get_safe_path(path), json.dumps({"version": self.VERSION, "files": self._files}, ensure_ascii=False), atomic=True
+        )
+
+    @classmethod
+    def load(cls, path: Optional[str], fs: Optional[VaultFS] = None) -> "BacklinkIndex":
+        """讀取既有索引；檔案不存在或版本不符則回傳空索引（之後 refresh 會全量建立）。"""
+        index = cls()
+        if not path:
+            return index
+        try:
+            text = state_fs(fs).read_state(get_safe_path(path))
+            if text is None:
+                return index
+            raw = json.loads(text)
+        except (OSError, json.JSONDecodeError):
+            return index
+        if raw.get("version") != cls.VERSION:
+            return index
+        for rel_path, data in raw.get("files", {}).items():
+            index._files[rel_path] = data
+            for target, offsets in data["links"].items():
+                index._by_target.setdefault(target, {})[rel_path] = offsets
+        return index
+
+
+def file_signature(path: str) -> Tuple[int, int]:
+    st = os.stat(get_safe_path(path))
+    return st.st_mtime_ns, st.st_size
@@ -0,0 +1,70 @@
+# src/utils/byte_prefilter.py
+
+import mmap
+import os
+import re
+from typing import Callable, Union
+
+from utils.get_safe_path import get_safe_path
+
+
+# 前置過濾條件：bytes regex（search 命中即可能受影響）或自訂函式 buf → bool。
+# 條件只能「寬」不能「窄」：回傳 False 代表這個檔案絕對不會被該步驟改動，可以不解碼直接跳過。
+BytesPredicate = Union["re.Pattern[bytes]", Callable[[bytes], bool]]
+
+# Python str.isspace() 為真的字元（UTF-8 編碼）；str.lstrip() 會移除的行首空白
+_UNICODE_SPACE = (
+    rb"[ \t\x0b\x0c\x1c-\x1f]|\xc2[\x85\xa0]|\xe1\x9a\x80"
+    rb"|\xe2\x80[\x80-\x8a\xa8\xa9\xaf]|\xe2\x81\x9f|\xe3\x80\x80"
+)
+# 行首（文字模式下 \r、\r\n、\n 都是換行）
+_LINE_START = rb"(?:\A|[\r\n])"
+
+LEADING_WHITESPACE = re.compile(_LINE_START + rb"(?:" + _UNICODE_SPACE + rb")")
+WIKILINK_OPEN = re.compile(rb"\[\[")
+
+
+def contains_in_order(*needles: bytes) -> Callable[[bytes], bool]:
+    """所有 needle 依序出現（中間可隔任意內容），例如 b"](" 之後有 b".md)"。"""
+    def predicate(buf) -> bool:
+        pos = 0
+        for needle in needles:
+            pos = buf.find(needle, pos)
+            if pos < 0:
+                return False
+            pos += len(needle)
+        return True
+    return predicate
+
+
+def in_first_line(needle: bytes) -> Callable[[bytes], bool]:
+    """needle 出現在第一行（第一個 \\r 或 \\n 之前）。"""
+    def predicate(buf) -> bool:
+        end = len(buf)
+        for sep in (b"\n", b"\r"):
+            pos = buf.find(sep, 0, end)
+            if pos >= 0:
+                end = pos
+        return buf.find(needle, 0, end) >= 0
+    return predicate
+
+
+def any_of(*predicates: BytesPredicate) -> Callable[[bytes], bool]:
+    def predicate(buf) -> bool:
+        return any(check_bytes(buf, p) for p in predicates)
+    return predicate
+
+
+def check_bytes(buf, predicate: BytesPredicate) -> bool:
+    if hasattr(predicate, "search"):
+        return predicate.search(buf) is not None
+    return predicate(buf)
+
+
+def file_may_match(path: str, predicate: BytesPredicate) -> bool:
+    """以 mmap 唯讀映射檔案並檢查條件，不做 UTF-8 解碼、不切行。空檔無法 mmap，改對 b"" 檢查。"""
+    with open(get_safe_path(path), "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return check_bytes(b"", predicate)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return check_bytes(buf, predicate)
@@ -0,0 +1,37 @@
+# src/utils/change_events.py
+
+from dataclasses import dataclass
+from typing import Generator, Optional, TypeVar
+
+
+# 事件種類
+CREATED = "created"                  # 匯入時新寫出的檔案
+RENAMED = "renamed"                  # 改名（path → new_path）
+REWRITTEN = "rewritten"              # 內容改寫（YAML 清理、縮排、首句序號化等）
+LINKS_CONVERTED = "links_converted"  # 連結改寫（markdown link → wikilink、[[title]] → [[uid|@alias]]），count 為處數
+UID_ASSIGNED = "uid_assigned"        # 新的 truncation_map 條目（uid ↔ full_sentence）
+DELETED = "deleted"                  # 刪除（重複的截斷卡片）
+
+
+@dataclass(frozen=True, slots=True)
+class ChangeEvent:
+    """步驟在 Vault 中造成的單一變更；事件產生時變更已寫入（經由 VaultFS）。"""
+    kind: str
+    step: str                            # 步驟 id（同 main.build_pipeline 的 "id"）
+    path: str                            # Vault 內相對路徑；renamed 為原路徑
+    new_path: Optional[str] = None       # renamed：新相對路徑
+    count: int = 0                       # links_converted：改寫的連結數
+    uid: Optional[str] = None            # uid_assigned
+    full_sentence: Optional[str] = None  # uid_assigned
+
+
+T = TypeVar("T")
+
+
+def drain(events: Generator[ChangeEvent, None, T]) -> T:
+    """把事件 generator 執行到底並回傳其 return 值；一般版步驟函式即以此包裝 iter_ 版。"""
+    while True:
+        try:
+            next(events)
+        except StopIteration as stop:
+            return stop.value
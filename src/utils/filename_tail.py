@@ -0,0 +1,27 @@
+# src/utils/filename_tail.py
+
+import unicodedata
+from functools import lru_cache
+from typing import Callable, Optional, Tuple
+
+
+INVALID_TAIL_CHARS = frozenset({" ", ".", "\u200B", "\u00A0", "\u3000"})
+
+
+@lru_cache(maxsize=4096)
+def is_invalid_tail_char(char: str) -> bool:
+    """檔名尾端不可出現的字元：空白、句點、零寬空白、不換行空白、全形空白、控制碼（Unicode C*）。"""
+    return char in INVALID_TAIL_CHARS or unicodedata.category(char).startswith("C")
+
+
+def split_invalid_tail(name: str, checker: Optional[Callable[[str], bool]] = None) -> Tuple[str, str]:
+    """name → (去除非法尾端後的名稱, 被去除的尾端字串)。"""
+    checker = checker or is_invalid_tail_char
+    i = len(name)
+    while i > 0 and checker(name[i - 1]):
+        i -= 1
+    return name[:i], name[i:]
+
+
+def unicode_escape(text: str) -> str:
+    return "".join(f"\\u{ord(c):04x}" for c in text)
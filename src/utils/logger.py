@@ -1,12 +1,13 @@
 # src/utils/logger.py
-import os
 from datetime import datetime
 from utils.get_safe_path import get_safe_path
+from utils.vault_fs import state_fs
 
 
 class Logger:
-    def __init__(self, log_path=None, verbose=False, title=None):
+    def __init__(self, log_path=None, verbose=False, title=None, fs=None):
         self.verbose = verbose
+        self.fs = fs  # 經由 VaultFS 寫 log（記憶體 Vault 時 log 也留在記憶體）
         self.log_path = get_safe_path(log_path) if log_path else None
         self.log_lines = []
         self.title = title or "📘 Log"
@@ -38,11 +39,8 @@ class Logger:
             self._line_buffer = ""
 
         if self.log_path:
-            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
-            with open(self.log_path, "w", encoding="utf-8") as f:
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                f.write(f"{self.title} — {timestamp}\n\n")
-                f.write("\n".join(self.log_lines))
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            state_fs(self.fs).write_state(self.log_path, f"{self.title} — {timestamp}\n\n" + "\n".join(self.log_lines))
 
     def info(self):
         self.log(f"self.log_path: {self.log_path}")
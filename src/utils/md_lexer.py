@@ -0,0 +1,125 @@
+# src/utils/md_lexer.py
+
+import itertools
+import re
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+
+# === 行種類 ===
+FRONTMATTER = "frontmatter"  # YAML 區塊（含上下兩條 ---）
+FENCE = "fence"              # ``` 開／關行
+CODE = "code"                # fenced code 內容
+TABLE = "table"
+HEADING = "heading"
+LIST = "list"
+BLOCKQUOTE = "blockquote"
+HR = "hr"
+BLANK = "blank"
+TEXT = "text"
+
+# === Markdown 區塊模式（各步驟共用，不再各自定義；連結樣式仍由各連結步驟依其語意自訂） ===
+MD_TABLE_LINE = re.compile(r'^\s*\|')
+HR_LINE = re.compile(r'^\s*(-{3,}|\*{3,}|_{3,})\s*$')
+ATX_HEADING = re.compile(r'^\s{0,3}#{1,6}\s')
+LIST_BULLET = re.compile(r'^\s{0,}[*\-+]\s+')
+LIST_ORDERED = re.compile(r'^\s{0,}\d{1,3}[.)]\s+')
+BLOCKQUOTE_LINE = re.compile(r'^\s{0,3}>\s?')
+CODE_FENCE = re.compile(r'^\s{0,3}```')
+
+# 連結：任一 wikilink（含 embed 與 alias；group 1 = 連結目標，| 之前）
+WIKILINK_TARGET = re.compile(r"\[\[([^\[\]\|\n]+?)(?:\|[^\]\n]*)?\]\]")
+
+
+def find_frontmatter(lines: Sequence[str]) -> Optional[Tuple[int, int]]:
+    """YAML frontmatter 的 (起始行, 結束行)（含兩條 ---）；第 0 行不是 --- 或沒有收尾則回傳 None。"""
+    if not lines or lines[0].strip() != "---":
+        return None
+    for i in range(1, len(lines)):
+        if lines[i].strip() == "---":
+            return 0, i
+    return None
+
+
+def split_lines(text: str) -> List[str]:
+    """與 f.readlines() 相同的切行（只認 \\n，保留換行符）；不用 str.splitlines 以免切到 \\x0c、\\u2028 等。"""
+    parts = text.split("\n")
+    lines = [p + "\n" for p in parts[:-1]]
+    if parts[-1]:
+        lines.append(parts[-1])
+    return lines
+
+
+def classify_line(line: str, in_fence: bool) -> Tuple[str, bool]:
+    """frontmatter 以外的單行分類；回傳 (種類, 下一行是否仍在 fence 內)。"""
+    if CODE_FENCE.match(line):
+        return FENCE, not in_fence
+    if in_fence:
+        return CODE, True
+    if not line.strip():
+        return BLANK, False
+    if MD_TABLE_LINE.match(line):
+        return TABLE, False
+    if ATX_HEADING.match(line):
+        return HEADING, False
+    if LIST_BULLET.match(line) or LIST_ORDERED.match(line):
+        return LIST, False
+    if BLOCKQUOTE_LINE.match(line):
+        return BLOCKQUOTE, False
+    if HR_LINE.match(line):
+        return HR, False
+    return TEXT, False
+
+
+def iter_lexed_lines(lines: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """classify_lines 的串流版：逐行產出 (line, 種類)，供大檔逐行處理。
+    只有開頭的 frontmatter 需要往後找收尾 ---，這段期間的行先暫存；沒有收尾則整段照一般行分類。
+    """
+    it = iter(lines)
+    first = next(it, None)
+    if first is None:
+        return
+    pending = [first]
+    if first.strip() == "---":
+        for line in it:
+            pending.append(line)
+            if line.strip() == "---":
+                for fm_line in pending:
+                    yield fm_line, FRONTMATTER
+                pending = []
+                break
+    in_fence = False
+    for line in itertools.chain(pending, it):
+        kind, in_fence = classify_line(line, in_fence)
+        yield line, kind
+
+
+def classify_lines(lines: Sequence[str]) -> List[str]:
+    """逐行標記種類；frontmatter 與 fenced code 優先於其他判斷。"""
+    return [kind for _, kind in iter_lexed_lines(lines)]
+
+
+class LexedDoc:
+    """單一檔案的切行結果與行種類（皆為延遲計算、算過即快取）。
+
+    - lines / kinds：供縮排、斷行等逐行步驟共用
+    由 VaultFS.lex() 與檔案內容一起快取；寫回新內容即換成新的 LexedDoc。
+    """
+
+    __slots__ = ("text", "_lines", "_kinds")
+
+    def __init__(self, text: str):
+        self.text = text
+        self._lines = None
+        self._kinds = None
+
+    @property
+    def lines(self) -> List[str]:
+        if self._lines is None:
+            self._lines = split_lines(self.text)
+        return self._lines
+
+    @property
+    def kinds(self) -> List[str]:
+        if self._kinds is None:
+            self._kinds = classify_lines(self.lines)
+        return self._kinds
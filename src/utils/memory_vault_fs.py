@@ -0,0 +1,278 @@
+# src/utils/memory_vault_fs.py
+
+import io
+import os
+from typing import IO, Callable, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+from utils.byte_prefilter import BytesPredicate, check_bytes
+from utils.get_safe_path import get_safe_path
+from utils.md_lexer import LexedDoc
+from utils.vault_fs import STREAM_THRESHOLD_BYTES, VaultFS
+
+
+def _key(path: str) -> str:
+    """記憶體內的路徑鍵：絕對路徑、去掉 Windows 長路徑前綴（get_safe_path 加的 \\\\?\\）。"""
+    path = str(path)
+    if path.startswith("\\\\?\\"):
+        path = path[4:]
+    return os.path.abspath(path)
+
+
+def _decode(data: bytes, errors: Optional[str] = None) -> str:
+    """與文字模式讀檔相同：UTF-8 解碼並把 \\r\\n、\\r 轉成 \\n。"""
+    return data.decode("utf-8", errors or "strict").replace("\r\n", "\n").replace("\r", "\n")
+
+
+class MemoryVaultFS(VaultFS):
+    """完全在記憶體中的 Vault（路徑 → bytes），介面與 VaultFS 相同，不做任何磁碟 I/O。
+
+    - 卡片、附件、狀態檔與 log 全部存在同一個 dict；資料夾結構由寫入路徑推得，列舉順序為寫入順序
+    - 簽章為 (寫入序號, 大小)：每次寫入序號遞增，lex() 的內容快取照常以簽章驗證
+    - durable = False：各步驟略過 WAL、還原日誌與 fsync（程序結束資料即消失，沒有中斷後要復原的狀態）
+    - link / copy 的來源是 Vault 外的檔案（匯入步驟的備份），僅此讀取磁碟
+    - 執行緒：與 VaultFS 相同，所有 dict 的修改都在 self._lock 內進行
+
+    建立：MemoryVaultFS.from_dir(磁碟資料夾) 或 MemoryVaultFS.from_files({相對路徑: 內容})；
+    取出：to_dict() / dump(資料夾)。
+    """
+
+    durable = False
+
+    def __init__(
+        self,
+        root: str = "/vault",
+        files: Optional[Dict[str, Union[bytes, str]]] = None,
+        cache_docs: bool = True,
+        stream_threshold: Optional[int] = STREAM_THRESHOLD_BYTES,
+    ):
+        super().__init__(root, fsync=None, cache_docs=cache_docs, stream_threshold=stream_threshold)
+        self._data: Dict[str, bytes] = {}
+        self._versions: Dict[str, int] = {}
+        self._clock = 0
+        self._ensure_dir(self.root)
+        for rel_path, content in (files or {}).items():
+            self._put(os.path.join(self.root, rel_path), content)
+
+    @classmethod
+    def from_dir(cls, dir_path: str, root: Optional[str] = None, **kwargs) -> "MemoryVaultFS":
+        """把磁碟資料夾整份載入記憶體（依 scandir 順序，走訪順序與直接在磁碟上執行相同）。
+        root 預設沿用 dir_path，呼叫端可繼續使用原本的路徑字串。
+        """
+        mem = cls(root or dir_path, **kwargs)
+
+        def load(src: str, dst: str) -> None:
+            with os.scandir(get_safe_path(src)) as it:
+                entries = list(it)
+            for e in entries:
+                if e.is_dir(follow_symlinks=False):
+                    mem._ensure_dir(os.path.join(dst, e.name))
+                    load(os.path.join(src, e.name), os.path.join(dst, e.name))
+                else:
+                    with open(get_safe_path(os.path.join(src, e.name)), "rb") as f:
+                        mem._put(os.path.join(dst, e.name), f.read())
+
+        load(os.path.abspath(dir_path), mem.root)
+        return mem
+
+    @classmethod
+    def from_files(cls, files: Dict[str, Union[bytes, str]], root: str = "/vault", **kwargs) -> "MemoryVaultFS":
+        """{相對路徑: 內容（str 以 UTF-8 編碼）} → 記憶體 Vault。"""
+        return cls(root, files=files, **kwargs)
+
+    def to_dict(self, top: Optional[str] = None) -> Dict[str, bytes]:
+        """top（預設 root）底下所有檔案 → {相對路徑: bytes}，依走訪順序。"""
+        top = _key(top or self.root)
+        result: Dict[str, bytes] = {}
+        for root, _, files in self.walk(top):
+            for file in files:
+                path = os.path.join(root, file)
+                result[os.path.relpath(path, top)] = self._data[path]
+        return result
+
+    def dump(self, dest_dir: str, top: Optional[str] = None) -> None:
+        """把 top（預設 root）底下的內容寫到磁碟資料夾（除錯、比對用）。"""
+        top = _key(top or self.root)
+        for root, dirs, files in self.walk(top):
+            out_dir = os.path.join(dest_dir, os.path.relpath(root, top))
+            os.makedirs(get_safe_path(out_dir), exist_ok=True)
+            for file in files:
+                with open(get_safe_path(os.path.join(out_dir, file)), "wb") as f:
+                    f.write(self._data[os.path.join(root, file)])
+
+    # ===== 內部 =====
+    def _ensure_dir(self, dir_path: str) -> None:
+        if dir_path in self._listings:
+            return
+        parent, name = os.path.split(dir_path)
+        if name:
+            self._ensure_dir(parent)
+            if self._listings[parent].get(name) is False:
+                raise NotADirectoryError(parent)
+            self._listings[parent][name] = True
+        self._listings[dir_path] = {}
+
+    def _put(self, path: str, data: Union[bytes, str]) -> None:
+        path = _key(path)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self._lock:
+            if path in self._listings:
+                raise IsADirectoryError(path)
+            parent, name = os.path.split(path)
+            self._ensure_dir(parent)
+            self._listings[parent][name] = False
+            self._data[path] = data
+            self._clock += 1
+            self._versions[path] = self._clock
+
+    def _get(self, path: str) -> bytes:
+        try:
+            return self._data[_key(path)]
+        except KeyError:
+            raise FileNotFoundError(path) from None
+
+    # ===== 列舉 / 查詢 =====
+    def _listing(self, dir_path: str) -> Dict[str, bool]:
+        return self._listings.get(_key(dir_path), {})
+
+    def exists(self, path: str) -> bool:
+        path = _key(path)
+        return path in self._data or path in self._listings
+
+    def is_dir(self, path: str) -> bool:
+        return _key(path) in self._listings
+
+    def exists_uncached(self, path: str) -> bool:
+        return self.exists(path)
+
+    def size(self, path: str) -> int:
+        return len(self._get(path))
+
+    def signature(self, path: str) -> Tuple[int, int]:
+        with self._lock:
+            data = self._get(path)
+            return self._versions[_key(path)], len(data)
+
+    # ===== 讀寫 =====
+    def read_bytes(self, path: str) -> bytes:
+        return self._get(path)
+
+    def read_text(self, path: str, errors: Optional[str] = None) -> str:
+        return _decode(self._get(path), errors)
+
+    def iter_lines(self, path: str) -> Iterator[str]:
+        yield from io.StringIO(self.read_text(path))
+
+    def stream_rewrite(self, path: str, transform: Callable[[Iterator[str]], Iterable[str]]) -> bool:
+        original = self.read_text(path)
+        content = "".join(transform(io.StringIO(original)))
+        if content == original:
+            return False
+        self.write_text(path, content)
+        return True
+
+    def may_match(self, path: str, predicate: BytesPredicate) -> bool:
+        path = _key(path)
+        with self._lock:
+            cached = self._docs.get(path)
+        if cached is not None and cached[0] == self.signature(path):
+            return True
+        return check_bytes(self._get(path), predicate)
+
+    def write_text(self, path: str, content: str) -> None:
+        path = _key(path)
+        doc = LexedDoc(content) if self.cache_docs and "\r" not in content and not self._is_large(len(content)) else None
+        with self._lock:
+            self._put(path, content)
+            if doc is not None:
+                self._docs[path] = (self.signature(path), doc)
+            else:
+                self._docs.pop(path, None)
+
+    def write_stream(self, path: str, src: IO[bytes]) -> None:
+        data = src.read()
+        with self._lock:
+            self._put(path, data)
+            self._docs.pop(_key(path), None)
+
+    def link(self, src: str, dst: str) -> None:
+        self.copy(src, dst)
+
+    def copy(self, src: str, dst: str) -> None:
+        with open(get_safe_path(src), "rb") as f:
+            data = f.read()
+        with self._lock:
+            self._put(dst, data)
+            self._docs.pop(_key(dst), None)
+
+    def makedirs(self, dir_path: str) -> None:
+        with self._lock:
+            self._ensure_dir(_key(dir_path))
+
+    def rename(self, src: str, dst: str) -> None:
+        """同 os.rename：檔案或整個資料夾；目的地為既有檔案時覆蓋。"""
+        src, dst = _key(src), _key(dst)
+        with self._lock:
+            self._rename(src, dst)
+
+    def _rename(self, src: str, dst: str) -> None:
+        if not self.exists(src):
+            raise FileNotFoundError(src)
+        src_parent, src_name = os.path.split(src)
+        dst_parent, dst_name = os.path.split(dst)
+        self._ensure_dir(dst_parent)
+        if src in self._data:
+            self._data[dst] = self._data.pop(src)
+            self._versions[dst] = self._versions.pop(src)
+        else:
+            prefix = src + os.sep
+            for old in [p for p in self._listings if p == src or p.startswith(prefix)]:
+                self._listings[dst + old[len(src):]] = self._listings.pop(old)
+            for old in [p for p in self._data if p.startswith(prefix)]:
+                new = dst + old[len(src):]
+                self._data[new] = self._data.pop(old)
+                self._versions[new] = self._versions.pop(old)
+        is_dir = self._listings[src_parent].pop(src_name)
+        self._listings[dst_parent][dst_name] = is_dir
+        if src in self._docs:
+            self._docs[dst] = self._docs.pop(src)
+
+    def remove(self, path: str) -> None:
+        path = _key(path)
+        parent, name = os.path.split(path)
+        with self._lock:
+            if path not in self._data:
+                raise FileNotFoundError(path)
+            del self._data[path]
+            del self._versions[path]
+            self._listings[parent].pop(name, None)
+            self._docs.pop(path, None)
+
+    # ===== 狀態檔 / log =====
+    def isfile(self, path: str) -> bool:
+        return _key(path) in self._data
+
+    def read_state(self, path: str, errors: Optional[str] = None) -> Optional[str]:
+        data = self._data.get(_key(path))
+        return None if data is None else _decode(data, errors)
+
+    def write_state(self, path: str, text: str, atomic: bool = False, fsync: bool = False) -> None:
+        self._put(path, text)
+
+    def append_state(self, path: str, text: str) -> None:
+        with self._lock:
+            self._put(path, self._data.get(_key(path), b"") + text.encode("utf-8"))
+
+    def remove_state(self, path: str) -> None:
+        if self.isfile(path):
+            self.remove(path)
+
+    # ===== 快取 / 落盤 =====
+    def invalidate(self, dir_path: Optional[str] = None) -> None:
+        """記憶體內容即為真實狀態，列舉不會過期；全部失效時只丟內容快取。"""
+        if dir_path is None:
+            with self._lock:
+                self._docs.clear()
+
+    def sync(self) -> None:
+        pass
@@ -0,0 +1,67 @@
+# src/utils/rename_planner.py
+
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+
+from utils.get_safe_path import get_safe_path
+
+
+def order_renames(moves: Dict[str, str], make_temp: Callable[[str], str]) -> List[Tuple[str, str]]:
+    """把一組 src → dst 的改名（視為置換）排成可安全依序執行的步驟。
+
+    - src 彼此不重複、dst 彼此不重複；dst 若非任何 src，必須是空位（由呼叫端保證）
+    - 鏈狀（a → b → c）：從鏈尾往回執行，先讓出目的地再搬入
+    - 環狀（a → b → a）：僅對環的起點借用一次暫存名 make_temp(src)
+
+    Returns:
+        List[Tuple[str, str]]: 依序執行的 (src, dst)，可能包含暫存名的中繼步驟
+    """
+    pending = {src: dst for src, dst in moves.items() if src != dst}
+    steps: List[Tuple[str, str]] = []
+
+    while pending:
+        start = next(iter(pending))
+        chain = [start]
+        seen = {start}
+        cur = pending[start]
+        # 目的地本身也要搬走 → 沿鏈往下找，直到遇到空位或繞回起點
+        while cur in pending and cur not in seen:
+            chain.append(cur)
+            seen.add(cur)
+            cur = pending[cur]
+
+        if cur == start:
+            # 環：起點先借暫存名讓位，其餘由尾往前搬，最後暫存名歸位
+            temp = make_temp(start)
+            steps.append((start, temp))
+            for src in reversed(chain[1:]):
+                steps.append((src, pending.pop(src)))
+            steps.append((temp, pending.pop(start)))
+        else:
+            for src in reversed(chain):
+                steps.append((src, pending.pop(src)))
+
+    return steps
+
+
+def apply_renames(
+    steps: List[Tuple[str, str]],
+    rename_fn: Optional[Callable[[str, str], None]] = None,
+    exists_fn: Optional[Callable[[str], bool]] = None,
+) -> None:
+    """依序執行 order_renames 的結果；遇到目的地已存在即中止，絕不覆寫。
+    rename_fn / exists_fn 可換成 VaultFS.rename / VaultFS.exists（查快取、同步更新快取）。
+    """
+    if rename_fn is None:
+        for src, dst in steps:
+            safe_dst = get_safe_path(dst)
+            if os.path.exists(safe_dst):
+                raise FileExistsError(f"rename target already exists: {dst}")
+            os.makedirs(os.path.dirname(safe_dst), exist_ok=True)
+            os.rename(get_safe_path(src), safe_dst)
+        return
+    exists_fn = exists_fn or (lambda p: os.path.exists(get_safe_path(p)))
+    for src, dst in steps:
+        if exists_fn(dst):
+            raise FileExistsError(f"rename target already exists: {dst}")
+        rename_fn(src, dst)
@@ -0,0 +1,205 @@
+# src/utils/state_store.py
+
+import os
+import json
+import hashlib
+import sqlite3
+from typing import Dict, Iterable, Optional, Tuple
+
+from utils.get_safe_path import get_safe_path
+from utils.vault_fs import VaultFS, state_fs
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS truncation_map (
+    key           TEXT PRIMARY KEY,
+    uid           TEXT NOT NULL UNIQUE,
+    full_sentence TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS rename_map (
+    path     TEXT PRIMARY KEY,
+    new_path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_rename_map_new_path ON rename_map(new_path);
+CREATE TABLE IF NOT EXISTS indent_unit_map (
+    path TEXT PRIMARY KEY,
+    unit INTEGER NOT NULL
+);
+"""
+
+UPSERT_TRUNCATION_SQL = (
+    "INSERT INTO truncation_map(key, uid, full_sentence) VALUES (?, ?, ?) "
+    "ON CONFLICT(key) DO UPDATE SET uid = excluded.uid, full_sentence = excluded.full_sentence"
+)
+
+
+def truncation_map_sha1(map_path: str, fs: Optional[VaultFS] = None) -> Optional[str]:
+    """map JSON 的 sha1（不存在回傳 None）；delta 記下產生時的值，第 7 步據此判斷 delta 是否對應目前的 map。"""
+    text = state_fs(fs).read_state(map_path)
+    return None if text is None else hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class StateStore:
+    """以 SQLite 保存 pipeline 狀態（truncation_map / rename_map / indent_unit_map）。
+
+    - key / uid / full_sentence / path 皆有索引（PRIMARY KEY 或 UNIQUE），各步驟只查需要的列
+    - 寫入皆為 upsert，且包在單一交易內（with store.transaction(): ...）
+    - export_json / import_json 與既有 JSON 檔互通
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = get_safe_path(db_path)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def transaction(self):
+        """with store.transaction(): ... → 成功 commit、例外 rollback。"""
+        return self.conn
+
+    # ===== truncation_map =====
+    def upsert_truncation_entries(self, items: Iterable[Tuple[str, str, str]]) -> None:
+        """items: (key, uid, full_sentence)。"""
+        with self.transaction():
+            self.conn.executemany(UPSERT_TRUNCATION_SQL, items)
+
+    def replace_truncation_entries(self, items: Iterable[Tuple[str, str, str]]) -> None:
+        """整表換成 items；DELETE 與寫入在同一交易，中斷時保留舊表（不會留下空表）。"""
+        with self.transaction():
+            self.conn.execute("DELETE FROM truncation_map")
+            self.conn.executemany(UPSERT_TRUNCATION_SQL, items)
+
+    def truncation_entry(self, key: str) -> Optional[Tuple[str, str]]:
+        """key → (uid, full_sentence)。"""
+        return self.conn.execute(
+            "SELECT uid, full_sentence FROM truncation_map WHERE key = ?", (key,)
+        ).fetchone()
+
+    def uid_for_full(self, full_sentence: str) -> Optional[str]:
+        row = self.conn.execute("SELECT uid FROM truncation_map WHERE full_sentence = ?", (full_sentence,)).fetchone()
+        return row[0] if row else None
+
+    def key_for_uid(self, uid: str) -> Optional[str]:
+        row = self.conn.execute("SELECT key FROM truncation_map WHERE uid = ?", (uid,)).fetchone()
+        return row[0] if row else None
+
+    def full_for_uid(self, uid: str) -> Optional[str]:
+        row = self.conn.execute("SELECT full_sentence FROM truncation_map WHERE uid = ?", (uid,)).fetchone()
+        return row[0] if row else None
+
+    def has_key(self, key: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM truncation_map WHERE key = ?", (key,)).fetchone() is not None
+
+    def truncation_count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM truncation_map").fetchone()[0]
+
+    def iter_truncation_entries(self) -> Iterable[Tuple[str, str, str]]:
+        """依插入順序（rowid）列出 (key, uid, full_sentence)。"""
+        return self.conn.execute("SELECT key, uid, full_sentence FROM truncation_map ORDER BY rowid")
+
+    # ===== rename_map =====
+    def upsert_rename_map(self, rename_map: Dict[str, str]) -> None:
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO rename_map(path, new_path) VALUES (?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET new_path = excluded.new_path",
+                rename_map.items(),
+            )
+
+    def rename_map(self) -> Dict[str, str]:
+        return dict(self.conn.execute("SELECT path, new_path FROM rename_map ORDER BY rowid"))
+
+    # ===== indent_unit_map =====
+    def upsert_indent_units(self, unit_map: Dict[str, int]) -> None:
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO indent_unit_map(path, unit) VALUES (?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET unit = excluded.unit",
+                unit_map.items(),
+            )
+
+    def indent_unit_for(self, path: str) -> Optional[int]:
+        row = self.conn.execute("SELECT unit FROM indent_unit_map WHERE path = ?", (path,)).fetchone()
+        return row[0] if row else None
+
+    # ===== JSON 相容 =====
+    def export_json(self, table: str, json_path: str) -> None:
+        """輸出與舊版相同結構的 JSON（縮排 2、UTF-8）。"""
+        if table == "truncation_map":
+            data = {k: {"uid": u, "full_sentence": s} for k, u, s in self.iter_truncation_entries()}
+        elif table == "rename_map":
+            data = self.rename_map()
+        elif table == "indent_unit_map":
+            data = dict(self.conn.execute("SELECT path, unit FROM indent_unit_map ORDER BY rowid"))
+        else:
+            raise ValueError(f"unknown table: {table}")
+        p = get_safe_path(json_path)
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        with open(p, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+    def import_json(self, table: str, json_path: str) -> int:
+        """把既有 JSON 匯入（upsert），回傳筆數；檔案不存在回傳 0。"""
+        p = get_safe_path(json_path)
+        if not os.path.exists(p):
+            return 0
+        with open(p, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if table == "truncation_map":
+            self.upsert_truncation_entries((k, v["uid"], v["full_sentence"]) for k, v in data.items())
+        elif table == "rename_map":
+            self.upsert_rename_map(data)
+        elif table == "indent_unit_map":
+            self.upsert_indent_units(data)
+        else:
+            raise ValueError(f"unknown table: {table}")
+        return len(data)
+
+
+class StoreIndices:
+    """與 Indices 相同介面的查詢物件，直接查 SQLite（不必每次重建三個 dict）。
+    register / update_full_for_uid 寫入同一連線，由呼叫端決定何時 commit。
+    """
+
+    def __init__(self, store: StateStore):
+        self.store = store
+
+    def uid_for_full(self, full_sentence: str) -> Optional[str]:
+        return self.store.uid_for_full(full_sentence)
+
+    def key_for_uid(self, uid: str) -> Optional[str]:
+        return self.store.key_for_uid(uid)
+
+    def expected_full_for_uid(self, uid: str) -> Optional[str]:
+        return self.store.full_for_uid(uid)
+
+    def has_uid(self, uid: str) -> bool:
+        return self.store.full_for_uid(uid) is not None
+
+    def has_full(self, full_sentence: str) -> bool:
+        return self.store.uid_for_full(full_sentence) is not None
+
+    def full_sentences(self) -> "_FullSentenceView":
+        return _FullSentenceView(self)
+
+    def register(self, key: str, entry) -> None:
+        self.store.conn.execute(
+            "INSERT INTO truncation_map(key, uid, full_sentence) VALUES (?, ?, ?)",
+            (key, entry.uid, entry.full_sentence),
+        )
+
+    def update_full_for_uid(self, uid: str, old_full: str, new_full: str) -> None:
+        self.store.conn.execute("UPDATE truncation_map SET full_sentence = ? WHERE uid = ?", (new_full, uid))
+
+
+class _FullSentenceView:
+    """讓 `x in indices.full_sentences()` 走索引查詢。"""
+
+    def __init__(self, indices: StoreIndices):
+        self._indices = indices
+
+    def __contains__(self, full_sentence: str) -> bool:
+        return self._indices.has_full(full_sentence)
@@ -0,0 +1,117 @@
+# src/utils/step_scheduler.py
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+
+# 步驟讀寫的資源標籤（steps 的 "reads" / "writes"）
+NAMES = "vault:names"              # 檔名 / 路徑（走訪 Vault 即算讀取）
+FRONTMATTER = "vault:frontmatter"  # 卡片 YAML frontmatter
+BODY = "vault:body"                # 卡片內文
+ATTACHMENTS = "vault:attachments"
+RENAME_MAP = "map:rename"
+INDENT_UNIT_MAP = "map:indent_unit"
+TRUNCATION_MAP = "map:truncation"
+TRUNCATION_DELTA = "map:truncation_delta"
+BACKLINK_INDEX = "index:backlink"
+INGEST_MANIFEST = "manifest:ingest"
+
+# 卡片內容以整檔原子替換寫回：改 frontmatter 與改內文的步驟同時跑會互相蓋掉，視為同一個寫入資源
+CARD_CONTENT = frozenset({FRONTMATTER, BODY})
+
+
+def _conflicts(earlier: dict, later: dict) -> bool:
+    """earlier 必須先於 later 執行：讀後寫、寫後讀、寫後寫任一成立，或兩者都改寫卡片內容。"""
+    r1, w1 = set(earlier.get("reads", ())), set(earlier.get("writes", ()))
+    r2, w2 = set(later.get("reads", ())), set(later.get("writes", ()))
+    if (w1 & r2) or (r1 & w2) or (w1 & w2):
+        return True
+    return bool(w1 & CARD_CONTENT) and bool(w2 & CARD_CONTENT)
+
+
+def build_dependencies(steps: List[dict]) -> List[Set[int]]:
+    """steps 的順序即語意上的執行順序；回傳每一步必須等待的前面步驟（index）。"""
+    return [{i for i in range(j) if _conflicts(steps[i], steps[j])} for j in range(len(steps))]
+
+
+def _ancestors(deps: List[Set[int]]) -> List[Set[int]]:
+    result: List[Set[int]] = []
+    for j, direct in enumerate(deps):
+        closure = set(direct)
+        for i in direct:
+            closure |= result[i]
+        result.append(closure)
+    return result
+
+
+def apply_fusions(steps: List[dict], fusions: Iterable[dict]) -> List[dict]:
+    """把可融合的連續步驟換成單一步驟（fusion["replaces"] 為被取代步驟的 "id"）。
+
+    條件：被取代的步驟全部都在 steps 中，且沒有外部步驟夾在它們的相依鏈中間
+    （某成員 → 外部步驟 → 另一成員），否則融合後無法維持原本順序的結果，維持不融合。
+    融合步驟的 reads / writes 為各成員的聯集；原本位於成員之間的外部步驟，
+    依賴成員者移到融合步驟之後，其餘留在之前（兩類之間不可能有衝突，否則即為「夾在中間」）。
+    """
+    for fusion in fusions:
+        ids = [s.get("id") for s in steps]
+        members = [ids.index(i) for i in fusion["replaces"] if i in ids]
+        if len(members) != len(fusion["replaces"]):
+            continue
+        ancestors = _ancestors(build_dependencies(steps))
+        member_set = set(members)
+        after_members = {k for k in range(len(steps)) if k not in member_set and ancestors[k] & member_set}
+        if any(k in ancestors[m] for k in after_members for m in members):
+            continue
+        fused = dict(fusion)
+        fused["reads"] = set().union(*(steps[m].get("reads", ()) for m in members))
+        fused["writes"] = set().union(*(steps[m].get("writes", ()) for m in members))
+        last = max(members)
+        before = [s for k, s in enumerate(steps) if k <= last and k not in member_set and k not in after_members]
+        after = [s for k, s in enumerate(steps) if k not in member_set and (k > last or k in after_members)]
+        steps = before + [fused] + after
+    return steps
+
+
+def plan_waves(steps: List[dict]) -> List[List[int]]:
+    """依相依關係分層：同一層的步驟彼此無衝突，可同時執行；層與層之間依序。"""
+    deps = build_dependencies(steps)
+    level: List[int] = []
+    for j, direct in enumerate(deps):
+        level.append(1 + max((level[i] for i in direct), default=-1))
+    waves: List[List[int]] = [[] for _ in range(max(level, default=-1) + 1)]
+    for j, lv in enumerate(level):
+        waves[lv].append(j)
+    return waves
+
+
+def run_steps(
+    steps: List[dict],
+    runner: Callable[..., object],
+    max_workers: Optional[int] = None,
+    before_wave: Optional[Callable[[List[dict]], bool]] = None,
+) -> Dict[str, object]:
+    """分層 → 逐層執行；同層多個步驟以執行緒並行（步驟多為 I/O，且同層保證不寫同一份資源）。
+    融合（apply_fusions）由呼叫端在排程前完成。
+
+    runner(func, *args, name=..., **kwargs) 即 main.py 的 run_pipeline_step。
+    before_wave(該層步驟) 回傳 False 即停止（逐步確認模式）。
+    Returns: {步驟名稱: 回傳值}
+    """
+    results: Dict[str, object] = {}
+
+    def call(step: dict):
+        return runner(step["func"], *step.get("args", ()), name=step["name"], **step.get("kwargs", {}))
+
+    for wave in plan_waves(steps):
+        batch = [steps[j] for j in wave]
+        if before_wave is not None and not before_wave(batch):
+            break
+        if len(batch) == 1 or max_workers == 1:
+            for step in batch:
+                results[step["name"]] = call(step)
+            continue
+        with ThreadPoolExecutor(max_workers=max_workers or len(batch)) as pool:
+            futures = [(step["name"], pool.submit(call, step)) for step in batch]
+            for name, future in futures:
+                results[name] = future.result()
+    return results
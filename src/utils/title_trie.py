@@ -0,0 +1,160 @@
+# src/utils/title_trie.py
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+
+# 連結文字尾端的重複序號，例如 "... (2)"
+DUP_SUFFIX = re.compile(r"\s*\((\d+)\)$")
+
+
+class _AmbiguousType:
+    __slots__ = ()
+
+    def __repr__(self) -> str:
+        return "AMBIGUOUS"
+
+
+AMBIGUOUS = _AmbiguousType()
+
+
+class _Node:
+    __slots__ = ("edges", "value", "only")
+
+    def __init__(self):
+        self.edges: Dict[str, Tuple[str, "_Node"]] = {}  # 邊首字元 → (邊標籤, 子節點)
+        self.value: Optional[str] = None                  # 恰好在此結束的字串對應值
+        self.only = None                                   # 子樹內唯一的值；多於一個則為 AMBIGUOUS
+
+
+class TitleTrie:
+    """壓縮前綴樹（radix trie）：字串 → 值（truncation_map key）。
+
+    - 每個節點記錄「子樹內唯一的值」，前綴查詢只需沿著連結文字走一次，O(連結長度)
+    - 邊標籤為整段字串（非逐字元節點），10 萬筆標題約 2×N 個節點
+    """
+
+    def __init__(self, min_bytes: int = 0):
+        self.min_bytes = min_bytes
+        self._root = _Node()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @staticmethod
+    def _mark(node: _Node, value: str) -> None:
+        if node.only is None:
+            node.only = value
+        elif node.only is not AMBIGUOUS and node.only != value:
+            node.only = AMBIGUOUS
+
+    def insert(self, text: str, value: str) -> None:
+        node = self._root
+        self._mark(node, value)
+        i = 0
+        while i < len(text):
+            edge = node.edges.get(text[i])
+            if edge is None:
+                leaf = _Node()
+                self._mark(leaf, value)
+                leaf.value = value
+                node.edges[text[i]] = (text[i:], leaf)
+                self._size += 1
+                return
+            label, child = edge
+            if text.startswith(label, i):
+                common = len(label)  # 最常見：整條邊都吻合，不必逐字元比
+            else:
+                # 二分搜尋共同前綴長度（startswith 在 C 層比對，長標題比逐字元迴圈快）
+                lo, hi = 1, min(len(label), len(text) - i)
+                while lo < hi:
+                    mid = (lo + hi + 1) // 2
+                    if text.startswith(label[:mid], i):
+                        lo = mid
+                    else:
+                        hi = mid - 1
+                common = lo
+            if common < len(label):
+                # 拆邊：label[:common] → mid → label[common:] → child
+                mid = _Node()
+                mid.only = child.only
+                mid.edges[label[common]] = (label[common:], child)
+                node.edges[text[i]] = (label[:common], mid)
+                child = mid
+            self._mark(child, value)
+            node = child
+            i += common
+        if node.value is None:
+            self._size += 1
+            node.value = value
+
+    def _find(self, prefix: str) -> Optional[_Node]:
+        """回傳 prefix 所落入的子樹根；prefix 停在邊中間時回傳該邊的子節點。"""
+        node = self._root
+        i = 0
+        while i < len(prefix):
+            edge = node.edges.get(prefix[i])
+            if edge is None:
+                return None
+            label, child = edge
+            rest = prefix[i:]
+            if rest.startswith(label):
+                node = child
+                i += len(label)
+            elif label.startswith(rest):
+                return child
+            else:
+                return None
+        return node
+
+    def match_prefix(self, prefix: str):
+        """以 prefix 開頭的字串 → 唯一值；多個值回傳 AMBIGUOUS；沒有則回傳 None。"""
+        node = self._find(prefix)
+        return node.only if node is not None else None
+
+    def values_with_prefix(self, prefix: str, limit: int = 10, suffix: Optional[str] = None) -> List[str]:
+        """列出以 prefix 開頭的字串所對應的值（去重，最多 limit 個），供歧義報告使用。
+        有 suffix 時只收以 suffix 結尾的值；limit 只計符合者，不符合的值不占名額。
+        """
+        node = self._find(prefix)
+        if node is None:
+            return []
+        found: List[str] = []
+        stack = [node]
+        while stack and len(found) < limit:
+            n = stack.pop()
+            if n.value is not None and n.value not in found and (suffix is None or n.value.endswith(suffix)):
+                found.append(n.value)
+            stack.extend(child for _, child in n.edges.values())
+        return found
+
+    def resolve(self, link_text: str) -> Tuple[Optional[str], List[str]]:
+        """把（可能以不同位元組數截斷的）連結文字解析成唯一值。
+
+        - 少於 min_bytes 的連結文字不比對（太短的前綴幾乎必然誤判）
+        - 連結以 " (n)" 結尾且本身不是任何字串的前綴時，改以去尾後的前綴比對，
+          並只保留同樣以 "(n)" 結尾的候選
+        Returns:
+            (唯一命中的值, 歧義時的候選值)；未命中為 (None, [])
+        """
+        text = link_text.strip()
+        if len(text.encode("utf-8")) < self.min_bytes:
+            return None, []
+        hit = self.match_prefix(text)
+        if hit is None:
+            m = DUP_SUFFIX.search(text)
+            if not m:
+                return None, []
+            base = text[:m.start()]
+            if len(base.encode("utf-8")) < self.min_bytes:
+                return None, []
+            suffix = f"({m.group(1)})"
+            # 邊走訪邊過濾：同前綴的兄弟再多，第二個 "(n)" 候選也不會被名額截掉而誤判為唯一
+            candidates = self.values_with_prefix(base, suffix=suffix)
+            if len(candidates) == 1:
+                return candidates[0], []
+            return None, candidates
+        if hit is AMBIGUOUS:
+            return None, self.values_with_prefix(text)
+        return hit, []
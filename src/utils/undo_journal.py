@@ -0,0 +1,404 @@
+# src/utils/undo_journal.py
+
+import difflib
+import gzip
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from utils.get_safe_path import get_safe_path
+
+
+class UndoJournal:
+    """單次執行的還原日誌：只記錄「被改動的部分」的反向操作，取代每次執行前整包複製 Vault。
+
+    每次執行一個資料夾 <undo_dir>/<run_id>/，內含 journal.jsonl（JSON Lines，每行一筆）：
+        {"op": "begin", "vault", "started"}
+        {"seq": n, "op": "patch",  "path", "hunks", "new_sha1", "old_sha1"}  # 反向差異：新內容 → 舊內容
+        {"seq": n, "op": "blob",   "path", "blob", "old_sha1", "new_sha1"?}  # 大檔 / 附件 / 非 UTF-8：舊檔 gzip 另存
+        {"seq": n, "op": "create", "path", "new_sha1"?}                      # 原本不存在 → 還原時刪除
+        {"seq": n, "op": "delete", "path", "content" | "blob"}              # 被刪除的檔案內容
+        {"seq": n, "op": "rename", "src", "dst"}                             # 還原時 dst → src
+        {"seq": n, "op": "mkdir",  "path"}                                   # 還原時若已清空則移除
+        {"seq": n, "op": "state",  "path", ...}                              # Vault 外的狀態檔（map / 索引），同 patch / blob / create
+        {"op": "end"}
+        {"op": "reverted", "seq": n}                                         # rollback 進度（中斷後可續做）
+
+    紀錄先於操作寫入，執行中斷時最後幾筆可能尚未套用；還原時檔案若已是舊內容（old_sha1）就直接略過。
+
+    - path 一律相對於 Vault 根目錄（state 為絕對路徑）；hunks 為 [i1, i2, 舊文字]，i1:i2 為新內容的行區間
+    - 每筆紀錄在對應檔案操作「之前」寫入；fsync 跟隨 VaultFS 的模式（each 逐筆、batch 於 sync() 時）
+    - 儲存量與時間只和本次改動的檔案數、改動幅度有關，與 Vault 大小無關
+    """
+
+    FILENAME = "journal.jsonl"
+
+    def __init__(self, run_dir: str, vault_path: str, fsync: bool = False):
+        self.run_dir = get_safe_path(run_dir)
+        self.vault_path = os.path.abspath(vault_path)
+        self.fsync = fsync
+        self._fh = None
+        self._seq = 0
+        self._blobs = 0
+        self._states: Dict[str, Optional[bytes]] = {}
+
+    @classmethod
+    def start(
+        cls,
+        undo_dir: str,
+        vault_path: str,
+        state_paths: Iterable[Optional[str]] = (),
+        keep_runs: Optional[int] = 10,
+        fsync: bool = False,
+    ) -> "UndoJournal":
+        """開新一次執行的日誌；state_paths 為會被本次執行改寫的狀態檔（先存起始內容，結束時改成反向差異）。
+        keep_runs：只保留最近幾次執行的日誌（None = 全部保留）。
+        """
+        run_id = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        journal = cls(os.path.join(undo_dir, run_id), vault_path, fsync=fsync)
+        journal._append({"op": "begin", "vault": journal.vault_path, "started": datetime.now().isoformat()})
+        for path in state_paths:
+            if path:
+                journal.track_state(path)
+        if keep_runs is not None:
+            for old in list_runs(undo_dir)[:-keep_runs]:
+                shutil.rmtree(get_safe_path(os.path.join(undo_dir, old)), ignore_errors=True)
+        return journal
+
+    # ===== 寫入 =====
+    def _append(self, record: dict) -> None:
+        if self._fh is None:
+            os.makedirs(self.run_dir, exist_ok=True)
+            self._fh = open(os.path.join(self.run_dir, self.FILENAME), "a", encoding="utf-8")
+        self._fh.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._fh.flush()
+        if self.fsync:
+            os.fsync(self._fh.fileno())
+
+    def _intend(self, op: str, **fields) -> None:
+        self._seq += 1
+        self._append({"seq": self._seq, "op": op, **fields})
+
+    def _save_blob(self, data: bytes = b"", src_path: Optional[str] = None) -> dict:
+        """gzip 另存舊內容，回傳 {"blob", "old_sha1"}；給 src_path 時逐塊串流複製，不整檔載入。"""
+        self._blobs += 1
+        name = f"blob-{self._blobs:06d}.gz"
+        h = hashlib.sha1()
+        with gzip.open(os.path.join(self.run_dir, name), "wb") as out:
+            if src_path is None:
+                h.update(data)
+                out.write(data)
+            else:
+                with open(get_safe_path(src_path), "rb") as src:
+                    for chunk in iter(lambda: src.read(1 << 20), b""):
+                        h.update(chunk)
+                        out.write(chunk)
+        return {"blob": name, "old_sha1": h.hexdigest()}
+
+    def _rel(self, path: str) -> str:
+        return os.path.relpath(os.path.abspath(path), self.vault_path)
+
+    def record_write(
+        self, path: str, new: Optional[bytes] = None, large: bool = False, new_sha1: Optional[str] = None
+    ) -> None:
+        """即將覆寫 / 新建 path。new 為即將寫入的位元組：可解碼的小檔存反向差異；
+        大檔（串流改寫）或新內容未知（附件）則把舊檔 gzip 另存。new_sha1 供還原時確認檔案未再被改過。
+        """
+        if new is not None:
+            new_sha1 = _sha1(new)
+        fields = {"new_sha1": new_sha1} if new_sha1 is not None else {}
+        safe_path = get_safe_path(path)
+        if not os.path.exists(safe_path):
+            self._intend("create", path=self._rel(path), **fields)
+            return
+        hunks = None
+        if new is not None and not large:
+            with open(safe_path, "rb") as f:
+                old = f.read()
+            hunks = reverse_hunks(old, new)
+        if hunks is not None:
+            fields.update(op="patch", hunks=hunks, old_sha1=_sha1(old))
+        else:
+            fields.update(op="blob", **self._save_blob(src_path=path))
+        self._intend(fields.pop("op"), path=self._rel(path), **fields)
+
+    def record_delete(self, path: str) -> None:
+        with open(get_safe_path(path), "rb") as f:
+            data = f.read()
+        try:
+            self._intend("delete", path=self._rel(path), content=data.decode("utf-8"))
+        except UnicodeDecodeError:
+            self._intend("delete", path=self._rel(path), blob=self._save_blob(data)["blob"])
+
+    def record_rename(self, src: str, dst: str) -> None:
+        self._intend("rename", src=self._rel(src), dst=self._rel(dst))
+
+    def record_mkdir(self, dir_path: str) -> None:
+        self._intend("mkdir", path=self._rel(dir_path))
+
+    def track_state(self, path: str) -> None:
+        """Vault 外的狀態檔：先把起始內容存成 blob（中斷時仍可還原），finish() 時換成反向差異。"""
+        path = os.path.abspath(path)
+        safe_path = get_safe_path(path)
+        if os.path.exists(safe_path):
+            with open(safe_path, "rb") as f:
+                old = f.read()
+            self._states[path] = old
+            self._intend("state", path=path, kind="blob", **self._save_blob(old))
+        else:
+            self._states[path] = None
+            self._intend("state", path=path, kind="create")
+
+    def sync(self) -> None:
+        if self._fh is not None:
+            os.fsync(self._fh.fileno())
+
+    def finish(self) -> str:
+        """本次執行結束：狀態檔改記反向差異（起始 blob 可刪）、寫入 end。回傳 run 資料夾。"""
+        for path, old in self._states.items():
+            safe_path = get_safe_path(path)
+            if old is None or not os.path.exists(safe_path):
+                continue
+            with open(safe_path, "rb") as f:
+                new = f.read()
+            hunks = reverse_hunks(old, new)
+            if hunks is not None:
+                self._intend("state", path=path, kind="patch", hunks=hunks, new_sha1=_sha1(new), old_sha1=_sha1(old))
+        self._append({"op": "end"})
+        self.sync()
+        self._prune_superseded_blobs()
+        self.close()
+        return self.run_dir
+
+    def _prune_superseded_blobs(self) -> None:
+        records = read_records(self.run_dir)
+        patched = {r["path"] for r in records if r.get("op") == "state" and r.get("kind") == "patch"}
+        for r in records:
+            if r.get("op") == "state" and r.get("kind") == "blob" and r["path"] in patched:
+                blob = os.path.join(self.run_dir, r["blob"])
+                if os.path.exists(blob):
+                    os.remove(blob)
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+# ===== 反向差異 =====
+def reverse_hunks(old: bytes, new: bytes) -> Optional[List[list]]:
+    """new → old 的行差異 [[i1, i2, 舊文字], ...]（i1:i2 為 new 的行區間）；任一方非 UTF-8 回傳 None。"""
+    try:
+        old_lines = old.decode("utf-8").splitlines(keepends=True)
+        new_lines = new.decode("utf-8").splitlines(keepends=True)
+    except UnicodeDecodeError:
+        return None
+    matcher = difflib.SequenceMatcher(None, new_lines, old_lines, autojunk=False)
+    return [
+        [i1, i2, "".join(old_lines[j1:j2])]
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+
+
+def apply_reverse_hunks(current: bytes, hunks: List[list]) -> bytes:
+    lines = current.decode("utf-8").splitlines(keepends=True)
+    for i1, i2, text in reversed(hunks):
+        lines[i1:i2] = [text]
+    return "".join(lines).encode("utf-8")
+
+
+def _sha1(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def file_sha1(path: str) -> str:
+    h = hashlib.sha1()
+    with open(get_safe_path(path), "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# ===== 讀取 / 還原 =====
+def list_runs(undo_dir: str) -> List[str]:
+    """undo_dir 內的執行紀錄（由舊到新，run_id 以時間命名）。"""
+    safe_dir = get_safe_path(undo_dir)
+    if not os.path.isdir(safe_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(safe_dir)
+        if os.path.exists(os.path.join(safe_dir, name, UndoJournal.FILENAME))
+    )
+
+
+def read_records(run_dir: str) -> List[dict]:
+    """讀取完整的紀錄；最後一行若寫到一半（當機）則忽略。"""
+    records = []
+    with open(os.path.join(get_safe_path(run_dir), UndoJournal.FILENAME), "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+    return records
+
+
+class UndoConflict(Exception):
+    """檔案在該次執行之後又被改過，反向差異無法安全套用。"""
+
+
+def revert_run(run_dir: str, vault_path: Optional[str] = None, force: bool = False, log=print) -> int:
+    """依相反順序撤銷一次執行的所有操作；每撤銷一筆即記下 reverted（中斷後重跑會接續）。
+    檔案目前內容與該次執行寫入的不同時丟出 UndoConflict（force=True 則以舊內容覆蓋）。
+    全部完成後刪除 run 資料夾。回傳撤銷筆數。
+    """
+    run_dir = get_safe_path(run_dir)
+    records = read_records(run_dir)
+    begin = next((r for r in records if r.get("op") == "begin"), {})
+    vault_path = os.path.abspath(vault_path or begin.get("vault", "."))
+    reverted = {r["seq"] for r in records if r.get("op") == "reverted"}
+    ops = [r for r in records if "seq" in r and r.get("op") != "reverted"]
+
+    # 同一狀態檔只套用最後一筆（finish 時的反向差異取代起始 blob）
+    last_state = {}
+    for r in ops:
+        if r["op"] == "state":
+            last_state[r["path"]] = r["seq"]
+
+    pending = [
+        r for r in reversed(ops)
+        if r["seq"] not in reverted and not (r["op"] == "state" and last_state[r["path"]] != r["seq"])
+    ]
+    if not force:
+        _preflight(pending, vault_path)
+
+    journal_path = os.path.join(run_dir, UndoJournal.FILENAME)
+    count = 0
+    with open(journal_path, "a", encoding="utf-8") as progress:
+        for r in pending:
+            _revert_op(r, run_dir, vault_path, force)
+            progress.write(json.dumps({"op": "reverted", "seq": r["seq"]}) + "\n")
+            progress.flush()
+            count += 1
+            log(f"↩️ 已還原：{_describe(r)}")
+    shutil.rmtree(run_dir)
+    return count
+
+
+def _op_path(r: dict, vault_path: str) -> str:
+    return r["path"] if r["op"] == "state" else os.path.normpath(os.path.join(vault_path, r["path"]))
+
+
+def _preflight(pending: List[dict], vault_path: str) -> None:
+    """動手前先檢查：每個檔案「最後一次」被該次執行寫入後是否又被改過（更早的紀錄由還原順序保證），
+    有衝突就在還原任何檔案之前中止。
+    """
+    seen = set()
+    for r in pending:
+        if r["op"] == "rename":
+            seen.add(os.path.normpath(os.path.join(vault_path, r["src"])))
+            seen.add(os.path.normpath(os.path.join(vault_path, r["dst"])))
+            continue
+        if r["op"] in ("mkdir", "delete"):
+            continue
+        path = _op_path(r, vault_path)
+        if path in seen:
+            continue
+        seen.add(path)
+        expected = r.get("new_sha1")
+        if expected is None or not os.path.exists(get_safe_path(path)):
+            continue
+        current = file_sha1(path)
+        if current not in (expected, r.get("old_sha1")):
+            raise UndoConflict(f"{path} 在該次執行後已被修改（force=True 可直接以舊內容覆蓋）")
+
+
+def _describe(r: dict) -> str:
+    if r["op"] == "rename":
+        return f"{r['dst']} → {r['src']}"
+    return f"[{r['op']}] {r['path']}"
+
+
+def _write_bytes(path: str, data: bytes) -> None:
+    safe_path = get_safe_path(path)
+    os.makedirs(os.path.dirname(safe_path), exist_ok=True)
+    tmp = f"{safe_path}.undo.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, safe_path)
+
+
+def _restore_blob(run_dir: str, name: str, path: str) -> None:
+    """gzip 舊內容逐塊解壓到暫存檔後替換（大檔不整檔載入）。"""
+    safe_path = get_safe_path(path)
+    os.makedirs(os.path.dirname(safe_path), exist_ok=True)
+    tmp = f"{safe_path}.undo.tmp"
+    with gzip.open(os.path.join(run_dir, name), "rb") as src, open(tmp, "wb") as out:
+        shutil.copyfileobj(src, out)
+    os.replace(tmp, safe_path)
+
+
+def _revert_content(path: str, r: dict, run_dir: str, force: bool, kind: str) -> None:
+    """patch / blob：檔案目前內容應為該次寫入的內容（new_sha1），還原成舊內容（old_sha1）。"""
+    safe_path = get_safe_path(path)
+    current_sha1 = file_sha1(path) if os.path.exists(safe_path) else None
+    if current_sha1 is not None and current_sha1 == r.get("old_sha1"):
+        return  # 中斷前尚未套用，或已還原
+    expected = r.get("new_sha1")
+    if expected is not None and current_sha1 != expected:
+        if kind == "patch":
+            raise UndoConflict(f"{path} 在該次執行後已被修改，無法套用反向差異")
+        if not force:
+            raise UndoConflict(f"{path} 在該次執行後已被修改（force=True 可直接以舊內容覆蓋）")
+    if kind == "patch":
+        with open(safe_path, "rb") as f:
+            old = apply_reverse_hunks(f.read(), r["hunks"])
+        if _sha1(old) != r["old_sha1"]:
+            raise UndoConflict(f"{path} 反向差異套用結果與原內容不符")
+        _write_bytes(path, old)
+    else:
+        _restore_blob(run_dir, r["blob"], path)
+
+
+def _revert_op(r: dict, run_dir: str, vault_path: str, force: bool) -> None:
+    op = r["op"]
+    if op == "state":
+        path = r["path"]
+        if r["kind"] == "create":
+            if os.path.exists(get_safe_path(path)):
+                os.remove(get_safe_path(path))
+        else:
+            _revert_content(path, r, run_dir, force, r["kind"])
+        return
+
+    if op == "rename":
+        src = os.path.normpath(os.path.join(vault_path, r["src"]))
+        dst = os.path.normpath(os.path.join(vault_path, r["dst"]))
+        if os.path.exists(get_safe_path(dst)):
+            if os.path.exists(get_safe_path(src)):
+                raise UndoConflict(f"無法還原改名：{r['src']} 已存在")
+            os.rename(get_safe_path(dst), get_safe_path(src))
+        return
+
+    path = _op_path(r, vault_path)
+    safe_path = get_safe_path(path)
+    if op == "create":
+        if os.path.exists(safe_path):
+            if not force and "new_sha1" in r and file_sha1(path) != r["new_sha1"]:
+                raise UndoConflict(f"{path} 在該次執行後已被修改（force=True 可直接刪除）")
+            os.remove(safe_path)
+    elif op == "delete":
+        if not os.path.exists(safe_path):
+            if "content" in r:
+                _write_bytes(path, r["content"].encode("utf-8"))
+            else:
+                _restore_blob(run_dir, r["blob"], path)
+    elif op == "mkdir":
+        if os.path.isdir(safe_path) and not os.listdir(safe_path):
+            os.rmdir(safe_path)
+    elif op in ("patch", "blob"):
+        _revert_content(path, r, run_dir, force, op)
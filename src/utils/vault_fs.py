@@ -0,0 +1,467 @@
+# src/utils/vault_fs.py
+
+import os
+import shutil
+import tempfile
+import threading
+from typing import IO, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from utils.byte_prefilter import BytesPredicate, file_may_match
+from utils.get_safe_path import get_safe_path
+from utils.md_lexer import LexedDoc
+from utils.undo_journal import UndoJournal, file_sha1
+
+
+FSYNC_MODES = ("each", "batch", None)
+STREAM_THRESHOLD_BYTES = 8 * 2**20  # 超過此大小的卡片改走逐行串流（不整檔載入、不進內容快取）
+
+
+class VaultFS:
+    """Vault 檔案系統存取層。
+
+    - 目錄列舉快取：每個資料夾只 scandir 一次，之後 exists / listdir 皆查記憶體；
+      透過本物件做的 write / rename / remove 會同步更新快取
+    - 原子寫入：先寫同資料夾暫存檔再 os.replace，中斷時不會留下寫到一半的卡片
+    - fsync 模式：
+        "each"  → 每次寫入在 replace 前 fsync 檔案、replace 後 fsync 資料夾
+        "batch" → 記下寫過的檔案與資料夾，sync()（或離開 with）時一次 fsync
+        None    → 不 fsync（仍為原子替換）
+    - 內容快取（cache_docs）：lex() 回傳的 LexedDoc（內容 + 切行 + 行種類）以 (mtime_ns, size) 驗證後重用，
+      後面的步驟不必重讀、重新解析；本物件寫入時直接換成新內容
+    - 大檔串流（stream_threshold）：should_stream() 為真的檔案由各步驟改用 iter_lines() / stream_rewrite()，
+      記憶體上限取決於 transform 一次持有的行數，而不是檔案大小
+    - 還原日誌（undo）：每次寫入 / 改名 / 刪除 / 建資料夾前先記下反向操作（UndoJournal），
+      不必在執行前整包複製 Vault；rollback_pipeline_run 依日誌還原
+    - 狀態檔 / log（read_state / write_state / append_state）：map、索引、log 也經由本物件讀寫，
+      不進列舉快取、不記還原日誌；MemoryVaultFS 時一併留在記憶體
+    - 執行緒：排程器同層步驟以執行緒並行並共用同一個物件；列舉快取、內容快取、待 fsync 清單與還原日誌
+      的存取都在 self._lock 內進行，listdir() 回傳快照
+    列舉快取只反映本物件看過的狀態；外部改動後請呼叫 invalidate()。
+    """
+
+    durable = True  # 資料實際落在磁碟：WAL、還原日誌、fsync 才有意義
+
+    def __init__(
+        self,
+        root: str,
+        fsync: Optional[str] = "batch",
+        cache_docs: bool = True,
+        stream_threshold: Optional[int] = STREAM_THRESHOLD_BYTES,
+        undo: Optional[UndoJournal] = None,
+    ):
+        if fsync not in FSYNC_MODES:
+            raise ValueError(f"fsync must be one of {FSYNC_MODES}, got {fsync!r}")
+        self.root = os.path.abspath(root)
+        self.fsync = fsync
+        self._listings: Dict[str, Dict[str, bool]] = {}  # 資料夾 → {名稱: 是否為資料夾}（保留列舉順序）
+        self._dirty_files: Set[str] = set()
+        self._dirty_dirs: Set[str] = set()
+        self.cache_docs = cache_docs
+        self.stream_threshold = stream_threshold
+        self._docs: Dict[str, Tuple[Tuple[int, int], LexedDoc]] = {}  # 路徑 → (簽章, LexedDoc)
+        self.undo = undo
+        self._lock = threading.RLock()
+
+    def __enter__(self) -> "VaultFS":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.sync()
+
+    # ===== 列舉 / 查詢 =====
+    def listdir(self, dir_path: str) -> Dict[str, bool]:
+        """資料夾內容 {名稱: 是否為資料夾}；首次查詢才真正 scandir。回傳快照（其他執行緒同時改名不影響迭代）。"""
+        with self._lock:
+            return dict(self._listing(dir_path))
+
+    def _listing(self, dir_path: str) -> Dict[str, bool]:
+        """快取本體（呼叫端須持有 self._lock）。"""
+        dir_path = os.path.abspath(dir_path)
+        listing = self._listings.get(dir_path)
+        if listing is None:
+            try:
+                with os.scandir(get_safe_path(dir_path)) as it:
+                    listing = {e.name: e.is_dir(follow_symlinks=False) for e in it}
+            except FileNotFoundError:
+                listing = {}
+            self._listings[dir_path] = listing
+        return listing
+
+    def exists(self, path: str) -> bool:
+        path = os.path.abspath(path)
+        parent, name = os.path.split(path)
+        with self._lock:
+            return name in self._listing(parent)
+
+    def is_dir(self, path: str) -> bool:
+        path = os.path.abspath(path)
+        parent, name = os.path.split(path)
+        with self._lock:
+            return self._listing(parent).get(name, False)
+
+    def walk(self, top: Optional[str] = None) -> Iterator[Tuple[str, List[str], List[str]]]:
+        """與 os.walk 相同的 (root, dirs, files) 由上而下走訪，但列舉來自快取。
+        與 os.walk 一樣，yield 的 files 是當下的快照，走訪途中改名不影響本層。
+        """
+        stack = [os.path.abspath(top or self.root)]
+        while stack:
+            root = stack.pop()
+            with self._lock:
+                entries = list(self._listing(root).items())
+            dirs = [n for n, d in entries if d]
+            files = [n for n, d in entries if not d]
+            yield root, dirs, files
+            stack.extend(os.path.join(root, d) for d in reversed(dirs))
+
+    def iter_md_files(self, top: Optional[str] = None) -> Iterator[str]:
+        for root, _, files in self.walk(top):
+            for file in files:
+                if file.endswith(".md"):
+                    yield os.path.join(root, file)
+
+    def exists_uncached(self, path: str) -> bool:
+        """不經列舉快取直接查（如不分大小寫的檔案系統上，快取中沒有的名稱實際可能已存在）。"""
+        return os.path.exists(get_safe_path(path))
+
+    def size(self, path: str) -> int:
+        return os.stat(get_safe_path(path)).st_size
+
+    def signature(self, path: str) -> Tuple[int, int]:
+        """(mtime_ns, size)：判斷檔案自上次讀取後是否變動。"""
+        return _signature(path)
+
+    # ===== 讀寫 =====
+    def read_bytes(self, path: str) -> bytes:
+        with open(get_safe_path(path), "rb") as f:
+            return f.read()
+
+    def read_text(self, path: str, errors: Optional[str] = None) -> str:
+        with open(get_safe_path(path), "r", encoding="utf-8", errors=errors) as f:
+            return f.read()
+
+    def lex(self, path: str) -> LexedDoc:
+        """讀檔並回傳 LexedDoc；檔案自上次讀寫後未變動（mtime_ns、size 相同）則直接重用。"""
+        path = os.path.abspath(path)
+        sig = self.signature(path)
+        with self._lock:
+            cached = self._docs.get(path)
+        if cached is not None and cached[0] == sig:
+            return cached[1]
+        doc = LexedDoc(self.read_text(path))
+        if self.cache_docs and not self._is_large(sig[1]):
+            with self._lock:
+                self._docs[path] = (sig, doc)
+        return doc
+
+    def should_stream(self, path: str) -> bool:
+        return self._is_large(self.size(path))
+
+    def iter_lines(self, path: str) -> Iterator[str]:
+        """逐行讀取（與 readlines 相同的切行與換行轉換），不整檔載入。"""
+        with open(get_safe_path(path), "r", encoding="utf-8") as f:
+            yield from f
+
+    def stream_rewrite(self, path: str, transform: Callable[[Iterator[str]], Iterable[str]]) -> bool:
+        """串流改寫：原檔逐行 → transform → 同資料夾暫存檔；邊寫邊與原內容比對，
+        有差異才 os.replace（原子替換），否則丟棄暫存檔、原檔不動。回傳是否改寫。
+        """
+        path = os.path.abspath(path)
+        parent, name = os.path.split(path)
+        safe_path = get_safe_path(path)
+        fd, tmp = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=get_safe_path(parent))
+        changed = False
+        try:
+            with open(safe_path, "r", encoding="utf-8") as src, \
+                    open(safe_path, "r", encoding="utf-8") as orig, \
+                    os.fdopen(fd, "w", encoding="utf-8") as out:
+                for chunk in transform(src):
+                    out.write(chunk)
+                    if not changed and orig.read(len(chunk)) != chunk:
+                        changed = True
+                if not changed and orig.read(1):
+                    changed = True
+                if changed and self.fsync == "each":
+                    out.flush()
+                    os.fsync(out.fileno())
+            if not changed:
+                os.remove(tmp)
+                return False
+            if self.undo is not None:
+                new_sha1 = file_sha1(tmp)
+                with self._lock:
+                    self.undo.record_write(path, large=True, new_sha1=new_sha1)
+            _replace_keep_mode(tmp, safe_path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        with self._lock:
+            self._after_write(parent, name, path)
+            self._docs.pop(path, None)
+        return True
+
+    def may_match(self, path: str, predicate: BytesPredicate) -> bool:
+        """bytes 前置過濾：內容已在快取（已解碼）就直接放行，否則以 mmap 檢查、不解碼。"""
+        path = os.path.abspath(path)
+        with self._lock:
+            cached = self._docs.get(path)
+        if cached is not None and cached[0] == self.signature(path):
+            return True
+        return file_may_match(path, predicate)
+
+    def write_text(self, path: str, content: str) -> None:
+        """原子寫入：同資料夾暫存檔 → (fsync) → os.replace。保留原檔權限。"""
+        path = os.path.abspath(path)
+        if self.undo is not None:
+            data = _encode_text(content)
+            with self._lock:
+                self.undo.record_write(path, data, large=self._is_large(len(content)))
+        self._atomic_write(path, lambda f: f.write(content), binary=False)
+        # 讀回時 \r\n 會被轉成 \n，這種內容不放進快取，下次 lex() 重讀
+        if self.cache_docs and "\r" not in content and not self._is_large(len(content)):
+            entry = (self.signature(path), LexedDoc(content))
+            with self._lock:
+                self._docs[path] = entry
+        else:
+            with self._lock:
+                self._docs.pop(path, None)
+
+    def write_stream(self, path: str, src: IO[bytes]) -> None:
+        """二進位串流原子寫入（附件等）：copyfileobj 到暫存檔後替換，不解碼、不整檔載入。"""
+        path = os.path.abspath(path)
+        if self.undo is not None:
+            with self._lock:
+                self.undo.record_write(path)
+        self._atomic_write(path, lambda f: shutil.copyfileobj(src, f), binary=True)
+        with self._lock:
+            self._docs.pop(path, None)
+
+    def link(self, src: str, dst: str) -> None:
+        """把 Vault 外的檔案以硬連結放進 dst（跨裝置等無法連結時改為複製）。"""
+        dst = os.path.abspath(dst)
+        parent, name = os.path.split(dst)
+        if self.undo is not None:
+            with self._lock:
+                self.undo.record_write(dst)
+        try:
+            os.link(get_safe_path(src), get_safe_path(dst))
+        except OSError:
+            shutil.copy2(get_safe_path(src), get_safe_path(dst))
+        with self._lock:
+            self._after_write(parent, name, dst)
+
+    def copy(self, src: str, dst: str) -> None:
+        """把 Vault 外的檔案複製進 dst（保留 mtime，之後可能被改寫的檔案不用硬連結，以免改到來源）。"""
+        dst = os.path.abspath(dst)
+        parent, name = os.path.split(dst)
+        if self.undo is not None:
+            with self._lock:
+                self.undo.record_write(dst)
+        shutil.copy2(get_safe_path(src), get_safe_path(dst))
+        with self._lock:
+            self._after_write(parent, name, dst)
+            self._docs.pop(dst, None)
+
+    def makedirs(self, dir_path: str) -> None:
+        """建立資料夾（含上層），同步更新列舉快取。"""
+        dir_path = os.path.abspath(dir_path)
+        parent, name = os.path.split(dir_path)
+        with self._lock:
+            if not name or self.is_dir(dir_path):
+                return
+            self.makedirs(parent)
+            if self.undo is not None and not os.path.isdir(get_safe_path(dir_path)):
+                self.undo.record_mkdir(dir_path)
+            os.makedirs(get_safe_path(dir_path), exist_ok=True)
+            self._listing(parent)[name] = True
+            self._mark_dir(parent)
+
+    def rename(self, src: str, dst: str) -> None:
+        src, dst = os.path.abspath(src), os.path.abspath(dst)
+        src_parent, src_name = os.path.split(src)
+        dst_parent, dst_name = os.path.split(dst)
+        with self._lock:
+            if self.undo is not None:
+                self.undo.record_rename(src, dst)
+            os.rename(get_safe_path(src), get_safe_path(dst))
+            is_dir = self._listing(src_parent).pop(src_name, False)
+            self._listing(dst_parent)[dst_name] = is_dir
+            self._mark_dir(src_parent)
+            self._mark_dir(dst_parent)
+            if src in self._dirty_files:
+                self._dirty_files.discard(src)
+                self._dirty_files.add(dst)
+            if src in self._docs:
+                self._docs[dst] = self._docs.pop(src)
+
+    def remove(self, path: str) -> None:
+        path = os.path.abspath(path)
+        parent, name = os.path.split(path)
+        with self._lock:
+            if self.undo is not None:
+                self.undo.record_delete(path)
+            os.remove(get_safe_path(path))
+            self._listing(parent).pop(name, None)
+            self._dirty_files.discard(path)
+            self._docs.pop(path, None)
+            self._mark_dir(parent)
+
+    # ===== 狀態檔 / log =====
+    def isfile(self, path: str) -> bool:
+        return os.path.isfile(get_safe_path(path))
+
+    def read_state(self, path: str, errors: Optional[str] = None) -> Optional[str]:
+        """讀取狀態檔（map、manifest、索引等）；不存在回傳 None。"""
+        try:
+            with open(get_safe_path(path), "r", encoding="utf-8", errors=errors) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write_state(self, path: str, text: str, atomic: bool = False, fsync: bool = False) -> None:
+        """寫入狀態檔（自動建立資料夾）。atomic → 先寫 path + ".tmp" 再 os.replace；fsync → replace 前落盤。"""
+        p = get_safe_path(path)
+        parent = os.path.dirname(p)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        target = p + ".tmp" if atomic else p
+        with open(target, "w", encoding="utf-8") as f:
+            f.write(text)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        if atomic:
+            os.replace(target, p)
+
+    def append_state(self, path: str, text: str) -> None:
+        """附加到 log 檔尾（逐筆寫入的 log）。"""
+        p = get_safe_path(path)
+        parent = os.path.dirname(p)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        with open(p, "a", encoding="utf-8") as f:
+            f.write(text)
+
+    def remove_state(self, path: str) -> None:
+        """刪除狀態檔（已消化的 delta 等）；不存在時略過。"""
+        try:
+            os.remove(get_safe_path(path))
+        except FileNotFoundError:
+            pass
+
+    # ===== 快取 / 落盤 =====
+    def invalidate(self, dir_path: Optional[str] = None) -> None:
+        """丟棄列舉快取（全部或單一資料夾），下次查詢重新 scandir。"""
+        with self._lock:
+            if dir_path is None:
+                self._listings.clear()
+                self._docs.clear()
+            else:
+                self._listings.pop(os.path.abspath(dir_path), None)
+
+    def sync(self) -> None:
+        """batch 模式：一次 fsync 所有寫過的檔案與其資料夾（還原日誌先落盤）。"""
+        with self._lock:
+            if self.undo is not None:
+                self.undo.sync()
+            dirty_files, dirty_dirs = list(self._dirty_files), list(self._dirty_dirs)
+            self._dirty_files.clear()
+            self._dirty_dirs.clear()
+        for path in dirty_files:
+            try:
+                fd = os.open(get_safe_path(path), os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        for dir_path in dirty_dirs:
+            _fsync_dir(dir_path)
+
+    def _after_write(self, parent: str, name: str, path: str) -> None:
+        """寫入後更新列舉快取與待 fsync 清單（呼叫端須持有 self._lock）。"""
+        self._listing(parent)[name] = False
+        if self.fsync == "batch":
+            self._dirty_files.add(path)
+        self._mark_dir(parent)
+
+    def _atomic_write(self, path: str, fill: Callable[[IO], None], binary: bool) -> None:
+        parent, name = os.path.split(path)
+        safe_path = get_safe_path(path)
+        fd, tmp = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=get_safe_path(parent))
+        try:
+            with (os.fdopen(fd, "wb") if binary else os.fdopen(fd, "w", encoding="utf-8")) as f:
+                fill(f)
+                if self.fsync == "each":
+                    f.flush()
+                    os.fsync(f.fileno())
+            _replace_keep_mode(tmp, safe_path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        with self._lock:
+            self._after_write(parent, name, path)
+
+    def _is_large(self, size: int) -> bool:
+        return self.stream_threshold is not None and size >= self.stream_threshold
+
+    def _mark_dir(self, dir_path: str) -> None:
+        if self.fsync == "each":
+            _fsync_dir(dir_path)
+        elif self.fsync == "batch":
+            self._dirty_dirs.add(dir_path)
+
+
+_LOCAL_FS = VaultFS(os.curdir, fsync=None)
+
+
+def state_fs(fs: Optional[VaultFS] = None) -> VaultFS:
+    """狀態檔 / log 的讀寫對象：呼叫端有 fs 就用它（記憶體 Vault 的狀態也留在記憶體），否則直接讀寫磁碟。"""
+    return fs if fs is not None else _LOCAL_FS
+
+
+def _fsync_dir(dir_path: str) -> None:
+    """讓改名 / 新增的目錄項目落盤；Windows 無法對資料夾 fsync，直接略過。"""
+    if os.name == "nt":
+        return
+    try:
+        fd = os.open(get_safe_path(dir_path), os.O_RDONLY)
+    except FileNotFoundError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _replace_keep_mode(tmp: str, safe_path: str) -> None:
+    """暫存檔沿用原檔權限（新檔依 umask）後原子替換。"""
+    try:
+        os.chmod(tmp, os.stat(safe_path).st_mode & 0o7777)
+    except FileNotFoundError:
+        os.chmod(tmp, 0o666 & ~_UMASK)
+    os.replace(tmp, safe_path)
+
+
+def _encode_text(content: str) -> bytes:
+    """write_text 實際寫入的位元組（文字模式會把 \n 轉成 os.linesep）。"""
+    if os.linesep != "\n":
+        content = content.replace("\n", os.linesep)
+    return content.encode("utf-8")
+
+
+def _signature(path: str) -> Tuple[int, int]:
+    st = os.stat(get_safe_path(path))
+    return st.st_mtime_ns, st.st_size
+
+
+def _read_umask() -> int:
+    """os.umask 只能「設定並取回舊值」且作用於整個程序：只在匯入時讀一次（此時尚無其他執行緒在建檔）。"""
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+_UMASK = _read_umask()
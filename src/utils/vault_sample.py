@@ -0,0 +1,39 @@
+# src/utils/vault_sample.py
+
+import math
+import os
+import random
+from typing import Dict, List, Sequence
+
+
+def sample_cards(rel_paths: Sequence[str], fraction: float, stratify: bool = True, seed: int = 0) -> List[str]:
+    """
+    從卡片清單（Vault 內相對路徑）抽出約 fraction 比例的樣本，至少一張；回傳值保持原清單順序。
+    - stratify=True：依資料夾分層，各資料夾按卡片數比例分配名額（最大餘數法，總數 = round(N × fraction)）
+    - stratify=False：整個 Vault 單純隨機抽樣
+    同一份清單、同一個 seed 抽出的樣本相同。
+    """
+    if not rel_paths:
+        return []
+    if not 0 < fraction <= 1:
+        raise ValueError(f"抽樣比例需介於 0 與 1 之間：{fraction}")
+    rng = random.Random(seed)
+    target = max(1, round(len(rel_paths) * fraction))
+
+    if not stratify:
+        picked = set(rng.sample(range(len(rel_paths)), target))
+        return [p for i, p in enumerate(rel_paths) if i in picked]
+
+    folders: Dict[str, List[int]] = {}
+    for i, p in enumerate(rel_paths):
+        folders.setdefault(os.path.dirname(p), []).append(i)
+    exact = {d: len(idx) * target / len(rel_paths) for d, idx in folders.items()}
+    quota = {d: math.floor(q) for d, q in exact.items()}
+    # 餘下名額給小數部分最大的資料夾（同分時隨機，避免固定偏向走訪順序在前的資料夾）
+    order = sorted(folders, key=lambda d: (exact[d] - quota[d], rng.random()), reverse=True)
+    for d in order[:target - sum(quota.values())]:
+        quota[d] += 1
+    picked = set()
+    for d, idx in folders.items():
+        picked.update(rng.sample(idx, quota[d]))
+    return [p for i, p in enumerate(rel_paths) if i in picked]
@@ -0,0 +1,160 @@
+# src/utils/write_ahead_journal.py
+
+import os
+import json
+import base64
+from typing import Dict, Iterable, List, Optional
+
+from utils.get_safe_path import get_safe_path
+
+
+class WriteAheadJournal:
+    """JSON Lines 格式的預寫日誌（write-ahead journal）。
+
+    紀錄格式（每行一筆）：
+        {"op": "begin"}                                    # 開始寫入意圖
+        {"seq": n, "op": "delete",   "path", "content_b64"}     # 原始位元組（base64），供 rollback 原樣還原
+        {"seq": n, "op": "headline", "path", "old_b64", "new"}  # 首句序號化前（原始位元組）／後的整檔內容
+        {"seq": n, "op": "rename",   "src", "dst"}
+        {"seq": n, "op": "map_insert", "key", "uid", "full_sentence"}
+        {"op": "planned"}                                  # 意圖已全數落盤，之後才動檔案
+        {"op": "done", "seq": n}                           # 該筆已套用
+        {"op": "commit"}                                   # 全部完成（隨即刪除日誌）
+
+    每筆紀錄寫入後立即 fsync；檔案操作一律在 "planned" 之後才開始。
+    還原用的舊內容記錄原始位元組而非解碼後的文字：非 UTF-8 位元組與 CRLF 在 rollback 後維持原樣。
+    （舊版日誌的 "content" / "old" 文字欄位仍可讀取。）
+    """
+
+    def __init__(self, path: str):
+        self.path = get_safe_path(path)
+        self._fh = None
+        self._seq = 0
+
+    # --- 寫入 ---
+    def _append(self, record: dict) -> None:
+        if self._fh is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._fh = open(self.path, "a", encoding="utf-8")
+        self._fh.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    def begin(self) -> None:
+        self._append({"op": "begin"})
+
+    def intend(self, op: str, **fields) -> int:
+        """記錄一筆尚未套用的操作，回傳序號。"""
+        self._seq += 1
+        self._append({"seq": self._seq, "op": op, **fields})
+        return self._seq
+
+    def planned(self) -> None:
+        self._append({"op": "planned"})
+
+    def done(self, seq: int) -> None:
+        self._append({"op": "done", "seq": seq})
+
+    def commit(self) -> None:
+        """標記完成並移除日誌。"""
+        self._append({"op": "commit"})
+        self.close()
+        os.remove(self.path)
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    # --- 讀取 / 復原 ---
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def read(self) -> List[dict]:
+        """讀取所有完整的紀錄；最後一行若寫到一半（當機）則忽略。"""
+        records = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+        return records
+
+    def pending(self) -> Optional[Dict[str, List[dict]]]:
+        """整理日誌狀態：
+        - None：沒有日誌，或意圖尚未寫完（"planned" 前當機 → 尚未動任何檔案，可直接丟棄）
+        - 否則回傳 {"ops": 全部意圖, "done": 已套用的意圖}
+        """
+        if not self.exists():
+            return None
+        records = self.read()
+        if not any(r.get("op") == "planned" for r in records):
+            return None
+        done_seqs = {r["seq"] for r in records if r.get("op") == "done"}
+        ops = [r for r in records if "seq" in r and r.get("op") != "done"]
+        return {"ops": ops, "done": [r for r in ops if r["seq"] in done_seqs]}
+
+    def discard(self) -> None:
+        self.close()
+        if self.exists():
+            os.remove(self.path)
+
+
+def encode_bytes(data: bytes) -> str:
+    """原始位元組 → 日誌欄位（base64 ASCII 字串）。"""
+    return base64.b64encode(data).decode("ascii")
+
+
+def _recorded_bytes(record: dict, field: str) -> bytes:
+    """讀出紀錄中的舊內容：新格式 <field>_b64，舊格式為 UTF-8 文字 <field>。"""
+    if f"{field}_b64" in record:
+        return base64.b64decode(record[f"{field}_b64"])
+    return record[field].encode("utf-8")
+
+
+def _write_bytes(path: str, data: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def apply_journal_op(record: dict) -> None:
+    """冪等地套用單筆檔案操作（replay 用；map_insert 由呼叫端處理）。"""
+    op = record["op"]
+    if op == "delete":
+        p = get_safe_path(record["path"])
+        if os.path.exists(p):
+            os.remove(p)
+    elif op == "headline":
+        p = get_safe_path(record["path"])
+        if os.path.exists(p):
+            with open(p, "rb") as f:
+                current = f.read()
+            if current == _recorded_bytes(record, "old"):
+                with open(p, "w", encoding="utf-8") as f:
+                    f.write(record["new"])
+    elif op == "rename":
+        src, dst = get_safe_path(record["src"]), get_safe_path(record["dst"])
+        if os.path.exists(src) and not os.path.exists(dst):
+            os.rename(src, dst)
+
+
+def revert_journal_op(record: dict) -> None:
+    """冪等地撤銷單筆已套用的檔案操作（rollback 用）。"""
+    op = record["op"]
+    if op == "delete":
+        p = get_safe_path(record["path"])
+        if not os.path.exists(p):
+            _write_bytes(p, _recorded_bytes(record, "content"))
+    elif op == "headline":
+        p = get_safe_path(record["path"])
+        if os.path.exists(p):
+            _write_bytes(p, _recorded_bytes(record, "old"))
+    elif op == "rename":
+        src, dst = get_safe_path(record["src"]), get_safe_path(record["dst"])
+        if os.path.exists(dst) and not os.path.exists(src):
+            os.rename(dst, src)
+
+
+def iter_map_inserts(records: Iterable[dict]) -> Iterable[dict]:
+    return (r for r in records if r["op"] == "map_insert")
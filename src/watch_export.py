@@ -0,0 +1,122 @@
+# src/watch_export.py
+
+import os
+import time
+import threading
+from utils.get_safe_path import get_safe_path
+from utils.logger import Logger
+from conversion_daemon import ConversionDaemon
+
+
+def snapshot_export(export_dir):
+    """匯出資料夾 → {相對路徑: (mtime_ns, size)}；略過隱藏檔與暫存檔（匯出程式寫到一半的檔案）。"""
+    snapshot = {}
+    for root, dirs, files in os.walk(export_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for file in files:
+            if file.startswith(".") or file.endswith((".tmp", "~")):
+                continue
+            full_path = os.path.join(root, file)
+            try:
+                st = os.stat(get_safe_path(full_path))
+            except FileNotFoundError:
+                continue  # 走訪途中被刪除
+            snapshot[os.path.relpath(full_path, export_dir)] = (st.st_mtime_ns, st.st_size)
+    return snapshot
+
+
+def diff_snapshots(before, after):
+    """回傳 (新增或變動的相對路徑, 刪除的相對路徑)。"""
+    changed = [rel for rel, sig in after.items() if before.get(rel) != sig]
+    removed = [rel for rel in before if rel not in after]
+    return changed, removed
+
+
+def watch_export(
+    daemon,
+    log_path=None,
+    verbose=False,
+    interval=1.0,
+    debounce=2.0,
+    max_wait=30.0,
+    stop=None,
+):
+    """
+    監看匯出資料夾：輪詢檔案簽章，新增／變動的檔案累積到沒有新變動 debounce 秒後（或最久 max_wait 秒），
+    整批交給 ConversionDaemon.convert（只跑受影響的步驟，map 與反向連結索引就地更新）。
+    啟動時的既有檔案視為已轉換，只處理之後的變動；匯出資料夾中被刪除的檔案只記錄，不刪除 Vault 內的輸出。
+
+    Args:
+        daemon (ConversionDaemon): 常駐狀態（Vault、匯出資料夾、狀態檔）
+        log_path (str): 監看 log
+        verbose (bool): 是否印出 log
+        interval (float): 輪詢間隔（秒）
+        debounce (float): 最後一次變動後再等多久才處理（秒）
+        max_wait (float): 持續有變動時，第一筆變動最多等多久就處理（秒）
+        stop (threading.Event): 設定後結束監看（未提供則直到 Ctrl+C）
+
+    Returns:
+        int: 處理的批次數
+    """
+    logger = Logger(log_path=log_path, verbose=verbose, title="Export Watch Log")
+    log = logger.log
+    stop = stop or threading.Event()
+
+    previous = snapshot_export(daemon.export_dir)
+    pending = {}  # 相對路徑 → 首次偵測到變動的時間
+    last_change = 0.0
+    batches = 0
+    log(f"👀 監看：{daemon.export_dir}（{len(previous)} 個既有檔案；每 {interval}s 輪詢、靜置 {debounce}s 後處理）")
+    try:
+        while not stop.is_set():
+            now = time.monotonic()
+            current = snapshot_export(daemon.export_dir)
+            changed, removed = diff_snapshots(previous, current)
+            previous = current
+            for rel in changed:
+                pending.setdefault(rel, now)
+            if changed:
+                last_change = now
+            for rel in removed:
+                pending.pop(rel, None)
+                log(f"⚠️ 匯出資料夾中已刪除（Vault 內的輸出保留）：{rel}")
+
+            if pending and (now - last_change >= debounce or now - min(pending.values()) >= max_wait):
+                batch = sorted(pending)
+                pending.clear()
+                batches += 1
+                log(f"\n📥 第 {batches} 批：{len(batch)} 個檔案")
+                try:
+                    result = daemon.convert(batch)
+                except Exception as e:
+                    log(f"❌ 轉換失敗：{type(e).__name__}: {e}")
+                else:
+                    for src, out in result["outputs"].items():
+                        log(f"  ✅ {src} → {out or '（與既有卡片相同，未保留）'}")
+                    log(
+                        f"  ☑️ 未變動 {len(result['unchanged'])}；新增 map 條目 {result['new_entries']}；"
+                        f"改寫連結 {len(result['rewritten'])} 個檔案（{result['ms']} ms）"
+                    )
+                logger.save()
+                continue  # 處理期間可能又有變動：立即重新輪詢
+
+            stop.wait(interval)
+    except KeyboardInterrupt:
+        log("\n🛑 停止監看")
+    if pending:
+        log(f"⚠️ 尚有 {len(pending)} 個變動未處理：{', '.join(sorted(pending))}")
+    logger.save()
+    return batches
+
+
+if __name__ == "__main__":
+    BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    VAULT_PATH = os.path.join(BASE_DIR, "TestData")
+    EXPORT_DIR = os.path.join(BASE_DIR, "Export")
+    LOG_DIR = os.path.join(BASE_DIR, "log")
+
+    watch_export(
+        ConversionDaemon(VAULT_PATH, EXPORT_DIR, LOG_DIR),
+        log_path=os.path.join(LOG_DIR, "watch_export.log"),
+        verbose=True,
+    )
@@ -0,0 +1,32 @@
+# tests/conftest.py
+
+import os
+import sys
+
+import pytest
+
+# 各步驟模組以 src/ 為根匯入（同 main.py）
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+
+def write_files(root, files):
+    """{相對路徑: 內容} → 磁碟檔案（str 以 UTF-8 寫出，bytes 原樣寫出）。"""
+    for rel, content in files.items():
+        path = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content.encode("utf-8") if isinstance(content, str) else content)
+
+
+def read_file(root, rel):
+    with open(os.path.join(root, rel), encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.fixture
+def vault(tmp_path):
+    """空的 Vault 與同層的 log 資料夾：回傳 (vault_path, log_dir)。"""
+    vault_path, log_dir = tmp_path / "vault", tmp_path / "log"
+    vault_path.mkdir()
+    log_dir.mkdir()
+    return str(vault_path), str(log_dir)
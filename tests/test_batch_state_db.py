@@ -0,0 +1,36 @@
+# tests/test_batch_state_db.py
+
+import json
+import os
+
+import main
+
+from conftest import write_files
+
+CARD_A = "Alpha long sentence that is written only to exercise the truncation detector in"
+CARD_B = "Bravo long sentence that is written only to exercise the truncation detector in"
+
+
+def test_vault_state_db_paths_follow_vault_log_dirs():
+    assert main.vault_state_db_paths(["/x/a"], "/s/state.sqlite") == ["/s/state.sqlite"]
+    assert main.vault_state_db_paths(["/x/a", "/y/a", "/x/b"], "/s/state.sqlite") == [
+        "/s/state.a.sqlite", "/s/state.a-2.sqlite", "/s/state.b.sqlite",
+    ]
+    assert main.vault_state_db_paths(["/x/a", "/x/b"], None) == [None, None]
+
+
+def test_batch_with_state_db_keeps_vaults_apart(tmp_path):
+    vault_a, vault_b, log_dir = str(tmp_path / "a"), str(tmp_path / "b"), str(tmp_path / "log")
+    write_files(vault_a, {f"{CARD_A}.md": f"{CARD_A} vault a.\n"})
+    write_files(vault_b, {f"{CARD_B}.md": f"{CARD_B} vault b.\n", "uid_001.md": "Unrelated card at uid one.\n"})
+
+    assert main.main([
+        "run", vault_a, vault_b, "--log-dir", log_dir, "--state-db", str(tmp_path / "state.sqlite"),
+        "--steps", "uid", "--quiet", "--no-undo",
+    ]) == 0
+
+    with open(os.path.join(log_dir, "b", "truncation_map.json"), encoding="utf-8") as f:
+        map_b = json.load(f)
+    assert CARD_B in map_b and CARD_A not in map_b
+    assert os.path.exists(os.path.join(vault_b, "uid_001.md"))
+    assert os.path.exists(tmp_path / "state.a.sqlite") and os.path.exists(tmp_path / "state.b.sqlite")
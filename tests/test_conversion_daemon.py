@@ -0,0 +1,111 @@
+# tests/test_conversion_daemon.py
+
+import json
+import os
+import shutil
+
+import pytest
+
+import main
+from conversion_daemon import ConversionDaemon
+
+from conftest import read_file, write_files
+
+FIRST = "First long sentence that is written only to exercise the truncation detector in"
+SECOND = "Second long sentence that is written only to exercise the truncation detector in"
+THIRD = "Third long sentence that is written only to exercise the truncation detector in"
+CARDS = {
+    f"{FIRST}.md": f"{FIRST} the first run.\n\n- a\n   - b\n",
+    f"{SECOND}.md": f"{SECOND} another card.\n\nSee [[{FIRST}]]\n",
+    "Plain card.md": "Plain card\n\n* x\n  * y\n[link]({}.md)\n".format(FIRST.replace(" ", "%20")),
+}
+
+
+def snapshot(vault_path):
+    files = {}
+    for root, _, names in os.walk(vault_path):
+        for name in names:
+            path = os.path.join(root, name)
+            files[os.path.relpath(path, vault_path)] = read_file(vault_path, os.path.relpath(path, vault_path))
+    return files
+
+
+def load_map(log_dir):
+    with open(os.path.join(log_dir, "truncation_map.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def full_run(vault_path, log_dir, backup_source=None):
+    main.run_vault(vault_path, log_dir, verbose=False, quiet=True, undo=False, backup_source=backup_source)
+
+
+@pytest.fixture
+def converted(tmp_path):
+    """匯出資料夾 + 已由完整 pipeline 匯入轉換的 Vault：回傳 (export_dir, vault_path, log_dir)。"""
+    export_dir, vault_path, log_dir = (str(tmp_path / name) for name in ("export", "vault", "log"))
+    write_files(export_dir, CARDS)
+    full_run(vault_path, log_dir, backup_source=export_dir)
+    return export_dir, vault_path, log_dir
+
+
+def test_new_card_matches_full_run(tmp_path, converted):
+    export_dir, vault_path, log_dir = converted
+    card = f"{THIRD}.md"
+    write_files(export_dir, {card: f"{THIRD} a new card.\n\nlinks [[{SECOND}]]\n"})
+    ref_vault, ref_log = str(tmp_path / "ref"), str(tmp_path / "reflog")
+    shutil.copytree(vault_path, ref_vault)
+    shutil.copytree(log_dir, ref_log)
+
+    result = ConversionDaemon(vault_path, export_dir, log_dir, undo=False).convert([card])
+
+    # 對照：把原始卡片放進 Vault 後跑完整 pipeline
+    shutil.copy(os.path.join(export_dir, card), os.path.join(ref_vault, card))
+    full_run(ref_vault, ref_log)
+    assert result["new_entries"] == 1
+    assert snapshot(vault_path) == snapshot(ref_vault)
+    assert load_map(log_dir) == load_map(ref_log)
+
+
+def test_reexported_card_matches_full_run(tmp_path, converted):
+    export_dir, vault_path, log_dir = converted
+    card = f"{SECOND}.md"
+    write_files(export_dir, {card: f"{SECOND} another card.\n\nSee [[{FIRST}]] edited\n\t- t\n"})
+
+    result = ConversionDaemon(vault_path, export_dir, log_dir, undo=False).convert([card])
+
+    # 對照：由更新後的匯出資料夾完整重新匯入
+    ref_vault, ref_log = str(tmp_path / "ref"), str(tmp_path / "reflog")
+    full_run(ref_vault, ref_log, backup_source=export_dir)
+    assert result["outputs"] == {card: "uid_001.md"}
+    assert snapshot(vault_path) == snapshot(ref_vault)
+    assert load_map(log_dir) == load_map(ref_log)
+
+
+def test_unchanged_card_is_noop(converted):
+    export_dir, vault_path, log_dir = converted
+    card = f"{SECOND}.md"
+    daemon = ConversionDaemon(vault_path, export_dir, log_dir, undo=False)
+    before = snapshot(vault_path)
+    truncation_map = load_map(log_dir)
+
+    result = daemon.convert([card])
+
+    assert result["unchanged"] == [card]
+    assert result["outputs"] == {} and result["rewritten"] == [] and result["new_entries"] == 0
+    assert snapshot(vault_path) == before
+    assert load_map(log_dir) == truncation_map
+
+
+def test_reloads_state_changed_on_disk(converted):
+    export_dir, vault_path, log_dir = converted
+    daemon = ConversionDaemon(vault_path, export_dir, log_dir, undo=False)
+    # 請求之間由外部（例如 pipeline 重跑）更新 truncation_map.json
+    truncation_map = load_map(log_dir)
+    truncation_map[THIRD] = {"uid": "uid_050", "full_sentence": f"{THIRD} written elsewhere."}
+    write_files(log_dir, {"truncation_map.json": json.dumps(truncation_map, indent=2, ensure_ascii=False)})
+    write_files(export_dir, {"Linker.md": f"Linker\n\nsee [[{THIRD}]]\n"})
+
+    daemon.convert(["Linker.md"])
+
+    assert THIRD in daemon.truncation_map
+    assert f"[[uid_050|@{THIRD} written elsewhere.]]" in read_file(vault_path, "Linker.md")
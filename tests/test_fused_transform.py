@@ -0,0 +1,51 @@
+# tests/test_fused_transform.py
+
+import json
+import os
+
+import main
+
+from conftest import write_files
+
+CARDS = {
+    "Yaml card.md": '---\ntitle: "Yaml card"\ntags: ""\n---\nYaml card\n\nSee [other](Nested%20card.md)\n',
+    "Nested card.md": "Nested card\n\n- a\n   - b\n      - c\n   - d\n",
+    "sub/Tabbed.md": "Tabbed\n\n- one\n\t- two\n\t\t- three\n",
+    "sub/Mixed indent.md": "Mixed indent\n\n* x\n  * y\n    * z\n[link](../Yaml%20card.md)\n",
+}
+STEP_LOGS = ("yaml_preprocess.log", "link_conversion.log", "indent_analysis.log", "indent_fix.log")
+
+
+def snapshot(vault_path, log_dir):
+    files = {}
+    for root, _, names in os.walk(vault_path):
+        for name in names:
+            path = os.path.join(root, name)
+            with open(path, encoding="utf-8") as f:
+                files[os.path.relpath(path, vault_path)] = f.read()
+    with open(os.path.join(log_dir, "indent_unit_map.json"), encoding="utf-8") as f:
+        return files, json.load(f)
+
+
+def run(tmp_path, name, fuse):
+    vault_path, log_dir = str(tmp_path / name / "vault"), str(tmp_path / name / "log")
+    write_files(vault_path, CARDS)
+    main.run_vault(vault_path, log_dir, verbose=False, step_ids={"yaml", "links", "indent_analyze", "indent_fix"},
+                   fuse=fuse, undo=False, quiet=True)
+    return vault_path, log_dir
+
+
+def test_fused_pass_matches_sequential_steps(tmp_path):
+    sequential = snapshot(*run(tmp_path, "sequential", fuse=False))
+    fused = snapshot(*run(tmp_path, "fused", fuse=True))
+    assert fused == sequential
+    assert sequential[0] != CARDS  # 確實有改寫
+
+
+def test_default_run_writes_per_step_logs(tmp_path):
+    _, log_dir = run(tmp_path, "default", fuse=False)
+    assert all(os.path.exists(os.path.join(log_dir, name)) for name in STEP_LOGS)
+    vault_path, log_dir = str(tmp_path / "cli" / "vault"), str(tmp_path / "cli" / "log")
+    write_files(vault_path, CARDS)
+    assert main.main(["run", vault_path, "--log-dir", log_dir, "--steps", "2-5", "--quiet", "--no-undo"]) == 0
+    assert all(os.path.exists(os.path.join(log_dir, name)) for name in STEP_LOGS)
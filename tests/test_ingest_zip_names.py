@@ -0,0 +1,60 @@
+# tests/test_ingest_zip_names.py
+
+import os
+import zipfile
+
+from ingest_heptabase_backup import ingest_heptabase_backup, member_name
+
+from conftest import write_files
+
+CARDS = {
+    "卡片/記憶與城市.md": "記憶與城市\n\n- 第一點\n",
+    "卡片/Plain card.md": "Plain card\n\n[[記憶與城市]]\n",
+}
+
+
+def write_unflagged_zip(zip_path, files):
+    """以 UTF-8 寫入檔名但清掉 0x800 旗標（Info-ZIP、Windows 檔案總管的寫法）。"""
+    with zipfile.ZipFile(zip_path, "w") as zf:
+        for name, content in files.items():
+            zf.writestr(name, content)
+    with open(zip_path, "rb") as f:
+        data = bytearray(f.read())
+    for signature, flag_offset in ((b"PK\x03\x04", 6), (b"PK\x01\x02", 8)):
+        pos = data.find(signature)
+        while pos != -1:
+            data[pos + flag_offset + 1] &= ~0x08 & 0xFF  # 旗標為 little-endian：0x800 在高位元組
+            pos = data.find(signature, pos + 4)
+    with open(zip_path, "wb") as f:
+        f.write(data)
+
+
+def vault_files(root):
+    result = {}
+    for dirpath, _, files in os.walk(root):
+        for file in files:
+            path = os.path.join(dirpath, file)
+            with open(path, "rb") as f:
+                result[os.path.relpath(path, root)] = f.read()
+    return result
+
+
+def test_member_name_restores_utf8_without_flag(tmp_path):
+    zip_path = str(tmp_path / "backup.zip")
+    write_unflagged_zip(zip_path, CARDS)
+    with zipfile.ZipFile(zip_path) as zf:
+        infos = zf.infolist()
+    assert all(not info.flag_bits & 0x800 for info in infos)
+    assert sorted(member_name(info) for info in infos) == sorted(CARDS)
+
+
+def test_unflagged_zip_ingests_like_folder(tmp_path):
+    zip_path, folder = str(tmp_path / "backup.zip"), str(tmp_path / "backup")
+    write_unflagged_zip(zip_path, CARDS)
+    write_files(folder, CARDS)
+
+    ingest_heptabase_backup(zip_path, str(tmp_path / "from_zip"))
+    ingest_heptabase_backup(folder, str(tmp_path / "from_folder"))
+
+    assert vault_files(str(tmp_path / "from_zip")) == vault_files(str(tmp_path / "from_folder"))
+    assert os.path.exists(tmp_path / "from_zip" / "卡片" / "記憶與城市.md")
@@ -0,0 +1,79 @@
+# tests/test_journal_rollback.py
+
+import json
+import os
+
+import pytest
+
+import build_uid_map_for_truncated_titles as uid_step
+from utils.logger import Logger
+from utils.write_ahead_journal import WriteAheadJournal
+
+TITLE = "First long sentence that is written only to exercise the truncation detector in"
+# 非 UTF-8 位元組 + CRLF：以文字模式讀回再寫出就無法還原
+RAW_BODY = b"\r\n\r\nbody \xff\xfe caf\xe9\r\nlast line\r\n"
+
+
+class Crash(Exception):
+    pass
+
+
+def write_bytes(root, files):
+    for rel, data in files.items():
+        path = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+def snapshot(root):
+    files = {}
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            with open(os.path.join(dirpath, name), "rb") as f:
+                files[os.path.relpath(os.path.join(dirpath, name), root)] = f.read()
+    return files
+
+
+def crash_then_rollback(monkeypatch, vault_path, log_dir):
+    """套用完所有檔案操作、日誌 commit 前中斷，再依日誌 rollback。"""
+    map_path = os.path.join(log_dir, "truncation_map.json")
+
+    def crash(self):
+        raise Crash()
+
+    with monkeypatch.context() as m:
+        m.setattr(WriteAheadJournal, "commit", crash)
+        with pytest.raises(Crash):
+            uid_step.build_uid_map_for_truncated_titles(vault_path, map_path, os.path.join(log_dir, "t.log"))
+    journal = WriteAheadJournal(f"{map_path}.journal")
+    logger = Logger(log_path=os.path.join(log_dir, "recover.log"), verbose=False, title=None)
+    assert uid_step.recover_from_journal(journal, map_path, "rollback", logger)
+    logger.save()
+
+
+def test_rollback_restores_headline_edit_bytes(monkeypatch, vault):
+    vault_path, log_dir = vault
+    files = {
+        f"{TITLE}.md": f"{TITLE} the first run.".encode() + RAW_BODY,
+        "uid_001.md": f"{TITLE} the first run.".encode() + b"\r\n\r\ndup \x80\r\n",  # 首句被序號化 → headline
+    }
+    write_bytes(vault_path, files)
+    write_bytes(log_dir, {"truncation_map.json": b"{}"})
+
+    crash_then_rollback(monkeypatch, vault_path, log_dir)
+
+    assert snapshot(vault_path) == files
+
+
+def test_rollback_restores_deleted_duplicate_bytes(monkeypatch, vault):
+    vault_path, log_dir = vault
+    content = f"{TITLE} the first run.".encode() + RAW_BODY
+    files = {f"{TITLE}.md": content, "uid_001.md": content}  # 與 map 指向的 uid_001.md 完全相同 → delete
+    write_bytes(vault_path, files)
+    truncation_map = {TITLE: {"uid": "uid_001", "full_sentence": f"{TITLE} the first run."}}
+    write_bytes(log_dir, {"truncation_map.json": json.dumps(truncation_map).encode()})
+
+    crash_then_rollback(monkeypatch, vault_path, log_dir)
+
+    assert snapshot(vault_path) == files
@@ -0,0 +1,70 @@
+# tests/test_rename_planner.py
+
+import pytest
+
+from utils.memory_vault_fs import MemoryVaultFS
+from utils.rename_planner import apply_renames, order_renames
+
+ROOT = "/vault"
+
+
+def run_plan(names, moves):
+    """每個檔案的內容即原檔名；套用 moves 後回傳 {檔名: 內容}。"""
+    fs = MemoryVaultFS.from_files({name: name for name in names}, root=ROOT)
+    full = {f"{ROOT}/{src}": f"{ROOT}/{dst}" for src, dst in moves.items()}
+    steps = order_renames(full, lambda src: src + ".tmp")
+    apply_renames(steps, rename_fn=fs.rename, exists_fn=fs.exists)
+    return {rel: data.decode("utf-8") for rel, data in fs.to_dict().items()}, steps
+
+
+def expected(names, moves):
+    return {moves.get(name, name): name for name in names}
+
+
+@pytest.mark.parametrize(
+    "names, moves",
+    [
+        # 鏈：c 先搬到空位 d，b 才能搬進 c
+        (["a.md", "b.md", "c.md"], {"a.md": "b.md", "b.md": "c.md", "c.md": "d.md"}),
+        # 順序打亂的鏈（起點不在鏈頭）
+        (["a.md", "b.md", "c.md"], {"b.md": "c.md", "c.md": "d.md", "a.md": "b.md"}),
+        # 兩兩互換
+        (["a.md", "b.md", "keep.md"], {"a.md": "b.md", "b.md": "a.md"}),
+        # 三元環
+        (["a.md", "b.md", "c.md"], {"a.md": "b.md", "b.md": "c.md", "c.md": "a.md"}),
+        # 同一份規劃混合：兩條鏈、一個二元環、一個三元環、一個不動
+        (
+            ["p.md", "q.md", "x.md", "y.md", "z.md", "u.md", "v.md", "w.md", "s.md"],
+            {
+                "u.md": "v.md", "v.md": "w.md", "w.md": "u.md",
+                "p.md": "q.md", "q.md": "r.md",
+                "x.md": "y.md", "y.md": "x.md",
+                "z.md": "new/z.md",
+                "s.md": "s.md",
+            },
+        ),
+    ],
+    ids=["chain", "chain-unordered", "2-cycle", "3-cycle", "mixed"],
+)
+def test_renames_land_on_planned_names(names, moves):
+    files, steps = run_plan(names, moves)
+
+    assert files == expected(names, moves)
+    assert not any(name.endswith(".tmp") for name in files)
+
+
+def test_cycles_borrow_one_temp_each():
+    moves = {"a.md": "b.md", "b.md": "a.md", "c.md": "d.md", "d.md": "e.md", "e.md": "c.md"}
+    _, steps = run_plan(list(moves), moves)
+
+    temps = [dst for _, dst in steps if dst.endswith(".tmp")]
+    assert len(temps) == 2
+    assert len(steps) == len(moves) + 2
+
+
+def test_occupied_target_is_never_overwritten():
+    fs = MemoryVaultFS.from_files({"a.md": "a", "b.md": "b"}, root=ROOT)
+
+    with pytest.raises(FileExistsError):
+        apply_renames([(f"{ROOT}/a.md", f"{ROOT}/b.md")], rename_fn=fs.rename, exists_fn=fs.exists)
+    assert fs.to_dict() == {"a.md": b"a", "b.md": b"b"}
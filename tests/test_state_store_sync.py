@@ -0,0 +1,57 @@
+# tests/test_state_store_sync.py
+
+import json
+import os
+
+import pytest
+
+from build_uid_map_for_truncated_titles import build_uid_map_for_truncated_titles
+from utils.state_store import StateStore
+
+from conftest import read_file, write_files
+
+TITLE = "First long sentence that is written only to exercise the truncation detector in"
+ENTRY = {"uid": "uid_001", "full_sentence": f"{TITLE} the first run."}
+
+
+class Crash(Exception):
+    pass
+
+
+def test_replace_keeps_old_rows_when_interrupted(tmp_path):
+    store = StateStore(str(tmp_path / "state.db"))
+    store.upsert_truncation_entries([("a", "uid_001", "A."), ("b", "uid_002", "B.")])
+
+    def items():
+        yield ("c", "uid_003", "C.")
+        raise Crash()
+
+    with pytest.raises(Crash):
+        store.replace_truncation_entries(items())
+
+    assert list(store.iter_truncation_entries()) == [("a", "uid_001", "A."), ("b", "uid_002", "B.")]
+    store.replace_truncation_entries([("c", "uid_003", "C.")])
+    assert list(store.iter_truncation_entries()) == [("c", "uid_003", "C.")]
+    store.close()
+
+
+def test_drifted_json_is_logged_and_store_wins(vault):
+    vault_path, log_dir = vault
+    map_path = os.path.join(log_dir, "truncation_map.json")
+    db_path = os.path.join(log_dir, "state.db")
+    store = StateStore(db_path)
+    store.upsert_truncation_entries([(TITLE, ENTRY["uid"], ENTRY["full_sentence"])])
+    store.close()
+    write_files(log_dir, {"truncation_map.json": "{}"})  # JSON 被外部清空 → 與 state.db 不一致
+    write_files(vault_path, {"uid_001.md": f"{ENTRY['full_sentence']}\n\nbody\n"})
+
+    build_uid_map_for_truncated_titles(
+        vault_path, map_path, os.path.join(log_dir, "truncation_detect.log"),
+        delta_path=os.path.join(log_dir, "truncation_delta.json"), state_db_path=db_path,
+    )
+
+    assert "[store-json-drift]" in read_file(log_dir, "truncation_detect.log")
+    assert "only_store=1, only_json=0, differing=0" in read_file(log_dir, "truncation_detect.log")
+    # delta 以 state.db 為執行前狀態：既有條目不算新增
+    assert json.loads(read_file(log_dir, "truncation_delta.json"))["added"] == {}
+    assert json.loads(read_file(log_dir, "truncation_map.json")) == {TITLE: ENTRY}
@@ -0,0 +1,27 @@
+# tests/test_title_trie.py
+
+from utils.title_trie import TitleTrie
+
+
+def build(keys):
+    trie = TitleTrie()
+    for key in keys:
+        trie.insert(key, key)
+    return trie
+
+
+def test_dup_suffix_with_many_siblings_stays_ambiguous():
+    keys = [f"k{i}" for i in range(60)] + ["k0 (2)", "k1 (2)"]
+    trie = build(keys)
+
+    key, candidates = trie.resolve("k (2)")
+
+    assert key is None
+    assert sorted(candidates) == ["k0 (2)", "k1 (2)"]
+
+
+def test_dup_suffix_with_many_siblings_unique_hit():
+    keys = [f"k{i}" for i in range(60)] + ["k3 (2)"]
+    trie = build(keys)
+
+    assert trie.resolve("k (2)") == ("k3 (2)", [])
@@ -0,0 +1,84 @@
+# tests/test_truncation_delta.py
+
+import json
+import os
+
+from build_uid_map_for_truncated_titles import build_uid_map_for_truncated_titles
+from rewrite_links_with_uid_alias import rewrite_links_with_uid_alias
+
+from conftest import read_file, write_files
+
+FIRST = "First long sentence that is written only to exercise the truncation detector in"
+SECOND = "Second long sentence that is written only to exercise the truncation detector in"
+
+
+def truncated_card(title):
+    return {f"{title}.md": f"{title} the first run.\n\nbody\n"}
+
+
+def run_uid(vault_path, log_dir):
+    build_uid_map_for_truncated_titles(
+        vault_path,
+        os.path.join(log_dir, "truncation_map.json"),
+        os.path.join(log_dir, "truncation_detect.log"),
+        delta_path=os.path.join(log_dir, "truncation_delta.json"),
+    )
+
+
+def run_uid_links(vault_path, log_dir):
+    return rewrite_links_with_uid_alias(
+        vault_path,
+        os.path.join(log_dir, "truncation_map.json"),
+        os.path.join(log_dir, "uid_link_rewrite.log"),
+        backlink_index_path=os.path.join(log_dir, "backlink_index.json"),
+        delta_path=os.path.join(log_dir, "truncation_delta.json"),
+    )
+
+
+def load_map(log_dir):
+    with open(os.path.join(log_dir, "truncation_map.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_step6_twice_before_step7_keeps_first_delta(vault):
+    vault_path, log_dir = vault
+    write_files(vault_path, {"refs.md": f"[[{FIRST}]] and [[{SECOND}]]\n", **truncated_card(FIRST)})
+    write_files(log_dir, {"truncation_map.json": "{}"})
+    run_uid_links(vault_path, log_dir)  # 先建立反向連結索引：之後 refs.md 未變動，只會依 delta 處理
+    run_uid(vault_path, log_dir)
+    write_files(vault_path, truncated_card(SECOND))
+    run_uid(vault_path, log_dir)
+
+    run_uid_links(vault_path, log_dir)
+
+    truncation_map = load_map(log_dir)
+    refs = read_file(vault_path, "refs.md")
+    assert f"[[{truncation_map[FIRST]['uid']}|@" in refs
+    assert f"[[{truncation_map[SECOND]['uid']}|@" in refs
+    assert not os.path.exists(os.path.join(log_dir, "truncation_delta.json"))
+
+
+def test_stale_delta_falls_back_to_full_pass(vault):
+    vault_path, log_dir = vault
+    write_files(vault_path, {"refs.md": f"[[{FIRST}]]\n", **truncated_card(FIRST)})
+    write_files(log_dir, {"truncation_map.json": "{}"})
+    run_uid_links(vault_path, log_dir)
+    run_uid(vault_path, log_dir)
+    # step 6 之後 delta 被清空：若只看 delta 會漏掉；map sha1 不符 → 全量處理
+    with open(os.path.join(log_dir, "truncation_delta.json"), "w", encoding="utf-8") as f:
+        json.dump({"added": {}, "changed": {}, "retargeted": {}, "map_sha1": "0" * 40}, f)
+
+    run_uid_links(vault_path, log_dir)
+
+    assert f"[[{load_map(log_dir)[FIRST]['uid']}|@" in read_file(vault_path, "refs.md")
+
+
+def test_delta_survives_until_step7_succeeds(vault):
+    vault_path, log_dir = vault
+    write_files(vault_path, {"refs.md": f"[[{FIRST}]]\n", **truncated_card(FIRST)})
+    run_uid(vault_path, log_dir)
+    assert os.path.exists(os.path.join(log_dir, "truncation_delta.json"))
+    run_uid(vault_path, log_dir)  # 沒有新條目，也不能覆蓋掉尚未處理的 added
+
+    with open(os.path.join(log_dir, "truncation_delta.json"), encoding="utf-8") as f:
+        assert FIRST in json.load(f)["added"]
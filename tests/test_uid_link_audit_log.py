@@ -0,0 +1,60 @@
+# tests/test_uid_link_audit_log.py
+
+import json
+import os
+
+from build_uid_map_for_truncated_titles import build_uid_map_for_truncated_titles
+from rewrite_links_with_uid_alias import rewrite_links_with_uid_alias
+
+from conftest import read_file, write_files
+
+PREFIX = "Shared long prefix that is written only to exercise the trie"
+FIRST = "First long sentence that is written only to exercise the truncation detector in"
+
+
+def run_uid_links(vault_path, log_dir, **kwargs):
+    rewrite_links_with_uid_alias(
+        vault_path,
+        os.path.join(log_dir, "truncation_map.json"),
+        os.path.join(log_dir, "uid_link_rewrite.log"),
+        backlink_index_path=os.path.join(log_dir, "backlink_index.json"),
+        **kwargs,
+    )
+    return read_file(log_dir, "uid_link_rewrite.log")
+
+
+def test_ambiguous_links_are_logged_with_locations(vault):
+    vault_path, log_dir = vault
+    truncation_map = {
+        f"{PREFIX} alpha": {"uid": "uid_001", "full_sentence": f"{PREFIX} alpha."},
+        f"{PREFIX} beta": {"uid": "uid_002", "full_sentence": f"{PREFIX} beta."},
+    }
+    write_files(log_dir, {"truncation_map.json": json.dumps(truncation_map)})
+    write_files(vault_path, {
+        "refs.md": f"Refs\n\nintro\nsee [[{PREFIX}]] and\nagain [[{PREFIX}]]\n",
+        "sub/other.md": f"[[{PREFIX}]]\n",
+    })
+
+    log = run_uid_links(vault_path, log_dir, prefix_match=True)
+
+    assert f"❓ [[{PREFIX}]]" in log
+    assert "📍 refs.md：第 4、5 行" in log
+    assert f"📍 {os.path.join('sub', 'other.md')}：第 1 行" in log
+    assert read_file(vault_path, "refs.md").count(f"[[{PREFIX}]]") == 2  # 歧義不改寫
+
+
+def test_delta_run_logs_who_links_to_new_entries(vault):
+    vault_path, log_dir = vault
+    write_files(vault_path, {"refs.md": f"[[{FIRST}]]\n", f"{FIRST}.md": f"{FIRST} the first run.\n\nbody\n"})
+    write_files(log_dir, {"truncation_map.json": "{}"})
+    run_uid_links(vault_path, log_dir)
+    build_uid_map_for_truncated_titles(
+        vault_path,
+        os.path.join(log_dir, "truncation_map.json"),
+        os.path.join(log_dir, "truncation_detect.log"),
+        delta_path=os.path.join(log_dir, "truncation_delta.json"),
+    )
+
+    log = run_uid_links(vault_path, log_dir, delta_path=os.path.join(log_dir, "truncation_delta.json"))
+
+    assert f"[added] uid_001（{FIRST}）← 1 檔：refs.md" in log
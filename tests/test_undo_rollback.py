@@ -0,0 +1,171 @@
+# tests/test_undo_rollback.py
+
+import os
+
+import pytest
+
+import utils.undo_journal as undo_journal
+from rollback_pipeline_run import rollback_pipeline_run
+from utils.undo_journal import UndoConflict, UndoJournal, list_runs, revert_run
+from utils.vault_fs import VaultFS
+
+from conftest import write_files
+
+CARDS = {
+    "a.md": "Alpha\n\nbody a\n",
+    "b.md": "Beta\r\n\r\nbody b \xe9\r\n",
+    "old/c.md": "Gamma\n",
+}
+
+
+def snapshot(*roots):
+    """{路徑: 位元組}（資料夾記為 None）；略過 undo 資料夾與 log。"""
+    out = {}
+    for root in roots:
+        for dirpath, dirs, files in os.walk(root):
+            dirs[:] = [d for d in dirs if d != "undo"]
+            for d in dirs:
+                out[os.path.join(dirpath, d)] = None
+            for name in files:
+                if name.endswith(".log"):
+                    continue
+                with open(os.path.join(dirpath, name), "rb") as f:
+                    out[os.path.join(dirpath, name)] = f.read()
+    return out
+
+
+def start_run(vault_path, log_dir, state_paths=()):
+    undo = UndoJournal.start(os.path.join(log_dir, "undo"), vault_path, state_paths=state_paths)
+    return VaultFS(vault_path, undo=undo)
+
+
+def finish_run(fs):
+    fs.sync()
+    fs.undo.finish()
+
+
+def rollback(vault_path, log_dir, **kwargs):
+    return rollback_pipeline_run(
+        vault_path, os.path.join(log_dir, "undo"), os.path.join(log_dir, "rollback.log"), **kwargs
+    )
+
+
+def edit_run(vault_path, log_dir):
+    """一次涵蓋各種操作的執行：mkdir、新建、改名、改寫、刪除。"""
+    fs = start_run(vault_path, log_dir)
+    fs.makedirs(os.path.join(vault_path, "new", "deeper"))
+    fs.write_text(os.path.join(vault_path, "new", "deeper", "created.md"), "Created\n")
+    fs.rename(os.path.join(vault_path, "a.md"), os.path.join(vault_path, "new", "a renamed.md"))
+    fs.write_text(os.path.join(vault_path, "b.md"), "Beta (2)\n\nbody b\n")
+    fs.remove(os.path.join(vault_path, "old", "c.md"))
+    finish_run(fs)
+
+
+def test_rollback_reverts_rename_mkdir_create_and_delete(vault):
+    vault_path, log_dir = vault
+    write_files(vault_path, CARDS)
+    before = snapshot(vault_path)
+
+    edit_run(vault_path, log_dir)
+    assert snapshot(vault_path) != before
+
+    assert len(rollback(vault_path, log_dir)) == 1
+    assert snapshot(vault_path) == before
+    assert list_runs(os.path.join(log_dir, "undo")) == []
+
+
+def test_rollback_restores_state_files(vault):
+    vault_path, log_dir = vault
+    write_files(vault_path, CARDS)
+    existing = os.path.join(log_dir, "truncation_map.json")
+    created = os.path.join(log_dir, "backlink_index.json")
+    write_files(log_dir, {"truncation_map.json": '{\n  "Alpha": "uid_001"\n}\n'})
+    before = snapshot(vault_path, log_dir)
+
+    fs = start_run(vault_path, log_dir, state_paths=[existing, created])
+    fs.write_state(existing, '{\n  "Alpha": "uid_001",\n  "Beta": "uid_002"\n}\n')
+    fs.write_state(created, "{}\n")
+    fs.write_text(os.path.join(vault_path, "a.md"), "Alpha\n\nedited\n")
+    finish_run(fs)
+
+    rollback(vault_path, log_dir)
+
+    assert snapshot(vault_path, log_dir) == before
+    assert not os.path.exists(created)
+
+
+def test_preflight_conflict_aborts_before_touching_files(vault):
+    vault_path, log_dir = vault
+    write_files(vault_path, CARDS)
+    before = snapshot(vault_path)
+
+    fs = start_run(vault_path, log_dir)
+    fs.write_text(os.path.join(vault_path, "a.md"), "Alpha\n\nrun edit\n")
+    fs.write_text(os.path.join(vault_path, "b.md"), "Beta\n\nrun edit\n")
+    finish_run(fs)
+    write_files(vault_path, {"a.md": "Alpha\n\nuser edit after the run\n"})
+    after_user_edit = snapshot(vault_path)
+
+    with pytest.raises(UndoConflict):
+        revert_run(os.path.join(log_dir, "undo", list_runs(os.path.join(log_dir, "undo"))[0]), vault_path)
+    assert rollback(vault_path, log_dir) == []
+    assert snapshot(vault_path) == after_user_edit  # b.md 也沒有被還原
+
+    # 反向差異即使 force 也不套用到被改過的內容
+    assert rollback(vault_path, log_dir, force=True) == []
+
+    write_files(vault_path, {"a.md": "Alpha\n\nrun edit\n"})  # 排除衝突後重新執行
+    assert len(rollback(vault_path, log_dir)) == 1
+    assert snapshot(vault_path) == before
+
+
+def test_interrupted_rollback_resumes(monkeypatch, vault):
+    vault_path, log_dir = vault
+    write_files(vault_path, CARDS)
+    before = snapshot(vault_path)
+    edit_run(vault_path, log_dir)
+
+    real_revert = undo_journal._revert_op
+    calls = {"n": 0}
+
+    def crash_after_two(*args, **kwargs):
+        calls["n"] += 1
+        if calls["n"] > 2:
+            raise KeyboardInterrupt("crash")
+        real_revert(*args, **kwargs)
+
+    with monkeypatch.context() as m:
+        m.setattr(undo_journal, "_revert_op", crash_after_two)
+        with pytest.raises(KeyboardInterrupt):
+            rollback(vault_path, log_dir)
+    assert snapshot(vault_path) != before
+
+    assert len(rollback(vault_path, log_dir)) == 1
+    assert snapshot(vault_path) == before
+
+
+def test_rollback_several_runs(vault):
+    vault_path, log_dir = vault
+    write_files(vault_path, CARDS)
+    before = snapshot(vault_path)
+
+    fs = start_run(vault_path, log_dir)
+    fs.write_text(os.path.join(vault_path, "a.md"), "Alpha\n\nfirst run\n")
+    finish_run(fs)
+    after_first = snapshot(vault_path)
+    fs = start_run(vault_path, log_dir)
+    fs.write_text(os.path.join(vault_path, "a.md"), "Alpha\n\nsecond run\n")
+    fs.rename(os.path.join(vault_path, "b.md"), os.path.join(vault_path, "uid_001.md"))
+    finish_run(fs)
+    fs = start_run(vault_path, log_dir)
+    fs.write_text(os.path.join(vault_path, "old", "c.md"), "Gamma\n\nthird run\n")
+    finish_run(fs)
+    undo_dir = os.path.join(log_dir, "undo")
+    assert len(list_runs(undo_dir)) == 3
+
+    assert len(rollback(vault_path, log_dir, runs=2)) == 2
+    assert snapshot(vault_path) == after_first
+    assert len(list_runs(undo_dir)) == 1
+
+    rollback(vault_path, log_dir, runs=5)
+    assert snapshot(vault_path) == before
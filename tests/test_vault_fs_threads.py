@@ -0,0 +1,35 @@
+# tests/test_vault_fs_threads.py
+
+import os
+import stat
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.vault_fs import VaultFS
+
+
+def test_concurrent_writes_and_renames_keep_listing_consistent(tmp_path):
+    fs = VaultFS(str(tmp_path))
+
+    def worker(n):
+        for i in range(50):
+            path = tmp_path / f"w{n}_{i}.md"
+            fs.write_text(str(path), f"card {n} {i}\n")
+            fs.rename(str(path), str(tmp_path / f"r{n}_{i}.md"))
+            # 同時走訪：不應因其他執行緒改動列舉而 RuntimeError
+            sum(1 for _ in fs.iter_md_files())
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(worker, range(4)))
+
+    fs.invalidate()
+    expected = {f"r{n}_{i}.md" for n in range(4) for i in range(50)}
+    assert set(fs.listdir(str(tmp_path))) == expected == set(os.listdir(tmp_path))
+
+
+def test_new_files_follow_process_umask(tmp_path):
+    fs = VaultFS(str(tmp_path))
+    path = str(tmp_path / "new.md")
+    fs.write_text(path, "x\n")
+    mask = os.umask(0)
+    os.umask(mask)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o666 & ~mask